@@ -1,18 +1,37 @@
 import os
+import io
+import atexit
+import math
+import sqlite3
+import sys
+import mmap
+import struct
 import random
 import json
 import unicodedata
 import re
 import uuid
+import bisect
+import hashlib
+import threading
+import time
+import queue
+from contextlib import contextmanager
+from collections import namedtuple
 from datetime import datetime, timedelta
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, Response, g, has_app_context, render_template, request, redirect, url_for, session, flash, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_mail import Mail, Message
-from itsdangerous import URLSafeTimedSerializer
+from flask_sqlalchemy.session import Session as FlaskSession
+import click
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
+from sqlalchemy import func, case, tuple_, select, update, insert, literal_column
+from sqlalchemy import event as sa_event, table as sa_table, column as sa_column, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
+from sqlalchemy.sql import Select
+from sqlalchemy.orm.attributes import set_committed_value
 
 
 
@@ -20,27 +39,99 @@ from sqlalchemy.orm import joinedload
 # ----------------------
 # App config
 # ----------------------
+# As rotas ficam registradas neste app de módulo (os templates usam os nomes
+# de endpoint sem prefixo); create_app() faz a configuração e liga as
+# extensões. E-mail e serializer só são criados no primeiro uso.
 app = Flask(__name__)
-app.config["SECRET_KEY"] = os.environ.get("PERFUT_SECRET", "dev-secret-change-me")
-db_url = os.getenv("DATABASE_URL", "sqlite:///perfut.db")
 
-if db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
 
-app.config["SQLALCHEMY_DATABASE_URI"] = db_url
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
+class RoutingSession(FlaskSession):
+    """Manda os SELECTs para a réplica enquanto g.read_replica estiver ligado.
 
-# Email
-app.config["MAIL_SERVER"] = "smtp.gmail.com"
-app.config["MAIL_PORT"] = 587
-app.config["MAIL_USE_TLS"] = True
-app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USER")
-app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASS")
-app.config["MAIL_DEFAULT_SENDER"] = os.environ.get("MAIL_USER")
-mail = Mail(app)
+    Escritas (flush, INSERT/UPDATE/DELETE) e tabelas de outros binds seguem o
+    roteamento normal do Flask-SQLAlchemy.
+    """
 
-s = URLSafeTimedSerializer(app.config["SECRET_KEY"])
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if (
+            bind is None and not self._flushing and isinstance(clause, Select)
+            and has_app_context() and g.get("read_replica")
+            and engine is self._db.engines.get(None)
+        ):
+            return self._db.engines["replica"]
+        return engine
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+_mail = None
+_serializer = None
+
+
+def create_app():
+    """Configura o app e inicializa o banco. Chamadas repetidas devolvem o mesmo app."""
+    if "sqlalchemy" in app.extensions:
+        return app
+
+    app.config["SECRET_KEY"] = os.environ.get("PERFUT_SECRET", "dev-secret-change-me")
+    db_url = os.getenv("DATABASE_URL", "sqlite:///perfut.db")
+
+    if db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Rollups de analytics podem morar em outro banco para não disputar com o jogo
+    analytics_url = os.getenv("ANALYTICS_DATABASE_URL", db_url)
+    if analytics_url.startswith("postgres://"):
+        analytics_url = analytics_url.replace("postgres://", "postgresql://", 1)
+    app.config["SQLALCHEMY_BINDS"] = {"analytics": analytics_url}
+
+    # Réplica de leitura opcional para rankings, histórico e exportações
+    replica_url = os.getenv("REPLICA_DATABASE_URL")
+    if replica_url:
+        if replica_url.startswith("postgres://"):
+            replica_url = replica_url.replace("postgres://", "postgresql://", 1)
+        app.config["SQLALCHEMY_BINDS"]["replica"] = replica_url
+
+    # Limite de requisições: sem caminho, cada worker guarda os baldes em memória
+    app.config["RATE_LIMIT_DB"] = os.environ.get("PERFUT_RATELIMIT_DB")
+
+    # Proxies na frente do app (o roteador da plataforma é um): só os valores de
+    # X-Forwarded-For acrescentados por eles valem, e remote_addr vira o IP do cliente
+    proxy_hops = int(os.environ.get("PERFUT_PROXY_HOPS", "1"))
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+
+    # Email
+    app.config["MAIL_SERVER"] = "smtp.gmail.com"
+    app.config["MAIL_PORT"] = 587
+    app.config["MAIL_USE_TLS"] = True
+    app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USER")
+    app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASS")
+    app.config["MAIL_DEFAULT_SENDER"] = os.environ.get("MAIL_USER")
+
+    db.init_app(app)
+    return app
+
+
+def send_mail(**kwargs):
+    """Envia e-mail; o Flask-Mail só é importado e iniciado no primeiro envio."""
+    global _mail
+    from flask_mail import Mail, Message
+    if _mail is None:
+        _mail = Mail(app)
+    _mail.send(Message(**kwargs))
+
+
+def get_serializer():
+    global _serializer
+    if _serializer is None:
+        from itsdangerous import URLSafeTimedSerializer
+        _serializer = URLSafeTimedSerializer(app.config["SECRET_KEY"])
+    return _serializer
 
 # ----------------------
 # Models
@@ -68,6 +159,25 @@ class User(db.Model):
 
 
 
+class CoinLedger(db.Model):
+    __tablename__ = "coin_ledger"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    delta = db.Column(db.Integer, nullable=False)            # negativo = gasto
+    reason = db.Column(db.String(40), nullable=False)
+    balance_after = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class CoinSnapshot(db.Model):
+    __tablename__ = "coin_snapshots"
+    # Saldo consolidado até ledger_id; o ledger antigo é apagado na compactação
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    balance = db.Column(db.Integer, nullable=False)
+    ledger_id = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
 class Card(db.Model):
     __tablename__ = "cards"
     id = db.Column(db.Integer, primary_key=True)
@@ -76,12 +186,93 @@ class Card(db.Model):
     answer = db.Column(db.String(120), nullable=False)
     hints_json = db.Column(db.Text, nullable=False)
     difficulty = db.Column(db.Integer, default=1)
+    answer_norm = db.Column(db.String(120))   # normalize(answer), preenchido ao salvar
+    aliases_json = db.Column(db.Text)         # apelidos já normalizados
 
     @property
     def hints(self):
         return json.loads(self.hints_json)
 
+    @validates("answer")
+    def _normalize_answer(self, key, value):
+        self.answer_norm = normalize(value)
+        return value
+
+    @property
+    def aliases(self):
+        return json.loads(self.aliases_json) if self.aliases_json else []
+
+    @aliases.setter
+    def aliases(self, values):
+        norm = {normalize(v) for v in values} - {"", self.answer_norm}
+        self.aliases_json = json.dumps(sorted(norm), ensure_ascii=False) if norm else None
+
+    @property
+    def accepted_answers(self):
+        """Resposta oficial e apelidos, todos normalizados."""
+        return [self.answer_norm or normalize(self.answer)] + self.aliases
+
+
+
+
+class CardStat(db.Model):
+    __tablename__ = "card_stats"
+    card_id = db.Column(db.Integer, db.ForeignKey("cards.id"), primary_key=True)
+    plays = db.Column(db.Integer, nullable=False, default=0)
+    solves = db.Column(db.Integer, nullable=False, default=0)
+    hints_total = db.Column(db.Integer, nullable=False, default=0)
+    solve_seconds_total = db.Column(db.Integer, nullable=False, default=0)
 
+    @property
+    def solve_rate(self):
+        return self.solves / self.plays if self.plays else 0.0
+
+    @property
+    def mean_solve_seconds(self):
+        return self.solve_seconds_total / self.solves if self.solves else None
+
+
+class UserThemeStat(db.Model):
+    __tablename__ = "user_theme_stats"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    theme = db.Column(db.String(50), primary_key=True)
+    rounds = db.Column(db.Integer, nullable=False, default=0)
+    solves = db.Column(db.Integer, nullable=False, default=0)
+    hints_total = db.Column(db.Integer, nullable=False, default=0)
+    points_total = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def accuracy(self):
+        return self.solves / self.rounds if self.rounds else 0.0
+
+    @property
+    def mean_hints(self):
+        return self.hints_total / self.rounds if self.rounds else 0.0
+
+
+class UserDailyScore(db.Model):
+    __tablename__ = "user_daily_scores"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    score = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.Index("ix_user_daily_scores_day", "day", "user_id", "score"),)
+
+
+class UserSeenCards(db.Model):
+    """Filtro de Bloom das cartas que o usuário já viu em um tema."""
+    __tablename__ = "user_seen_cards"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    theme = db.Column(db.String(50), primary_key=True)
+    bits = db.Column(db.LargeBinary, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ReplicaHeartbeat(db.Model):
+    """Linha única gravada no primário; a idade dela na réplica mede o atraso."""
+    __tablename__ = "replica_heartbeat"
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
 
 
 class Duel(db.Model):
@@ -93,9 +284,31 @@ class Duel(db.Model):
     rounds_count = db.Column(db.Integer, default=3)
     status = db.Column(db.String(20), default="waiting")  # waiting, active, finished
     code = db.Column(db.String(8), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    winner_id = db.Column(db.Integer, db.ForeignKey("users.id"))  # None com status finished = empate
 
     creator = db.relationship("User", foreign_keys=[creator_id])
     opponent = db.relationship("User", foreign_keys=[opponent_id])
+    winner = db.relationship("User", foreign_keys=[winner_id])
+
+    @validates("status")
+    def _track_finish(self, key, value):
+        if value == "finished" and self.status != "finished":
+            self.finished_at = datetime.utcnow()
+            bump_daily("duels_finished")
+        return value
+
+
+class MatchmakingEntry(db.Model):
+    __tablename__ = "matchmaking_queue"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), unique=True, nullable=False)
+    level = db.Column(db.Integer, nullable=False, index=True)
+    enqueued_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    duel_id = db.Column(db.Integer, db.ForeignKey("duels.id"))  # preenchido quando pareado
+
+    duel = db.relationship("Duel")
 
 
 
@@ -121,6 +334,11 @@ class Game(db.Model):
 
     user = db.relationship("User", backref="games")
 
+    # Índice para o histórico paginado (keyset em created_at, id)
+    __table_args__ = (
+        db.Index("ix_games_user_created", "user_id", "created_at", "id"),
+    )
+
     @property
     def themes(self):
         return json.loads(self.themes_json)
@@ -129,7 +347,7 @@ class Game(db.Model):
 class Round(db.Model):
     __tablename__ = "rounds"
     id = db.Column(db.Integer, primary_key=True)
-    game_id = db.Column(db.Integer, db.ForeignKey("games.id"), nullable=False)
+    game_id = db.Column(db.Integer, db.ForeignKey("games.id"), nullable=False, index=True)
     number = db.Column(db.Integer, nullable=False)
     card_id = db.Column(db.Integer, db.ForeignKey("cards.id"), nullable=False)
     requested_hints = db.Column(db.Integer, default=0)
@@ -173,11 +391,93 @@ class DuelScore(db.Model):
     duel_id = db.Column(db.Integer, db.ForeignKey("duels.id"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     score = db.Column(db.Integer, default=0)
+    badge = db.Column(db.String(100), default="")
 
     duel = db.relationship("Duel", backref="scores")
     user = db.relationship("User")
 
 
+class DuelEvent(db.Model):
+    __tablename__ = "duel_events"
+    id = db.Column(db.Integer, primary_key=True)
+    duel_id = db.Column(db.Integer, db.ForeignKey("duels.id"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    round_number = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # hit, miss, skip
+    points = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "round": self.round_number,
+            "kind": self.kind,
+            "points": self.points,
+        }
+
+
+class DailyStat(db.Model):
+    __tablename__ = "daily_stats"
+    __bind_key__ = "analytics"
+    day = db.Column(db.Date, primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)  # ex.: games:solo, coins_spent
+    value = db.Column(db.BigInteger, default=0, nullable=False)
+
+
+class Tournament(db.Model):
+    __tablename__ = "tournaments"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    format = db.Column(db.String(10), default="single")  # single (mata-mata) ou swiss
+    themes_json = db.Column(db.Text, nullable=False)
+    rounds_per_match = db.Column(db.Integer, default=3)
+    status = db.Column(db.String(20), default="open")  # open, running, finished
+    stage = db.Column(db.Integer, default=0)  # fase atual (0 = inscrições)
+    total_stages = db.Column(db.Integer, default=0)
+    winner_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    winner = db.relationship("User")
+
+    @property
+    def themes(self):
+        return json.loads(self.themes_json)
+
+
+class TournamentPlayer(db.Model):
+    __tablename__ = "tournament_players"
+    id = db.Column(db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey("tournaments.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    seed = db.Column(db.Integer)  # 1 = cabeça de chave (maior nível)
+    points = db.Column(db.Integer, default=0)  # vitórias (suíço)
+    alive = db.Column(db.Boolean, default=True)  # ainda no mata-mata
+
+    user = db.relationship("User")
+
+    __table_args__ = (
+        db.UniqueConstraint("tournament_id", "user_id"),
+        db.Index("ix_tournament_players_standing", "tournament_id", "alive", "points", "seed"),
+    )
+
+
+class TournamentMatch(db.Model):
+    __tablename__ = "tournament_matches"
+    id = db.Column(db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey("tournaments.id"), nullable=False)
+    stage = db.Column(db.Integer, nullable=False)
+    slot = db.Column(db.Integer, nullable=False)  # posição na chave; define o cruzamento seguinte
+    player_a_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)  # melhor colocado
+    player_b_id = db.Column(db.Integer, db.ForeignKey("users.id"))  # None = folga (bye)
+    game_a_id = db.Column(db.Integer, db.ForeignKey("games.id"), index=True)
+    game_b_id = db.Column(db.Integer, db.ForeignKey("games.id"), index=True)
+    deck_json = db.Column(db.Text)  # mesmas cartas para os dois jogadores
+    winner_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+
+    __table_args__ = (db.Index("ix_tournament_matches_stage", "tournament_id", "stage", "slot"),)
+
+
 class WeeklyEvent(db.Model):
     __tablename__ = "weekly_event"
     id = db.Column(db.Integer, primary_key=True)
@@ -194,6 +494,16 @@ class WeeklyEvent(db.Model):
         today = datetime.utcnow().date()
         return self.is_active and self.start_date <= today <= self.end_date
 
+class WeeklyDeck(db.Model):
+    __tablename__ = "weekly_decks"
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey("weekly_event.id"), nullable=False)
+    play_date = db.Column(db.Date, nullable=False)
+    cards_json = db.Column(db.Text, nullable=False)  # ids das cartas na ordem das rodadas
+
+    __table_args__ = (db.UniqueConstraint("event_id", "play_date"),)
+
+
 class WeeklyScore(db.Model):
     __tablename__ = "weekly_scores"
     id = db.Column(db.Integer, primary_key=True)
@@ -221,7 +531,7 @@ class QuizScore(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     score = db.Column(db.Integer, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True)
     played_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # ✅ Adicione esta linha
 
     user = db.relationship("User", backref="quiz_scores")
@@ -257,20 +567,422 @@ def require_login():
         return False
     return True
 
+_NON_ALNUM = re.compile(r'[^a-z0-9 ]')
+_SPACES = re.compile(r'\s+')
+
+
 def normalize(text: str) -> str:
     text = ''.join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != 'Mn')
-    text = re.sub(r'[^a-z0-9 ]', '', text.lower())
-    return re.sub(r'\s+', ' ', text).strip()
+    text = _NON_ALNUM.sub('', text.lower())
+    return _SPACES.sub(' ', text).strip()
+
+
+def max_typos(length: int) -> int:
+    # Respostas curtas precisam ser exatas; longas aceitam até 2 erros
+    if length <= 4:
+        return 0
+    if length <= 8:
+        return 1
+    return 2
+
+
+def within_distance(a: str, b: str, k: int) -> bool:
+    """Levenshtein(a, b) <= k, calculando só a faixa |i - j| <= k da matriz.
+
+    Para assim que uma linha inteira passa de k.
+    """
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if k <= 0 or abs(la - lb) > k:
+        return False
+    big = k + 1
+    prev = [j if j <= k else big for j in range(lb + 1)]
+    for i in range(1, la + 1):
+        cur = [big] * (lb + 1)
+        if i <= k:
+            cur[0] = i
+        row_min = cur[0]
+        ca = a[i - 1]
+        for j in range(max(1, i - k), min(lb, i + k) + 1):
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != b[j - 1]))
+            if v > big:
+                v = big
+            cur[j] = v
+            if v < row_min:
+                row_min = v
+        if row_min > k:
+            return False
+        prev = cur
+    return prev[lb] <= k
+
+
+def answer_matches(guess_norm: str, card) -> bool:
+    accepted = card.accepted_answers
+    if guess_norm in accepted:
+        return True
+    return any(within_distance(guess_norm, ans, max_typos(len(ans))) for ans in accepted)
 
 def is_admin():
     return "user_id" in session and session["user_id"] == 1
 
+LEVEL_POINTS = 100
+LEVEL_RECALC_CHUNK = 5000
+
+
+def level_for_user_expr():
+    # Nível calculado no banco: 1 nível a cada 100 pontos somados nas partidas
+    total = (
+        select(func.coalesce(func.sum(Game.user_score), 0))
+        .where(Game.user_id == User.id)
+        .scalar_subquery()
+    )
+    return total // LEVEL_POINTS + 1
+
+
 def update_user_level(user):
-    # Soma todos os pontos das partidas do usuário
-    total_score = sum(game.user_score for game in user.games)
+    # Soma os pontos das partidas direto no banco, sem carregar user.games
+    total_score = db.session.query(func.coalesce(func.sum(Game.user_score), 0)).filter(Game.user_id == user.id).scalar()
     # Calcula o nível (1 nível a cada 100 pontos)
-    user.level = total_score // 100 + 1
+    user.level = int(total_score) // LEVEL_POINTS + 1
+
+
+def recalc_levels(chunk_size=LEVEL_RECALC_CHUNK):
+    """Recalcula o nível de todos os usuários com um UPDATE por faixa de ids.
+
+    Só reescreve as linhas cujo nível mudou e faz commit a cada faixa, para
+    não segurar uma transação longa no SQLite nem no PostgreSQL.
+    Retorna quantos usuários tiveram o nível alterado.
+    """
+    lo, hi = db.session.query(func.min(User.id), func.max(User.id)).one()
+    if lo is None:
+        return 0
+
+    new_level = level_for_user_expr()
+    changed = 0
+    for start in range(lo, hi + 1, chunk_size):
+        result = db.session.execute(
+            update(User)
+            .where(User.id >= start, User.id < start + chunk_size)
+            .where(func.coalesce(User.level, 0) != new_level)
+            .values(level=new_level)
+            .execution_options(synchronize_session=False)
+        )
+        changed += result.rowcount
+        db.session.commit()
+    return changed
+
+
+# ----------------------
+# Moedas (ledger)
+# ----------------------
+COIN_LEDGER_KEEP_DAYS = 30
+COIN_COMPACT_CHUNK = 1000
+
+
+def _change_coins(user, delta, reason, only_if_enough=False):
+    """Aplica delta ao saldo com um único UPDATE e registra no ledger.
+
+    Retorna o novo saldo, ou None se only_if_enough e o saldo não bastava.
+    """
+    stmt = update(User).where(User.id == user.id).values(coins=User.coins + delta)
+    if only_if_enough:
+        stmt = stmt.where(User.coins >= -delta)
+
+    if db.engine.dialect.update_returning:
+        balance = db.session.execute(stmt.returning(User.coins).execution_options(synchronize_session=False)).scalar()
+    else:
+        result = db.session.execute(stmt.execution_options(synchronize_session=False))
+        balance = None
+        if result.rowcount:
+            balance = db.session.query(User.coins).filter(User.id == user.id).scalar()
+
+    if balance is None:
+        return None
+
+    # Atualiza o objeto em memória sem marcá-lo como alterado
+    set_committed_value(user, "coins", balance)
+    db.session.add(CoinLedger(user_id=user.id, delta=delta, reason=reason, balance_after=balance))
+    bump_daily("coins_spent" if delta < 0 else "coins_earned", abs(delta))
+    return balance
+
+
+def debit(user, amount, reason):
+    """Debita moedas só se houver saldo; retorna o novo saldo ou None."""
+    return _change_coins(user, -amount, reason, only_if_enough=True)
+
+
+def credit(user, amount, reason):
+    """Credita moedas e retorna o novo saldo."""
+    return _change_coins(user, amount, reason)
+
+
+def compact_coin_ledger(keep_days=COIN_LEDGER_KEEP_DAYS, chunk_size=COIN_COMPACT_CHUNK):
+    """Consolida o ledger antigo em coin_snapshots e apaga as linhas compactadas.
+
+    Retorna quantas linhas do ledger foram removidas.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    cutoff_id = db.session.query(func.max(CoinLedger.id)).filter(CoinLedger.created_at < cutoff).scalar()
+    if cutoff_id is None:
+        return 0
+
+    # Última entrada de cada usuário até o corte carrega o saldo naquele ponto
+    last_ids = (
+        db.session.query(func.max(CoinLedger.id))
+        .filter(CoinLedger.id <= cutoff_id)
+        .group_by(CoinLedger.user_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(CoinLedger.user_id, CoinLedger.id, CoinLedger.balance_after)
+        .filter(CoinLedger.id.in_(select(last_ids)))
+        .order_by(CoinLedger.user_id)
+        .all()
+    )
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        existing = {
+            snap.user_id: snap for snap in
+            CoinSnapshot.query.filter(CoinSnapshot.user_id.in_([user_id for user_id, _, _ in chunk]))
+        }
+        for user_id, ledger_id, balance in chunk:
+            snap = existing.get(user_id)
+            if snap is None:
+                db.session.add(CoinSnapshot(user_id=user_id, balance=balance, ledger_id=ledger_id))
+            else:
+                snap.balance, snap.ledger_id, snap.taken_at = balance, ledger_id, datetime.utcnow()
+
+    removed = CoinLedger.query.filter(CoinLedger.id <= cutoff_id).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def upsert(model, values, key, increment=(), replace=(), connection=None):
+    """INSERT ... ON CONFLICT DO UPDATE no PostgreSQL e no SQLite.
+
+    Colunas em increment somam o valor novo ao atual; em replace, sobrescrevem.
+    Em outros bancos cai para UPDATE seguido de INSERT. Com connection, roda
+    nela em vez da sessão (ex.: outro bind).
+    """
+    target = connection if connection is not None else db.session
+    dialect = connection.dialect.name if connection is not None else db.engine.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(model).values(**values)
+        set_ = {col: getattr(model, col) + stmt.excluded[col] for col in increment}
+        set_.update({col: stmt.excluded[col] for col in replace})
+        target.execute(stmt.on_conflict_do_update(index_elements=list(key), set_=set_))
+        return
+
+    where = [getattr(model, col) == values[col] for col in key]
+    set_ = {col: getattr(model, col) + values[col] for col in increment}
+    set_.update({col: values[col] for col in replace})
+    result = target.execute(update(model).where(*where).values(**set_).execution_options(synchronize_session=False))
+    if not result.rowcount:
+        if connection is not None:
+            connection.execute(model.__table__.insert().values(**values))
+        else:
+            db.session.add(model(**values))
+
+
+# ----------------------
+# Réplica de leitura
+# ----------------------
+# Rotas marcadas com @read_only (rankings, histórico, exportações) e blocos
+# "with on_replica()" leem da réplica. Antes de usá-la o worker grava um
+# heartbeat no primário e lê o da réplica (no máximo a cada
+# REPLICA_CHECK_INTERVAL): se a réplica ainda não tem o heartbeat anterior e
+# ele é mais velho que REPLICA_MAX_LAG, ou se ela não responde, a leitura
+# volta para o primário.
+REPLICA_MAX_LAG = 5.0          # segundos de atraso tolerados
+REPLICA_CHECK_INTERVAL = 2.0   # segundos entre verificações por worker
+
+
+class ReplicaGuard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.healthy = False
+        self.last_beat = None   # heartbeat gravado por este worker na verificação anterior
+
+    def usable(self):
+        if "replica" not in app.config.get("SQLALCHEMY_BINDS", {}):
+            return False
+        now = time.monotonic()
+        if now - self.checked_at < REPLICA_CHECK_INTERVAL:
+            return self.healthy
+        with self.lock:
+            if now - self.checked_at >= REPLICA_CHECK_INTERVAL:
+                self.healthy = self._check()
+                self.checked_at = time.monotonic()
+        return self.healthy
+
+    def _check(self):
+        beat = datetime.utcnow()
+        previous, self.last_beat = self.last_beat, beat
+        try:
+            with db.engine.begin() as conn:
+                upsert(ReplicaHeartbeat, {"id": 1, "beat_at": beat}, key=("id",), replace=("beat_at",), connection=conn)
+            with db.engines["replica"].connect() as conn:
+                seen = conn.execute(select(ReplicaHeartbeat.beat_at).where(ReplicaHeartbeat.id == 1)).scalar()
+        except Exception as exc:
+            app.logger.warning("réplica indisponível, lendo do primário: %s", exc)
+            return False
+        if seen is None:
+            return False
+        if previous is not None and seen >= previous:
+            return True
+        return (beat - seen).total_seconds() <= REPLICA_MAX_LAG
+
+
+replica_guard = ReplicaGuard()
+
+
+def read_only(view):
+    """Marca a rota como só leitura: as consultas vão para a réplica, se estiver em dia."""
+    view.read_replica = True
+    return view
+
+
+@contextmanager
+def on_replica():
+    """Lê da réplica dentro do bloco (se estiver em dia), fora de rotas @read_only."""
+    previous = g.get("read_replica", False)
+    g.read_replica = replica_guard.usable()
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+
+def record_card_play(r, solved):
+    """Soma a rodada encerrada nas estatísticas da carta e do jogador no tema.
+
+    Roda na mesma transação do chute/pulo, sem ler a tabela rounds.
+    """
+    seconds = int((datetime.utcnow() - r.started_at).total_seconds()) if solved and r.started_at else 0
+    upsert(
+        CardStat,
+        {
+            "card_id": r.card_id,
+            "plays": 1,
+            "solves": 1 if solved else 0,
+            "hints_total": r.requested_hints or 0,
+            "solve_seconds_total": seconds,
+        },
+        key=("card_id",),
+        increment=("plays", "solves", "hints_total", "solve_seconds_total"),
+    )
+    upsert(
+        UserThemeStat,
+        {
+            "user_id": r.game.user_id,
+            "theme": r.card.theme,
+            "rounds": 1,
+            "solves": 1 if solved else 0,
+            "hints_total": r.requested_hints or 0,
+            "points_total": r.user_points or 0,
+        },
+        key=("user_id", "theme"),
+        increment=("rounds", "solves", "hints_total", "points_total"),
+    )
+    bump_daily("rounds_played")
+    if solved:
+        bump_daily("rounds_solved")
+
+
+THEME_BACKFILL_CHUNK = 5000
+
+
+def backfill_theme_stats(chunk_size=THEME_BACKFILL_CHUNK):
+    """Refaz user_theme_stats a partir das rodadas já encerradas, em blocos por id.
+
+    Cada bloco é agregado em memória e somado com upsert; só um bloco de
+    rodadas fica carregado por vez. Retorna quantas rodadas foram lidas.
+
+    A tabela é zerada na mesma transação que fotografa as rodadas (maior id e
+    as ainda abertas); no PostgreSQL em REPEATABLE READ, para as leituras
+    verem o mesmo instante do DELETE. O backfill soma só as rodadas que já
+    estavam encerradas nesse instante: as que terminam depois entram ao vivo
+    por record_card_play, então nenhuma é contada duas vezes.
+    """
+    options = {"isolation_level": "REPEATABLE READ"} if db.engine.dialect.name == "postgresql" else {}
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(**options)
+        with conn.begin():
+            conn.execute(UserThemeStat.__table__.delete())
+            cutoff = conn.execute(select(func.max(Round.id))).scalar() or 0
+            still_open = set(conn.execute(
+                select(Round.id).where(Round.id <= cutoff, Round.finished.is_not(True))
+            ).scalars())
+
+    last_id, total = 0, 0
+    while last_id < cutoff:
+        rows = db.session.execute(
+            select(Round.id, Game.user_id, Card.theme, Round.user_points, Round.requested_hints)
+            .join(Game, Game.id == Round.game_id)
+            .join(Card, Card.id == Round.card_id)
+            .where(Round.finished.is_(True), Round.id > last_id, Round.id <= cutoff)
+            .order_by(Round.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        agg = {}
+        for round_id, user_id, theme, points, hints in rows:
+            if round_id in still_open:
+                continue
+            a = agg.setdefault((user_id, theme), [0, 0, 0, 0])
+            a[0] += 1
+            a[1] += 1 if points and points > 0 else 0
+            a[2] += hints or 0
+            a[3] += points or 0
+        for (user_id, theme), (n, solves, hints, points) in agg.items():
+            upsert(
+                UserThemeStat,
+                {"user_id": user_id, "theme": theme, "rounds": n, "solves": solves,
+                 "hints_total": hints, "points_total": points},
+                key=("user_id", "theme"),
+                increment=("rounds", "solves", "hints_total", "points_total"),
+            )
+        db.session.commit()
+        last_id = rows[-1][0]
+        total += sum(n for n, _, _, _ in agg.values())
+    return total
+
+
+# Taxa de acerto mínima para cada nível de dificuldade (1 = mais fácil)
+DIFFICULTY_BUCKETS = [(0.7, 1), (0.5, 2), (0.3, 3), (0.15, 4)]
+DIFFICULTY_MIN_PLAYS = 20
+
+
+def rebucket_difficulty(min_plays=DIFFICULTY_MIN_PLAYS):
+    """Reclassifica Card.difficulty pela taxa de acerto em card_stats.
+
+    Um único UPDATE; cartas com menos de min_plays jogadas ficam como estão.
+    """
+    rate = (
+        select(CardStat.solves * 1.0 / CardStat.plays)
+        .where(CardStat.card_id == Card.id)
+        .scalar_subquery()
+    )
+    new_difficulty = case(*[(rate >= threshold, level) for threshold, level in DIFFICULTY_BUCKETS], else_=5)
+    result = db.session.execute(
+        update(Card)
+        .where(Card.id.in_(select(CardStat.card_id).where(CardStat.plays >= min_plays)))
+        .where(func.coalesce(Card.difficulty, 0) != new_difficulty)
+        .values(difficulty=new_difficulty)
+        .execution_options(synchronize_session=False)
+    )
     db.session.commit()
+    if result.rowcount:
+        # O sorteio lê a dificuldade do catálogo mapeado
+        build_card_catalog()
+    return result.rowcount
 
 
 def update_daily_login(user):
@@ -292,10 +1004,10 @@ def update_daily_login(user):
     day_index = min(user.login_streak, len(streak_rewards)) - 1
     coins_earned = streak_rewards[day_index]
 
-    user.coins += coins_earned
+    credit(user, coins_earned, "daily_login")
     user.last_login = datetime.utcnow()
+    bump_daily("active_users")
 
-    db.session.commit()
     return coins_earned
 
 
@@ -305,6 +1017,671 @@ def update_daily_login(user):
 
 
 
+# ----------------------
+# Estatísticas diárias (rollup para o painel do admin)
+# ----------------------
+# O jogo só soma contadores em memória (depois do commit da requisição); o
+# buffer grava no bind "analytics" no máximo a cada DAILY_STATS_FLUSH segundos,
+# numa conexão própria, sem travar linhas nas transações do jogo. O comando
+# rollup-daily-stats recalcula um dia fechado a partir das tabelas de origem
+# e substitui os valores (idempotente), corrigindo o que o buffer perdeu.
+DAILY_STATS_FLUSH = 30   # segundos
+DAILY_STATS_DAYS = 30    # dias mostrados no painel
+
+
+def bump_daily(metric, n=1):
+    """Soma n ao contador do dia, só se a transação da sessão for gravada."""
+    if not n or not has_app_context():
+        return
+    pending = db.session.info.setdefault("daily_stats", {})
+    key = (datetime.utcnow().date(), metric)
+    pending[key] = pending.get(key, 0) + n
+
+
+# Os contadores seguem a transação da sessão, não a requisição: valem também
+# para rotas @manual_commit e comandos CLI, e somem se houver rollback.
+@sa_event.listens_for(RoutingSession, "after_commit")
+def _keep_daily_counts(session):
+    counts = session.info.pop("daily_stats", None)
+    if counts:
+        daily_stats_buffer.add(counts)
+
+
+@sa_event.listens_for(RoutingSession, "after_transaction_end")
+def _drop_daily_counts(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("daily_stats", None)
+
+
+class DailyStatsBuffer:
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    def add(self, counts):
+        with self.lock:
+            for key, n in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + n
+            due = time.monotonic() - self.flushed_at >= DAILY_STATS_FLUSH
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            self.flushed_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            with db.engines["analytics"].begin() as conn:
+                for (day, metric), n in sorted(counts.items()):
+                    upsert(DailyStat, {"day": day, "metric": metric, "value": n},
+                           key=("day", "metric"), increment=("value",), connection=conn)
+        except Exception as e:
+            print("Erro ao gravar daily_stats:", e)
+            self.add(counts)
+
+
+daily_stats_buffer = DailyStatsBuffer()
+
+
+@atexit.register
+def flush_daily_stats():
+    with app.app_context():
+        daily_stats_buffer.flush()
+
+
+@sa_event.listens_for(Game, "after_insert")
+def _count_game(mapper, connection, target):
+    bump_daily(f"games:{target.mode or 'solo'}")
+
+
+@sa_event.listens_for(Duel, "after_insert")
+def _count_duel(mapper, connection, target):
+    bump_daily("duels_created")
+
+
+def rollup_daily_stats(day):
+    """Recalcula todas as métricas de um dia a partir das tabelas de origem."""
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    metrics = {}
+
+    for mode, n in (
+        db.session.query(Game.mode, func.count(Game.id))
+        .filter(Game.created_at >= start, Game.created_at < end)
+        .group_by(Game.mode)
+    ):
+        metrics[f"games:{mode or 'solo'}"] = n
+
+    played, solved = (
+        db.session.query(func.count(Round.id), func.coalesce(func.sum(case((Round.user_points > 0, 1), else_=0)), 0))
+        .filter(Round.finished.is_(True), Round.started_at >= start, Round.started_at < end)
+        .one()
+    )
+    metrics["rounds_played"], metrics["rounds_solved"] = played, solved
+
+    metrics["duels_created"] = (
+        db.session.query(func.count(Duel.id)).filter(Duel.created_at >= start, Duel.created_at < end).scalar()
+    )
+    metrics["duels_finished"] = (
+        db.session.query(func.count(Duel.id)).filter(Duel.finished_at >= start, Duel.finished_at < end).scalar()
+    )
+
+    spent, earned, active = (
+        db.session.query(
+            func.coalesce(func.sum(case((CoinLedger.delta < 0, -CoinLedger.delta), else_=0)), 0),
+            func.coalesce(func.sum(case((CoinLedger.delta > 0, CoinLedger.delta), else_=0)), 0),
+            func.count(func.distinct(case((CoinLedger.reason == "daily_login", CoinLedger.user_id)))),
+        )
+        .filter(CoinLedger.created_at >= start, CoinLedger.created_at < end)
+        .one()
+    )
+    metrics.update(coins_spent=spent, coins_earned=earned, active_users=active)
+
+    rows = [{"day": day, "metric": metric, "value": value} for metric, value in metrics.items() if value]
+    with db.engines["analytics"].begin() as conn:
+        conn.execute(DailyStat.__table__.delete().where(DailyStat.day == day))
+        if rows:
+            conn.execute(DailyStat.__table__.insert(), rows)
+    return metrics
+
+
+@app.route("/admin/stats")
+@read_only
+def admin_stats():
+    if not is_admin():
+        flash("Acesso negado.", "danger")
+        return redirect(url_for("index"))
+
+    since = datetime.utcnow().date() - timedelta(days=DAILY_STATS_DAYS - 1)
+    days = {}
+    modes = set()
+    for day, metric, value in (
+        db.session.query(DailyStat.day, DailyStat.metric, DailyStat.value)
+        .filter(DailyStat.day >= since)
+        .order_by(DailyStat.day.desc())
+    ):
+        days.setdefault(day, {})[metric] = value
+        if metric.startswith("games:"):
+            modes.add(metric.split(":", 1)[1])
+
+    for stats in days.values():
+        created = stats.get("duels_created", 0)
+        stats["duel_completion"] = round(100 * stats.get("duels_finished", 0) / created) if created else None
+
+    return render_template("admin_stats.html", days=days, modes=sorted(modes))
+
+
+# ----------------------
+# Catálogo de cartas (snapshot binário via mmap)
+# ----------------------
+# Layout do arquivo (little-endian):
+#   cabeçalho  CATALOG_HEADER
+#   temas      CATALOG_THEME  x n_themes  (início, quantidade, nome)
+#   registros  CATALOG_RECORD x n         (ordenados por tema e id)
+#   índice     CATALOG_ID     x n         (id -> registro, ordenado por id)
+#   blob       textos UTF-8 (título, resposta, dicas em JSON, nomes de tema)
+CATALOG_MAGIC = b"PFCAT\x00\x00\x01"
+CATALOG_HEADER = struct.Struct("<8sQIIIIII")
+CATALOG_THEME = struct.Struct("<IIII")
+CATALOG_RECORD = struct.Struct("<IHBxIIIIII")
+CATALOG_ID = struct.Struct("<II")
+CATALOG_CHECK_INTERVAL = 1.0   # segundos entre os stat() que detectam um snapshot novo
+CATALOG_VERIFY_INTERVAL = 60.0  # segundos entre as conferências do snapshot com a tabela cards
+
+CatalogCard = namedtuple("CatalogCard", "id theme difficulty title answer hints")
+CatalogSnapshot = namedtuple(
+    "CatalogSnapshot", "map stat_key n max_id themes theme_names records_off ids_off blob_off"
+)
+
+
+def catalog_path():
+    return app.config.get("CARD_CATALOG_PATH") or os.path.join(app.instance_path, "cards.catalog")
+
+
+def build_card_catalog(path=None):
+    """Gera o snapshot da tabela cards e publica com rename atômico."""
+    path = path or catalog_path()
+    # Conexão própria no primário: lê o que já foi commitado, sem passar pela
+    # sessão da requisição (que pode estar apontando para a réplica)
+    with db.engine.connect() as conn:
+        rows = conn.execute(
+            select(Card.id, Card.theme, Card.difficulty, Card.title, Card.answer, Card.hints_json)
+            .order_by(Card.theme, Card.id)
+        ).all()
+
+    blob = bytearray()
+
+    def put(text):
+        data = text.encode("utf-8")
+        off = len(blob)
+        blob.extend(data)
+        return off, len(data)
+
+    themes = []        # [nome, início, quantidade]
+    records = bytearray()
+    for i, (card_id, theme, difficulty, title, answer, hints_json) in enumerate(rows):
+        if not themes or themes[-1][0] != theme:
+            themes.append([theme, i, 0])
+        themes[-1][2] += 1
+        records += CATALOG_RECORD.pack(
+            card_id, len(themes) - 1, min(difficulty or 1, 255),
+            *put(title), *put(answer), *put(hints_json),
+        )
+
+    theme_table = bytearray()
+    for name, start, count in themes:
+        theme_table += CATALOG_THEME.pack(start, count, *put(name))
+
+    id_index = bytearray()
+    for card_id, rec in sorted((row[0], i) for i, row in enumerate(rows)):
+        id_index += CATALOG_ID.pack(card_id, rec)
+
+    themes_off = CATALOG_HEADER.size
+    records_off = themes_off + len(theme_table)
+    ids_off = records_off + len(records)
+    blob_off = ids_off + len(id_index)
+    header = CATALOG_HEADER.pack(
+        CATALOG_MAGIC, time.time_ns(), len(rows), len(themes), records_off, ids_off, blob_off, 0,
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(theme_table)
+        f.write(records)
+        f.write(id_index)
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(rows)
+
+
+class CardCatalog:
+    """Leitura do snapshot mapeado em memória, compartilhado entre workers.
+
+    As páginas do arquivo ficam no page cache do sistema, então vários
+    workers não multiplicam a memória. Um snapshot novo é detectado pelo
+    stat() do caminho (o rename troca o inode) e remapeado.
+
+    Todo o estado de um arquivo (mapa, offsets, temas) fica num único
+    CatalogSnapshot, trocado por uma atribuição só: quem está lendo nunca vê
+    o mapa novo com os offsets do antigo. Ao carregar, e depois a cada
+    CATALOG_VERIFY_INTERVAL, o snapshot é conferido com a tabela cards
+    (quantidade e maior id); init-db, seeds e SQL direto não passam pelas
+    rotas do admin, então um arquivo atrasado é regerado ali.
+    """
+
+    def __init__(self):
+        self.snap = None
+        self.checked_at = 0.0
+        self.verified_at = 0.0
+        self.lock = threading.Lock()
+
+    def _load(self):
+        """Snapshot atual, ou None se não há catálogo."""
+        snap = self.snap
+        now = time.monotonic()
+        if snap is not None and now - self.checked_at < CATALOG_CHECK_INTERVAL:
+            return snap
+        self.checked_at = now
+        try:
+            st = os.stat(catalog_path())
+        except FileNotFoundError:
+            return snap
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if snap is None or key != snap.stat_key:
+            with self.lock:
+                if self.snap is None or key != self.snap.stat_key:
+                    # O mapa antigo não é fechado aqui: outra thread pode estar lendo
+                    # dele, e ele é liberado pelo coletor quando ninguém mais o referencia.
+                    self.snap = self._open(key) or self.snap
+                    self.verified_at = 0.0
+                snap = self.snap
+        if snap is not None and now - self.verified_at >= CATALOG_VERIFY_INTERVAL:
+            self.verified_at = now
+            snap = self._verify(snap)
+        return snap
+
+    def _open(self, key):
+        with open(catalog_path(), "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, n, n_themes, records_off, ids_off, blob_off, _ = CATALOG_HEADER.unpack_from(m, 0)
+        if magic != CATALOG_MAGIC:
+            m.close()
+            return None
+
+        themes = {}
+        for i in range(n_themes):
+            start, count, name_off, name_len = CATALOG_THEME.unpack_from(m, CATALOG_HEADER.size + i * CATALOG_THEME.size)
+            themes[m[blob_off + name_off:blob_off + name_off + name_len].decode("utf-8")] = (start, count)
+        max_id = CATALOG_ID.unpack_from(m, ids_off + (n - 1) * CATALOG_ID.size)[0] if n else 0
+        return CatalogSnapshot(m, key, n, max_id, themes, list(themes), records_off, ids_off, blob_off)
+
+    def _verify(self, snap):
+        """Confere o snapshot com a tabela cards no primário e o regera se ficou para trás."""
+        try:
+            with db.engine.connect() as conn:
+                n, max_id = conn.execute(select(func.count(Card.id), func.coalesce(func.max(Card.id), 0))).one()
+            if (n, max_id) == (snap.n, snap.max_id):
+                return snap
+            app.logger.warning("catálogo de cartas desatualizado (%s cartas até o id %s, banco tem %s até %s); regerando",
+                               snap.n, snap.max_id, n, max_id)
+            with self.lock:
+                build_card_catalog()
+                st = os.stat(catalog_path())
+                self.snap = self._open((st.st_ino, st.st_mtime_ns, st.st_size)) or self.snap
+                return self.snap
+        except Exception:
+            app.logger.exception("falha ao conferir o catálogo de cartas")
+            return snap
+
+    @staticmethod
+    def _text(snap, off, length):
+        start = snap.blob_off + off
+        return snap.map[start:start + length].decode("utf-8")
+
+    @staticmethod
+    def _record(snap, rec):
+        card_id, theme_idx, difficulty, t_off, t_len, a_off, a_len, h_off, h_len = \
+            CATALOG_RECORD.unpack_from(snap.map, snap.records_off + rec * CATALOG_RECORD.size)
+        return card_id, theme_idx, difficulty, (t_off, t_len), (a_off, a_len), (h_off, h_len)
+
+    def available(self):
+        return self._load() is not None
+
+    def get(self, card_id):
+        """Carta pelo id (busca binária no índice), ou None."""
+        snap = self._load()
+        if snap is None:
+            return None
+        lo, hi = 0, snap.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id, rec = CATALOG_ID.unpack_from(snap.map, snap.ids_off + mid * CATALOG_ID.size)
+            if mid_id < card_id:
+                lo = mid + 1
+            elif mid_id > card_id:
+                hi = mid
+            else:
+                return self._card(snap, rec)
+        return None
+
+    def _card(self, snap, rec):
+        card_id, theme_idx, difficulty, title, answer, hints = self._record(snap, rec)
+        theme = snap.theme_names[theme_idx]
+        return CatalogCard(card_id, theme, difficulty, self._text(snap, *title), self._text(snap, *answer),
+                           json.loads(self._text(snap, *hints)))
+
+    def theme_cards(self, theme):
+        """(id, dificuldade) das cartas do tema, sem decodificar textos."""
+        snap = self._load()
+        if snap is None or theme not in snap.themes:
+            return []
+        start, count = snap.themes[theme]
+        out = []
+        for rec in range(start, start + count):
+            card_id, _, difficulty = CATALOG_RECORD.unpack_from(snap.map, snap.records_off + rec * CATALOG_RECORD.size)[:3]
+            out.append((card_id, difficulty))
+        return out
+
+    def answers(self, after_id=0):
+        """(id, tema, resposta) de todas as cartas com id > after_id."""
+        snap = self._load()
+        if snap is None:
+            return []
+        out = []
+        for theme, (start, count) in snap.themes.items():
+            for rec in range(start, start + count):
+                card_id, _, _, _, answer, _ = self._record(snap, rec)
+                if card_id > after_id:
+                    out.append((card_id, theme, self._text(snap, *answer)))
+        out.sort()
+        return out
+
+    def random_card_id(self, theme, exclude=(), difficulty=None, seen=()):
+        return pick_card_id(self.theme_cards(theme), exclude, difficulty, seen)
+
+
+def pick_card_id(cards, exclude=(), difficulty=None, seen=()):
+    """Sorteia um id de (id, dificuldade) fora de exclude e seen; prefere a dificuldade pedida."""
+    cards = [(cid, diff) for cid, diff in cards if cid not in exclude and cid not in seen]
+    if difficulty is not None:
+        preferred = [cid for cid, diff in cards if diff == difficulty]
+        if preferred:
+            return random.choice(preferred)
+        cards.sort(key=lambda c: c[1])
+        cards = [c for c in cards if c[1] == cards[0][1]] if cards else []
+    return random.choice(cards)[0] if cards else None
+
+
+card_catalog = CardCatalog()
+
+
+# ----------------------
+# Cartas já vistas (filtro de Bloom por usuário e tema)
+# ----------------------
+# Evita repetir entre partidas sem um NOT IN com o histórico inteiro: cada
+# (usuário, tema) guarda um filtro de 2 KB em user_seen_cards, lido por chave
+# primária e consultado em memória. O custo do sorteio não depende do
+# histórico. Falsos positivos só escondem algumas cartas inéditas até o
+# filtro ser zerado, o que acontece quando o tema se esgota para o usuário ou
+# quando o filtro passa da capacidade (a taxa de falso positivo ali é ~2%).
+SEEN_FILTER_BITS = 16384
+SEEN_FILTER_HASHES = 4
+SEEN_FILTER_CAPACITY = 2000
+
+
+class SeenFilter:
+    def __init__(self, bits=None, count=0):
+        self.bits = bytearray(bits) if bits else bytearray(SEEN_FILTER_BITS // 8)
+        self.count = count
+
+    @staticmethod
+    def _positions(card_id):
+        digest = hashlib.blake2b(card_id.to_bytes(8, "little"), digest_size=8).digest()
+        h1, h2 = struct.unpack("<II", digest)
+        return [(h1 + i * h2) % SEEN_FILTER_BITS for i in range(SEEN_FILTER_HASHES)]
+
+    def __contains__(self, card_id):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(card_id))
+
+    def add(self, card_id):
+        for p in self._positions(card_id):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def clear(self):
+        self.bits = bytearray(SEEN_FILTER_BITS // 8)
+        self.count = 0
+
+
+def load_seen_filter(user_id, theme):
+    row = db.session.execute(
+        select(UserSeenCards.bits, UserSeenCards.count)
+        .where(UserSeenCards.user_id == user_id, UserSeenCards.theme == theme)
+    ).first()
+    return SeenFilter(row.bits, row.count) if row else SeenFilter()
+
+
+def store_seen_card(user_id, theme, card_id, seen=None):
+    """Marca card_id como visto, zerando o filtro se ele já estiver cheio."""
+    seen = seen or load_seen_filter(user_id, theme)
+    if seen.count >= SEEN_FILTER_CAPACITY:
+        seen.clear()
+    seen.add(card_id)
+    upsert(
+        UserSeenCards,
+        {"user_id": user_id, "theme": theme, "bits": bytes(seen.bits), "count": seen.count},
+        key=("user_id", "theme"),
+        replace=("bits", "count"),
+    )
+
+
+# ----------------------
+# Limite de requisições (token bucket + concorrência)
+# ----------------------
+# Rotas quentes que gravam ou consultam o banco a cada chamada. Cada uma tem
+# um balde por usuário e outro por IP (taxa em fichas/s e rajada máxima) e um
+# teto de requisições simultâneas por worker. Acima do limite a resposta é um
+# 429 simples, devolvido antes de carregar o usuário ou tocar no ORM.
+RATE_LIMITS = {
+    # endpoint: (fichas por segundo, rajada, simultâneas por worker)
+    "game_guess": (2.0, 10, 8),
+    "game_hint": (1.0, 5, 8),
+    "quiz_answer": (2.0, 10, 8),
+    "duel_wait": (1.0, 5, 16),
+    "api_v1_guess": (2.0, 10, 8),
+    "api_v1_hint": (1.0, 5, 8),
+}
+RATE_LIMIT_IDLE = 300   # segundos sem uso até o balde ser descartado
+
+
+class MemoryBuckets:
+    """Baldes no próprio processo; cada worker do gunicorn tem os seus."""
+
+    def __init__(self):
+        self.buckets = {}   # chave -> (fichas, instante)
+        self.lock = threading.Lock()
+        self.pruned_at = time.monotonic()
+
+    def take(self, key, rate, burst):
+        """Consome uma ficha. Devolve 0 se passou ou os segundos até a próxima ficha."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, ts = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self.buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if now - self.pruned_at > RATE_LIMIT_IDLE:
+                self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < RATE_LIMIT_IDLE}
+                self.pruned_at = now
+        return wait
+
+
+class SQLiteBuckets:
+    """Baldes num arquivo SQLite local, compartilhados entre os workers da máquina."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, ts REAL)"
+            )
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, ts FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, ts = row if row else (burst, now)
+            tokens = min(burst, tokens + (now - ts) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, ts) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, ts = excluded.ts",
+                (key, tokens, now),
+            )
+            if random.random() < 0.001:
+                conn.execute("DELETE FROM buckets WHERE ts < ?", (now - RATE_LIMIT_IDLE,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, limits):
+        self.limits = limits
+        self.slots = {endpoint: threading.BoundedSemaphore(limit[2]) for endpoint, limit in limits.items()}
+        self.store = None
+
+    def buckets(self):
+        if self.store is None:
+            path = app.config.get("RATE_LIMIT_DB")
+            self.store = SQLiteBuckets(path) if path else MemoryBuckets()
+        return self.store
+
+    def check(self, endpoint, keys):
+        """Devolve None se a requisição pode seguir, ou a resposta 429."""
+        rate, burst, _ = self.limits[endpoint]
+        if not self.slots[endpoint].acquire(blocking=False):
+            return self.reject(1)
+        try:
+            wait = max(self.buckets().take(f"{endpoint}:{key}", rate, burst) for key in keys)
+        except sqlite3.Error:
+            wait = 0   # o limitador nunca derruba a rota
+        except Exception:
+            # Qualquer outro erro sobe, mas sem levar a vaga junto
+            self.slots[endpoint].release()
+            raise
+        if wait:
+            self.slots[endpoint].release()
+            return self.reject(wait)
+        g.rate_limit_slot = endpoint
+        return None
+
+    def release(self):
+        endpoint = g.pop("rate_limit_slot", None)
+        if endpoint:
+            self.slots[endpoint].release()
+
+    @staticmethod
+    def reject(wait):
+        return Response(
+            "Muitas requisições. Tente novamente em instantes.\n",
+            status=429,
+            mimetype="text/plain",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+
+# Registrado antes da unidade de trabalho: um 429 não chega a carregar o usuário
+@app.before_request
+def shed_load():
+    if request.endpoint not in RATE_LIMITS:
+        return None
+    # remote_addr já passou pelo ProxyFix; o primeiro X-Forwarded-For é do cliente
+    keys = [f"ip:{request.remote_addr}"]
+    if "user_id" in session:
+        keys.append(f"user:{session['user_id']}")
+    return rate_limiter.check(request.endpoint, keys)
+
+
+@app.teardown_request
+def release_load_slot(exc):
+    rate_limiter.release()
+
+
+# ----------------------
+# Unidade de trabalho por requisição
+# ----------------------
+# Cada requisição carrega o usuário logado uma vez, acumula as alterações na
+# sessão do SQLAlchemy e faz um único commit no final. Se a rota levantar
+# exceção ou responder com erro (>= 400), nada é gravado.
+def manual_commit(view):
+    """Marca a rota como responsável pelos próprios commits/rollbacks."""
+    view.manual_commit = True
+    return view
+
+
+def current_user():
+    return g.get("user")
+
+
+def after_commit(callback):
+    """Agenda uma ação para depois do commit da requisição (ex.: publicar eventos)."""
+    g.setdefault("after_commit", []).append(callback)
+
+
+@app.before_request
+def begin_unit_of_work():
+    view = app.view_functions.get(request.endpoint)
+    g.unit_of_work = not getattr(view, "manual_commit", False)
+    # O usuário vem sempre do primário: quem acabou de se cadastrar pode não estar na réplica
+    g.user = db.session.get(User, session["user_id"]) if "user_id" in session else None
+    g.read_replica = getattr(view, "read_replica", False) and replica_guard.usable()
+
+
+@app.after_request
+def commit_unit_of_work(response):
+    if g.get("unit_of_work") and response.status_code < 400:
+        db.session.commit()
+        for callback in g.pop("after_commit", []):
+            callback()
+    return response
+
+
+@app.teardown_request
+def end_unit_of_work(exc):
+    if exc is not None:
+        db.session.rollback()
+
+
 # ----------------------
 # Routes (Auth, Game, Admin)
 # ----------------------
@@ -326,12 +1703,12 @@ def register():
         u = User(name=name, email=email)
         u.set_password(password)
         db.session.add(u)
-        db.session.commit()
+        db.session.flush()
         session["user_id"] = u.id
 
         # ----- Enviar e-mail de boas-vindas -----
         try:
-            msg = Message(
+            send_mail(
                 subject="Bem-vindo ao PERFUT!",
                 recipients=[email],
                 html=f"""
@@ -345,7 +1722,6 @@ def register():
                 </html>
                 """
             )
-            mail.send(msg)
         except Exception as e:
             print("Erro ao enviar e-mail de boas-vindas:", e)
             flash("Cadastro realizado, mas não foi possível enviar o e-mail de boas-vindas.", "warning")
@@ -379,7 +1755,7 @@ def game_mode_select():
     if not require_login():
         return redirect(url_for("login"))
 
-    user = User.query.get(session["user_id"])
+    user = current_user()
     today = datetime.utcnow().date()
 
     # Atualiza login diário e pega moedas ganhas
@@ -426,10 +1802,10 @@ def duel_join(code):
     duel.status = "active"
 
     # Cria jogos para os dois
-    creator_game = Game(user_id=duel.creator_id, rounds_count=duel.rounds_count, themes_json=duel.themes_json)
-    opponent_game = Game(user_id=duel.opponent_id, rounds_count=duel.rounds_count, themes_json=duel.themes_json)
+    creator_game = Game(user_id=duel.creator_id, rounds_count=duel.rounds_count, themes_json=duel.themes_json, mode="duel")
+    opponent_game = Game(user_id=duel.opponent_id, rounds_count=duel.rounds_count, themes_json=duel.themes_json, mode="duel")
     db.session.add_all([creator_game, opponent_game])
-    db.session.commit()
+    db.session.flush()
 
     flash("Você entrou no duelo!", "success")
     return redirect(url_for("game_play", game_id=opponent_game.id))
@@ -442,7 +1818,7 @@ def duel_wait(duel_id):
         return redirect(url_for("login"))
 
     duel = Duel.query.get_or_404(duel_id)
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     # Se for requisição AJAX
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
@@ -473,7 +1849,7 @@ def weekly_event():
     if not require_login():
         return redirect(url_for("login"))
     
-    user = User.query.get(session["user_id"])
+    user = current_user()
     today = datetime.utcnow().date()
     
     # Pega evento ativo
@@ -492,7 +1868,7 @@ def weekly_event_start():
     if not require_login():
         return redirect(url_for("login"))
 
-    user = User.query.get(session["user_id"])
+    user = current_user()
     if not user:
         flash("Usuário não encontrado.", "danger")
         return redirect(url_for("login"))
@@ -517,12 +1893,11 @@ def weekly_event_start():
     # Cria jogo (10 rodadas para evento semanal)
     g = Game(
         user_id=user.id,
-        rounds_count=10,
+        rounds_count=WEEKLY_ROUNDS,
         themes_json=json.dumps([key for key, _ in THEMES]),
         mode="weekly"
     )
     db.session.add(g)
-    db.session.commit()
 
     # Registra a participação na tabela weekly_scores
     score_entry = WeeklyScore(
@@ -532,7 +1907,7 @@ def weekly_event_start():
         play_date=today
     )
     db.session.add(score_entry)
-    db.session.commit()
+    db.session.flush()
 
     flash("Desafio semanal iniciado!", "success")
     return redirect(url_for("game_play", game_id=g.id))
@@ -542,6 +1917,133 @@ def weekly_event_start():
 
 
 
+# ----------------------
+# Baralho diário do evento semanal
+# ----------------------
+WEEKLY_ROUNDS = 10
+
+# O baralho do dia nunca muda, nem o evento de uma partida: depois da primeira
+# leitura, uma rodada semanal só consulta estes dicionários. Leituras são sem
+# trava; toda escrita (e a limpeza dos dias anteriores) é feita com ela.
+weekly_deck_cache = {}    # (event_id, dia) -> ids das cartas
+weekly_game_events = {}   # game_id -> (event_id, dia)
+weekly_cache_lock = threading.Lock()
+
+
+def build_weekly_deck(rounds=WEEKLY_ROUNDS):
+    themes = [key for key, _ in THEMES]
+    per_theme = {}
+    for i in range(rounds):
+        theme = themes[i % len(themes)]
+        per_theme[theme] = per_theme.get(theme, 0) + 1
+
+    # Um sorteio por tema, uma vez por dia
+    picked = {}
+    for theme, n in per_theme.items():
+        if card_catalog.available():
+            ids = []
+            for _ in range(n):
+                card_id = card_catalog.random_card_id(theme, exclude=ids, difficulty=1)
+                if card_id is not None:
+                    ids.append(card_id)
+        else:
+            ids = [
+                card_id for (card_id,) in
+                db.session.query(Card.id).filter(Card.theme == theme)
+                .order_by(Card.difficulty, db.func.random()).limit(n)
+            ]
+        picked[theme] = ids
+
+    deck = []
+    for i in range(rounds):
+        ids = picked[themes[i % len(themes)]]
+        if ids:
+            deck.append(ids.pop(0))
+    return deck
+
+
+def weekly_event_for_game(g):
+    """Evento da partida semanal: a inscrição em weekly_scores é criada junto com o jogo."""
+    return (
+        WeeklyEvent.query.join(WeeklyScore, WeeklyScore.event_id == WeeklyEvent.id)
+        .filter(WeeklyScore.player_id == g.user_id, WeeklyScore.play_date == g.created_at.date())
+        .order_by(WeeklyScore.id.desc())
+        .first()
+    ) or active_weekly_event()
+
+
+def weekly_event_id_for_game(g):
+    """Id do evento da partida semanal; o banco é consultado uma vez por partida."""
+    cached = weekly_game_events.get(g.id)
+    if cached is not None:
+        return cached[0]
+    event = weekly_event_for_game(g)
+    if not event:
+        return None
+    with weekly_cache_lock:
+        weekly_game_events[g.id] = (event.id, g.created_at.date())
+    return event.id
+
+
+def record_weekly_points(g, points):
+    """Soma os pontos da rodada na inscrição do desafio e no ranking semanal em memória."""
+    event_id = weekly_event_id_for_game(g)
+    if not event_id:
+        return
+    play_date, user_id = g.created_at.date(), g.user_id
+    updated = db.session.execute(
+        update(WeeklyScore)
+        .where(WeeklyScore.event_id == event_id, WeeklyScore.player_id == user_id, WeeklyScore.play_date == play_date)
+        .values(score=func.coalesce(WeeklyScore.score, 0) + points)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if updated:
+        period = (event_id, play_date - timedelta(days=play_date.weekday()))
+        after_commit(lambda: rank_boards.add("weekly", user_id, points, period=period))
+
+
+def weekly_deck_for(event_id, play_date):
+    """Baralho compartilhado do evento no dia: cache local, depois banco, depois sorteio.
+
+    O sorteio é gravado numa conexão própria; a restrição única em
+    (event_id, play_date) garante que só um worker vence e os outros leem o dele.
+    Retorna None se não houver evento.
+    """
+    if not event_id:
+        return None
+    deck = weekly_deck_cache.get((event_id, play_date))
+    if deck is not None:
+        return deck
+
+    row = WeeklyDeck.query.filter_by(event_id=event_id, play_date=play_date).first()
+    if row is None:
+        deck = build_weekly_deck()
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(WeeklyDeck).values(
+                    event_id=event_id, play_date=play_date, cards_json=json.dumps(deck)
+                ))
+        except IntegrityError:
+            # Outro worker gravou antes; a sessão não foi tocada, só a conexão própria
+            row = WeeklyDeck.query.filter_by(event_id=event_id, play_date=play_date).one()
+            deck = json.loads(row.cards_json)
+    else:
+        deck = json.loads(row.cards_json)
+
+    with weekly_cache_lock:
+        # Descarta baralhos e partidas de dias anteriores
+        for old in [key for key in weekly_deck_cache if key[1] < play_date]:
+            del weekly_deck_cache[old]
+        for old in [game_id for game_id, (_, day) in weekly_game_events.items() if day < play_date]:
+            del weekly_game_events[old]
+        weekly_deck_cache[(event_id, play_date)] = deck
+    return deck
+
+
+def active_weekly_event():
+    return WeeklyEvent.query.filter_by(is_active=True).first()
+
+
 @app.route("/game_finish/<int:game_id>")
 def game_finish(game_id):
     # Pega o jogo
@@ -589,8 +2091,6 @@ def game_finish(game_id):
                 db.session.add(weekly_score)
                 print(f"Criando score do jogador {user.id} com {final_score}")
 
-            db.session.commit()
-
         flash(f"Jogo finalizado! Você marcou {final_score} pontos no evento semanal.", "success")
         return redirect(url_for("weekly_result", event_id=event.id))
 
@@ -667,19 +2167,11 @@ def game_duel_setup():
     if not require_login():
         return redirect(url_for("login"))
 
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     if request.method == "POST":
         # Custo do duelo
         cost = 5
-        if user.coins < cost:
-            flash(f"Você precisa de {cost} moedas para criar um duelo.", "warning")
-            return redirect(url_for("game_duel_setup"))
-
-        # Deduz as moedas
-        user.coins -= cost
-        db.session.commit()
-        flash(f"Você gastou {cost} moedas para criar o duelo.", "info")
 
         selected = request.form.getlist("themes")
         valid_themes = [key for key, _ in THEMES]
@@ -688,6 +2180,12 @@ def game_duel_setup():
             flash("Selecione ao menos um tema.", "warning")
             return redirect(url_for("game_duel_setup"))
 
+        # Deduz as moedas
+        if debit(user, cost, "duel_create") is None:
+            flash(f"Você precisa de {cost} moedas para criar um duelo.", "warning")
+            return redirect(url_for("game_duel_setup"))
+        flash(f"Você gastou {cost} moedas para criar o duelo.", "info")
+
         rounds_count = int(request.form.get("rounds", 3))
 
         duel_code = str(uuid.uuid4())[:8].upper()
@@ -699,7 +2197,6 @@ def game_duel_setup():
             status="waiting"
         )
         db.session.add(duel)
-        db.session.commit()
 
         # Cria imediatamente o jogo do criador, mas sem começar o duelo ainda
         creator_game = Game(
@@ -709,7 +2206,7 @@ def game_duel_setup():
             mode="duel"
         )
         db.session.add(creator_game)
-        db.session.commit()
+        db.session.flush()
 
         flash(f"Duelo criado! Compartilhe o código: {duel_code}", "info")
 
@@ -726,14 +2223,11 @@ def duel_join_page():
     if not require_login():
         return redirect(url_for("login"))
 
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     if request.method == "POST":
         # Custo para entrar no duelo
         cost = 5
-        if user.coins < cost:
-            flash(f"Você precisa de {cost} moedas para entrar no duelo.", "warning")
-            return redirect(url_for("duel_join_page"))
 
         code = request.form.get("code", "").strip().upper()
         duel = Duel.query.filter_by(code=code, status="waiting").first()
@@ -746,13 +2240,13 @@ def duel_join_page():
             return redirect(url_for("duel_join_page"))
 
         # Deduz as moedas do oponente
-        user.coins -= cost
-        db.session.commit()
+        if debit(user, cost, "duel_join") is None:
+            flash(f"Você precisa de {cost} moedas para entrar no duelo.", "warning")
+            return redirect(url_for("duel_join_page"))
         flash(f"Você gastou {cost} moedas para entrar no duelo.", "info")
 
         duel.opponent_id = user.id
         duel.status = "active"
-        db.session.commit()
 
         # Cria o jogo do criador se ainda não existir
         creator_game = Game.query.filter_by(
@@ -777,7 +2271,7 @@ def duel_join_page():
             mode="duel"
         )
         db.session.add(opponent_game)
-        db.session.commit()
+        db.session.flush()
 
         flash(f"Duelo iniciado! Boa sorte!", "success")
         return redirect(url_for("game_play", game_id=opponent_game.id))
@@ -787,48 +2281,536 @@ def duel_join_page():
 
 
 
-@app.route("/duel/result/<int:duel_id>")
-def duel_result(duel_id):
-    # Busca o duelo ou retorna 404 se não existir
-    duel = Duel.query.get_or_404(duel_id)
-    
-    # Pega os jogos mais recentes de cada jogador
-    creator_game = Game.query.filter_by(user_id=duel.creator_id).order_by(Game.id.desc()).first()
-    opponent_game = Game.query.filter_by(user_id=duel.opponent_id).order_by(Game.id.desc()).first()
+# ----------------------
+# Matchmaking (duelo por nível)
+# ----------------------
+MATCHMAKING_COST = 5
+MATCHMAKING_ROUNDS = 3
+MATCH_BASE_WINDOW = 1        # diferença de nível aceita logo de início
+MATCH_WIDEN_EVERY = 5        # a cada N segundos de espera a janela cresce 1 nível
+MATCH_MAX_WINDOW = 50
+MATCHMAKING_REFRESH = 1.0    # segundos entre leituras incrementais da fila no banco
+MATCHMAKING_FULL_RELOAD = 30.0
+
+
+class LevelQueue:
+    """Fila de espera ordenada por nível.
+
+    Cada nível tem um bucket em ordem de chegada e a lista de níveis distintos
+    fica ordenada. Achar o adversário mais próximo é uma busca binária nessa
+    lista; entrar ou sair de um nível que já tem gente é O(1). Só o primeiro a
+    entrar num nível (ou o último a sair) move a lista, em O(k) com k níveis
+    distintos: os níveis são inteiros pequenos, então k fica em algumas
+    centenas mesmo com milhares de jogadores na fila.
+    """
+
+    def __init__(self):
+        self.levels = []    # níveis distintos, ordenados
+        self.buckets = {}   # nível -> {entry_id: (user_id, enqueued_at)}
+        self.where = {}     # entry_id -> nível
+
+    def __len__(self):
+        return len(self.where)
+
+    def add(self, entry_id, user_id, level, enqueued_at):
+        if entry_id in self.where:
+            return
+        bucket = self.buckets.get(level)
+        if bucket is None:
+            bucket = self.buckets[level] = {}
+            bisect.insort(self.levels, level)
+        bucket[entry_id] = (user_id, enqueued_at)
+        self.where[entry_id] = level
+
+    def remove(self, entry_id):
+        level = self.where.pop(entry_id, None)
+        if level is None:
+            return
+        bucket = self.buckets[level]
+        bucket.pop(entry_id, None)
+        if not bucket:
+            del self.buckets[level]
+            del self.levels[bisect.bisect_left(self.levels, level)]
+
+    def clear(self):
+        self.levels.clear()
+        self.buckets.clear()
+        self.where.clear()
+
+    def closest(self, level, window, exclude_user_id=None):
+        """Entrada mais antiga do nível mais próximo dentro da janela."""
+        i = bisect.bisect_left(self.levels, level)
+        lo, hi = i - 1, i
+        while True:
+            left = self.levels[lo] if lo >= 0 else None
+            right = self.levels[hi] if hi < len(self.levels) else None
+            if left is not None and level - left > window:
+                left = None
+            if right is not None and right - level > window:
+                right = None
+            if left is None and right is None:
+                return None
+            # Prefere o nível com menor diferença
+            if right is not None and (left is None or right - level <= level - left):
+                candidate_level, hi = right, hi + 1
+            else:
+                candidate_level, lo = left, lo - 1
+            for entry_id, (user_id, enqueued_at) in self.buckets[candidate_level].items():
+                if user_id != exclude_user_id:
+                    return entry_id, user_id, candidate_level
+
+
+class MatchmakingCache:
+    """Cópia local da fila do banco, compartilhada pelas threads do worker.
+
+    O banco é a fonte da verdade: o cache só lê entradas novas (id maior que o
+    último visto) e descobre entradas já pareadas por outro worker quando a
+    reserva condicional falha.
+    """
+
+    def __init__(self):
+        self.queue = LevelQueue()
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.refreshed_at = 0.0
+        self.reloaded_at = 0.0
+
+    def refresh(self, force=False):
+        """Lê a fila do banco fora do lock; só a troca do conteúdo é feita com ele."""
+        now = time.monotonic()
+        if not force and now - self.refreshed_at < MATCHMAKING_REFRESH:
+            return
+        self.refreshed_at = now
+        full = force or now - self.reloaded_at >= MATCHMAKING_FULL_RELOAD
+        q = db.session.query(
+            MatchmakingEntry.id, MatchmakingEntry.user_id,
+            MatchmakingEntry.level, MatchmakingEntry.enqueued_at,
+        ).filter(MatchmakingEntry.duel_id.is_(None))
+        if not full:
+            q = q.filter(MatchmakingEntry.id > self.last_id)
+        rows = q.order_by(MatchmakingEntry.id).all()
+        with self.lock:
+            if full:
+                self.queue.clear()
+                self.last_id = 0
+                self.reloaded_at = now
+            for entry_id, user_id, level, enqueued_at in rows:
+                self.queue.add(entry_id, user_id, level, enqueued_at)
+                self.last_id = max(self.last_id, entry_id)
+
+
+matchmaking_cache = MatchmakingCache()
+
+
+def match_window(entry):
+    waited = (datetime.utcnow() - entry.enqueued_at).total_seconds()
+    return min(MATCH_BASE_WINDOW + int(waited // MATCH_WIDEN_EVERY), MATCH_MAX_WINDOW)
+
+
+def try_match(entry):
+    """Tenta parear a entrada com o jogador de nível mais próximo.
+
+    Devolve o duelo criado ou None. O par é escolhido no cache com o lock e
+    reservado tirando as duas entradas dele; o banco é escrito já sem o lock.
+    A reserva no banco é um DELETE condicional das duas entradas, na mesma
+    transação do duelo, então dois workers nunca pareiam o mesmo jogador e
+    nenhuma entrada pareada fica na fila. Quem esperava descobre o duelo por
+    pending_match_game.
+    """
+    entry_id, user_id, level, enqueued_at = entry.id, entry.user_id, entry.level, entry.enqueued_at
+    if entry.duel_id:
+        # Entrada pareada antes das entradas serem apagadas no pareamento
+        duel = entry.duel
+        db.session.delete(entry)
+        db.session.commit()
+        return duel
+
+    cache = matchmaking_cache
+    cache.refresh()
+    window = match_window(entry)
+
+    while True:
+        with cache.lock:
+            cache.queue.add(entry_id, user_id, level, enqueued_at)
+            found = cache.queue.closest(level, window, exclude_user_id=user_id)
+            if not found:
+                return None
+            other_id, other_user_id, _ = found
+            cache.queue.remove(entry_id)
+            cache.queue.remove(other_id)
+
+        themes = [key for key, _ in THEMES]
+        duel = Duel(
+            creator_id=other_user_id,  # quem esperava mais vira o criador
+            opponent_id=user_id,
+            themes_json=json.dumps(themes),
+            rounds_count=MATCHMAKING_ROUNDS,
+            code=str(uuid.uuid4())[:8].upper(),
+            status="active",
+        )
+        db.session.add(duel)
+        db.session.flush()
+
+        claimed = (
+            MatchmakingEntry.query
+            .filter(MatchmakingEntry.id.in_([entry_id, other_id]), MatchmakingEntry.duel_id.is_(None))
+            .delete(synchronize_session=False)
+        )
+        if claimed != 2:
+            # Outro worker chegou antes: desfaz e tenta o próximo candidato
+            db.session.rollback()
+            if db.session.query(MatchmakingEntry.id).filter_by(id=entry_id).first() is None:
+                # A entrada sumiu: pareada por outro worker ou cancelada em outra aba
+                return matched_duel_since(user_id, enqueued_at)
+            continue
+
+        db.session.add_all([
+            Game(user_id=duel.creator_id, rounds_count=duel.rounds_count, themes_json=duel.themes_json, mode="duel"),
+            Game(user_id=duel.opponent_id, rounds_count=duel.rounds_count, themes_json=duel.themes_json, mode="duel"),
+        ])
+        db.session.commit()
+        return duel
+
+
+def matched_duel_since(user_id, since):
+    """Duelo ativo do usuário criado depois de since (o pareamento da entrada), ou None."""
+    return (
+        Duel.query
+        .filter((Duel.creator_id == user_id) | (Duel.opponent_id == user_id),
+                Duel.status == "active", Duel.created_at >= since)
+        .order_by(Duel.id.desc())
+        .first()
+    )
+
+
+def pending_match_game(user_id):
+    """Partida de duelo ainda não começada de um pareamento já feito, ou None."""
+    duel = find_user_duel(user_id)
+    if duel is None or duel.status != "active":
+        return None
+    game = latest_duel_game(user_id)
+    return game if game and game.status != "finished" and not game.rounds else None
+
+
+def latest_duel_game(user_id):
+    return Game.query.filter_by(user_id=user_id, mode="duel").order_by(Game.id.desc()).first()
+
+
+@app.route("/duel/matchmaking", methods=["GET", "POST"])
+@manual_commit
+def duel_matchmaking():
+    if not require_login():
+        return redirect(url_for("login"))
+
+    user = current_user()
+    entry = MatchmakingEntry.query.filter_by(user_id=user.id).first()
+
+    if request.method == "POST" and not entry:
+        if debit(user, MATCHMAKING_COST, "matchmaking") is None:
+            flash(f"Você precisa de {MATCHMAKING_COST} moedas para procurar um adversário.", "warning")
+            return redirect(url_for("game_duel_setup"))
+
+        entry = MatchmakingEntry(user_id=user.id, level=user.level or 1)
+        db.session.add(entry)
+        db.session.commit()
+        flash(f"Você gastou {MATCHMAKING_COST} moedas para procurar um adversário.", "info")
+
+    if not entry:
+        # Pareado por outro jogador enquanto esperava
+        game = pending_match_game(user.id)
+        if game:
+            flash("Adversário encontrado! Boa sorte!", "success")
+            return redirect(url_for("game_play", game_id=game.id))
+        return redirect(url_for("game_duel_setup"))
+
+    duel = try_match(entry)
+    if duel:
+        flash("Adversário encontrado! Boa sorte!", "success")
+        return redirect(url_for("game_play", game_id=latest_duel_game(user.id).id))
+
+    return render_template("duel_matchmaking.html", user=user, window=match_window(entry))
+
+
+@app.route("/duel/matchmaking/status")
+@manual_commit
+def duel_matchmaking_status():
+    if "user_id" not in session:
+        return {"status": "login_required"}, 401
+
+    entry = MatchmakingEntry.query.filter_by(user_id=session["user_id"]).first()
+    if not entry:
+        game = pending_match_game(session["user_id"])
+        return {"status": "matched", "game_id": game.id} if game else {"status": "idle"}
+
+    duel = try_match(entry)
+    if duel:
+        return {"status": "matched", "game_id": latest_duel_game(session["user_id"]).id}
+
+    return {"status": "waiting", "window": match_window(entry)}
+
 
-    # Pontuação de cada jogador (0 se não houver jogo)
-    creator_score = creator_game.user_score if creator_game else 0
-    opponent_score = opponent_game.user_score if opponent_game else 0
+@app.route("/duel/matchmaking/cancel", methods=["POST"])
+@manual_commit
+def duel_matchmaking_cancel():
+    if not require_login():
+        return redirect(url_for("login"))
+
+    entry = MatchmakingEntry.query.filter_by(user_id=session["user_id"], duel_id=None).first()
+    if entry:
+        entry_id = entry.id
+        # Remoção condicional: se já foi pareado em outro worker, não devolve
+        removed = (
+            MatchmakingEntry.query
+            .filter(MatchmakingEntry.id == entry_id, MatchmakingEntry.duel_id.is_(None))
+            .delete(synchronize_session=False)
+        )
+        if removed:
+            credit(current_user(), MATCHMAKING_COST, "matchmaking_refund")
+            flash("Busca cancelada. Suas moedas foram devolvidas.", "info")
+        db.session.commit()
+        with matchmaking_cache.lock:
+            matchmaking_cache.queue.remove(entry_id)
+
+    return redirect(url_for("game_duel_setup"))
+
+
+# ----------------------
+# Progresso ao vivo do duelo (SSE)
+# ----------------------
+DUEL_STREAM_POLL = 0.5        # intervalo da leitura única de duel_events por worker
+DUEL_STREAM_KEEPALIVE = 15    # segundos entre comentários de keep-alive
+DUEL_RESULT_MAX_AGE = 300     # segundos de cache do resultado de um duelo encerrado
+
+
+class DuelHub:
+    """Publish/subscribe em memória para os eventos de duelo.
+
+    Cada conexão SSE é só uma fila local. Uma única thread por worker lê
+    duel_events de forma incremental e distribui para as filas, então o custo
+    no banco não cresce com o número de espectadores. Eventos publicados no
+    próprio worker chegam na hora via publish().
+    """
+
+    def __init__(self):
+        self.subscribers = {}  # duel_id -> set(queue.Queue)
+        self.lock = threading.Lock()
+        self.last_id = None
+        self.thread = None
+
+    def subscribe(self, duel_id):
+        q = queue.Queue()
+        with self.lock:
+            self.subscribers.setdefault(duel_id, set()).add(q)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._poll, daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, duel_id, q):
+        with self.lock:
+            subs = self.subscribers.get(duel_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self.subscribers[duel_id]
+
+    def publish(self, duel_id, event):
+        with self.lock:
+            subs = list(self.subscribers.get(duel_id, ()))
+        for q in subs:
+            q.put(event)
+
+    def _poll(self):
+        with app.app_context():
+            if self.last_id is None:
+                self.last_id = db.session.query(func.max(DuelEvent.id)).scalar() or 0
+            while True:
+                with self.lock:
+                    duel_ids = list(self.subscribers)
+                    if not duel_ids:
+                        # Sob a mesma trava de subscribe(): quem se inscrever
+                        # depois daqui vê thread None e sobe outro leitor
+                        self.thread = None
+                        break
+                try:
+                    rows = (
+                        DuelEvent.query
+                        .filter(DuelEvent.id > self.last_id, DuelEvent.duel_id.in_(duel_ids))
+                        .order_by(DuelEvent.id)
+                        .all()
+                    )
+                    for ev in rows:
+                        self.last_id = max(self.last_id, ev.id)
+                        self.publish(ev.duel_id, ev.to_dict())
+                finally:
+                    db.session.remove()
+                time.sleep(DUEL_STREAM_POLL)
+
+
+duel_hub = DuelHub()
+
+
+def find_user_duel(user_id):
+    return Duel.query.filter(
+        ((Duel.creator_id == user_id) | (Duel.opponent_id == user_id)),
+        Duel.status.in_(["active", "finished"])
+    ).order_by(Duel.id.desc()).first()
+
+
+def record_duel_event(game, r, kind):
+    """Registra o fim de uma rodada de duelo e publica depois do commit."""
+    if game.mode != "duel":
+        return None
+    duel = find_user_duel(game.user_id)
+    if not duel:
+        return None
+    duel_id = duel.id
+    ev = DuelEvent(duel_id=duel_id, user_id=game.user_id, round_number=r.number, kind=kind, points=r.user_points or 0)
+    db.session.add(ev)
+    db.session.flush()
+    event = ev.to_dict()
+    # Só valores locais: depois do commit ev está expirado e lê-lo faria um SELECT
+    after_commit(lambda: duel_hub.publish(duel_id, event))
+    return ev
+
+
+def finish_game(g):
+    """Marca a partida como encerrada e, se for a segunda de um duelo, finaliza o duelo."""
+    g.status = "finished"
+    if g.mode == "duel":
+        finalize_duel(g.user_id)
+
+
+def finalize_duel(user_id):
+    """Grava o resultado do duelo uma única vez, quando as duas partidas terminaram.
+
+    A linha do duelo é travada (FOR UPDATE no PostgreSQL) para que os dois
+    jogadores terminando juntos não deixem cada um de ver a partida do outro;
+    a transição active -> finished é um UPDATE condicional, então só quem o
+    vence grava placar, vencedor e badges.
+    """
+    duel = db.session.execute(
+        select(Duel)
+        .where((Duel.creator_id == user_id) | (Duel.opponent_id == user_id), Duel.status == "active")
+        .order_by(Duel.id.desc())
+        .limit(1)
+        .with_for_update()
+    ).scalar()
+    if duel is None or duel.opponent_id is None:
+        return None
+
+    games = [latest_duel_game(duel.creator_id), latest_duel_game(duel.opponent_id)]
+    if not all(game and game.status == "finished" for game in games):
+        return None
+
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Duel)
+        .where(Duel.id == duel.id, Duel.status == "active")
+        .values(status="finished", finished_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed != 1:
+        return None
+    set_committed_value(duel, "status", "finished")
+    set_committed_value(duel, "finished_at", now)
+    bump_daily("duels_finished")
+
+    creator_score, opponent_score = (game.user_score or 0 for game in games)
+    if creator_score != opponent_score:
+        duel.winner_id = duel.creator_id if creator_score > opponent_score else duel.opponent_id
+
+    badges = db.session.execute(
+        select(Badge.name, Badge.level_required).order_by(Badge.level_required.desc())
+    ).all()
+
+    def get_badge(score):
+        return next((name for name, level in badges if score >= level), "")
 
-    # Atualiza a tabela DuelScore
-    DuelScore.query.filter_by(duel_id=duel.id).delete()
     db.session.add_all([
-        DuelScore(duel_id=duel.id, user_id=duel.creator_id, score=creator_score),
-        DuelScore(duel_id=duel.id, user_id=duel.opponent_id, score=opponent_score)
+        DuelScore(duel_id=duel.id, user_id=duel.creator_id, score=creator_score, badge=get_badge(creator_score)),
+        DuelScore(duel_id=duel.id, user_id=duel.opponent_id, score=opponent_score, badge=get_badge(opponent_score)),
     ])
-    db.session.commit()
+    return duel
 
-    # Determina o vencedor
-    winner = None
-    if creator_score > opponent_score:
-        winner = duel.creator
-    elif opponent_score > creator_score:
-        winner = duel.opponent
 
-    # Pega badges do banco
-    def get_badge(score):
-        badge = ""
-        badges = Badge.query.order_by(Badge.level_required.desc()).all()
-        for b in badges:
-            if score >= b.level_required:
-                badge = b.name
-                break
-        return badge
+def sse_format(event):
+    return f"id: {event['id']}\nevent: round\ndata: {json.dumps(event)}\n\n"
 
-    creator_badge = get_badge(creator_score)
-    opponent_badge = get_badge(opponent_score)
 
-    return render_template(
+@app.route("/duel/<int:duel_id>/stream")
+@manual_commit
+def duel_stream(duel_id):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+
+    user_id = session["user_id"]
+    duel = Duel.query.get_or_404(duel_id)
+    if user_id not in (duel.creator_id, duel.opponent_id):
+        return {"error": "forbidden"}, 403
+
+    # Reenvia o que o cliente perdeu (reconexão) numa única consulta
+    try:
+        last_seen = int(request.headers.get("Last-Event-ID") or request.args.get("last_id") or 0)
+    except ValueError:
+        last_seen = 0
+    backlog = [
+        ev.to_dict() for ev in
+        DuelEvent.query.filter(DuelEvent.duel_id == duel_id, DuelEvent.id > last_seen).order_by(DuelEvent.id)
+    ]
+    # Libera a conexão do pool; o stream não precisa mais do banco
+    db.session.close()
+
+    q = duel_hub.subscribe(duel_id)
+
+    def generate():
+        sent = last_seen
+        try:
+            yield "retry: 3000\n\n"
+            pending = backlog
+            while True:
+                for event in pending:
+                    if event["id"] > sent and event["user_id"] != user_id:
+                        yield sse_format(event)
+                    sent = max(sent, event["id"])
+                try:
+                    pending = [q.get(timeout=DUEL_STREAM_KEEPALIVE)]
+                except queue.Empty:
+                    pending = []
+                    yield ": keep-alive\n\n"
+        finally:
+            duel_hub.unsubscribe(duel_id, q)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/duel/result/<int:duel_id>")
+def duel_result(duel_id):
+    # Só leitura: o resultado é gravado uma vez em finalize_duel
+    duel = Duel.query.get_or_404(duel_id)
+    scores = {s.user_id: s for s in DuelScore.query.filter_by(duel_id=duel.id)}
+    stored = duel.status == "finished" and bool(scores)
+    winner = duel.winner
+
+    if stored:
+        creator, opponent = scores.get(duel.creator_id), scores.get(duel.opponent_id)
+        creator_score, opponent_score = creator.score, opponent.score
+        creator_badge, opponent_badge = creator.badge, opponent.badge
+    else:
+        # Duelo em andamento (ou antigo, sem placar gravado): placar das partidas, sem badges
+        creator_game = latest_duel_game(duel.creator_id)
+        opponent_game = latest_duel_game(duel.opponent_id) if duel.opponent_id else None
+        creator_score = creator_game.user_score if creator_game else 0
+        opponent_score = opponent_game.user_score if opponent_game else 0
+        creator_badge = opponent_badge = ""
+        if duel.status == "finished" and creator_score != opponent_score:
+            winner = duel.creator if creator_score > opponent_score else duel.opponent
+
+    response = app.make_response(render_template(
         "duel_result.html",
         duel=duel,
         creator_score=creator_score,
@@ -836,16 +2818,494 @@ def duel_result(duel_id):
         winner=winner,
         creator_badge=creator_badge,
         opponent_badge=opponent_badge
+    ))
+    if stored:
+        # O resultado não muda mais e é igual para os dois jogadores
+        response.headers["Cache-Control"] = f"private, max-age={DUEL_RESULT_MAX_AGE}"
+        response.set_etag(f"duel-{duel.id}-{duel.finished_at.isoformat() if duel.finished_at else ''}")
+        return response.make_conditional(request)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+
+# ----------------------
+# Torneios (mata-mata e suíço)
+# ----------------------
+# Cada fase gera todas as partidas de uma vez: os jogos (Game, modo
+# "tournament") e as partidas entram em INSERTs em lote, e as duas pessoas de
+# uma partida jogam o mesmo baralho. Avançar a fase é um punhado de UPDATEs
+# por conjunto (placar -> vencedor -> jogadores) na mesma transação.
+TOURNAMENT_FORMATS = {"single": "Mata-mata", "swiss": "Suíço"}
+
+
+def tournament_card_pool(themes):
+    """Ids das cartas de cada tema, carregados uma vez por fase."""
+    if card_catalog.available():
+        return {theme: [card_id for card_id, _ in card_catalog.theme_cards(theme)] for theme in themes}
+    pool = {theme: [] for theme in themes}
+    for card_id, theme in db.session.query(Card.id, Card.theme).filter(Card.theme.in_(themes)):
+        pool[theme].append(card_id)
+    return pool
+
+
+def tournament_deck(themes, rounds, pool):
+    deck = []
+    for i in range(rounds):
+        ids = pool[themes[i % len(themes)]]
+        if not ids:
+            continue
+        card_id = random.choice(ids)
+        # Evita repetir carta no mesmo baralho quando o tema permite
+        for _ in range(3):
+            if card_id not in deck:
+                break
+            card_id = random.choice(ids)
+        deck.append(card_id)
+    return deck
+
+
+def tournament_pairs(t, stage):
+    """Lista de (jogador_a, jogador_b ou None) da fase, jogador_a sempre o melhor colocado."""
+    tp = TournamentPlayer
+    if t.format == "single" and stage > 1:
+        # Vencedores na ordem da chave: slot 2k enfrenta slot 2k+1
+        players = list(db.session.scalars(
+            select(TournamentMatch.winner_id)
+            .where(TournamentMatch.tournament_id == t.id, TournamentMatch.stage == stage - 1)
+            .order_by(TournamentMatch.slot)
+        ))
+        pairs = [(players[i], players[i + 1]) for i in range(0, len(players) - 1, 2)]
+        if len(players) % 2:
+            pairs.append((players[-1], None))
+        return pairs
+
+    players = list(db.session.scalars(
+        select(tp.user_id)
+        .where(tp.tournament_id == t.id, tp.alive.is_(True))
+        .order_by(tp.points.desc(), tp.seed)
+    ))
+
+    if t.format == "single":
+        # Primeira fase: chave padrão em potência de 2 (1x16, 8x9, ... na ordem
+        # que separa as cabeças de chave); sementes além dos inscritos viram folga
+        size = 1 << max(len(players) - 1, 0).bit_length()
+        order = [1]
+        while len(order) < size:
+            mirror = 2 * len(order) + 1
+            order = [seed for s in order for seed in (s, mirror - s)]
+        return [
+            (players[a - 1], players[b - 1] if b <= len(players) else None)
+            for a, b in zip(order[::2], order[1::2])
+        ]
+
+    # Suíço: cruza vizinhos na classificação, pulando quem já se enfrentou
+    played = set(db.session.execute(
+        select(TournamentMatch.player_a_id, TournamentMatch.player_b_id)
+        .where(TournamentMatch.tournament_id == t.id, TournamentMatch.player_b_id.isnot(None))
+    ).tuples())
+
+    bye = None
+    if len(players) % 2:
+        had_bye = {
+            user_id for (user_id,) in
+            db.session.query(TournamentMatch.player_a_id)
+            .filter(TournamentMatch.tournament_id == t.id, TournamentMatch.player_b_id.is_(None))
+        }
+        bye = next((u for u in reversed(players) if u not in had_bye), players[-1])
+        players.remove(bye)
+
+    # Pilha com o líder no fim: pop() e a busca do adversário só mexem na ponta
+    pairs = []
+    waiting = players[::-1]
+    while waiting:
+        a = waiting.pop()
+        j = next((j for j in range(len(waiting) - 1, max(len(waiting) - 8, -1), -1)
+                  if (a, waiting[j]) not in played and (waiting[j], a) not in played), len(waiting) - 1)
+        pairs.append((a, waiting.pop(j)))
+    if bye is not None:
+        pairs.append((bye, None))
+    return pairs
+
+
+def create_tournament_stage(t, stage):
+    """Gera jogos e partidas da fase com INSERTs em lote."""
+    pairs = tournament_pairs(t, stage)
+    themes, rounds, tournament_id = t.themes, t.rounds_per_match, t.id
+    pool = tournament_card_pool(themes)
+    now = datetime.utcnow()
+
+    game_row = {
+        "rounds_count": rounds, "themes_json": t.themes_json,
+        "mode": "tournament", "status": "active", "user_score": 0, "created_at": now,
+    }
+    game_rows = [
+        {**game_row, "user_id": user_id}
+        for a, b in pairs if b is not None
+        for user_id in (a, b)
+    ]
+    # Cada jogador tem um único jogo por fase, então o RETURNING não precisa
+    # preservar a ordem (o que forçaria um INSERT por linha no SQLite)
+    game_of = {}
+    if game_rows:
+        game_of = dict(
+            (user_id, game_id) for game_id, user_id in
+            db.session.execute(insert(Game.__table__).returning(Game.id, Game.user_id), game_rows)
+        )
+
+    match_rows = []
+    for slot, (a, b) in enumerate(pairs):
+        row = {
+            "tournament_id": tournament_id, "stage": stage, "slot": slot,
+            "player_a_id": a, "player_b_id": b,
+            "game_a_id": None, "game_b_id": None, "deck_json": None,
+            "winner_id": a if b is None else None,
+        }
+        if b is not None:
+            row["game_a_id"], row["game_b_id"] = game_of[a], game_of[b]
+            row["deck_json"] = json.dumps(tournament_deck(themes, rounds, pool))
+        match_rows.append(row)
+    if match_rows:
+        db.session.execute(insert(TournamentMatch.__table__), match_rows)
+    bump_daily("games:tournament", len(game_rows))
+
+    t.stage = stage
+    return len(pairs)
+
+
+def start_tournament(t):
+    """Fecha as inscrições, define as cabeças de chave pelo nível e gera a 1ª fase."""
+    tp = TournamentPlayer
+    players = db.session.query(func.count(tp.id)).filter(tp.tournament_id == t.id).scalar()
+    if players < 2:
+        return False
+
+    # Sementes numa única instrução (UPDATE ... FROM com row_number)
+    ranked = (
+        select(tp.id, func.row_number().over(order_by=(User.level.desc(), tp.id)).label("seed"))
+        .join(User, User.id == tp.user_id)
+        .where(tp.tournament_id == t.id)
+        .subquery()
     )
+    db.session.execute(
+        update(tp).where(tp.id == ranked.c.id).values(seed=ranked.c.seed)
+        .execution_options(synchronize_session=False)
+    )
+    t.status = "running"
+    t.total_stages = (players - 1).bit_length()
+    create_tournament_stage(t, 1)
+    return True
 
 
+def advance_tournament(t):
+    """Encerra a fase atual (placar dos jogos decide) e gera a próxima.
+
+    Jogos não terminados contam com o placar que tiverem. Empate favorece o
+    melhor colocado (jogador_a). Tudo roda na transação da requisição/comando.
+    """
+    tm, tp = TournamentMatch, TournamentPlayer
+    in_stage = (tm.tournament_id == t.id, tm.stage == t.stage)
+
+    stage_games = select(tm.game_a_id).where(*in_stage, tm.game_a_id.isnot(None)).union_all(
+        select(tm.game_b_id).where(*in_stage, tm.game_b_id.isnot(None))
+    )
+    db.session.execute(
+        update(Game).where(Game.id.in_(stage_games)).values(status="finished")
+        .execution_options(synchronize_session=False)
+    )
+
+    score_a = select(Game.user_score).where(Game.id == tm.game_a_id).scalar_subquery()
+    score_b = select(Game.user_score).where(Game.id == tm.game_b_id).scalar_subquery()
+    db.session.execute(
+        update(tm).where(*in_stage, tm.player_b_id.isnot(None))
+        .values(winner_id=case((func.coalesce(score_b, 0) > func.coalesce(score_a, 0), tm.player_b_id),
+                               else_=tm.player_a_id))
+        .execution_options(synchronize_session=False)
+    )
+
+    if t.format == "single":
+        losers = select(
+            case((tm.winner_id == tm.player_a_id, tm.player_b_id), else_=tm.player_a_id)
+        ).where(*in_stage, tm.player_b_id.isnot(None))
+        db.session.execute(
+            update(tp).where(tp.tournament_id == t.id, tp.user_id.in_(losers)).values(alive=False)
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        winners = select(tm.winner_id).where(*in_stage)
+        db.session.execute(
+            update(tp).where(tp.tournament_id == t.id, tp.user_id.in_(winners)).values(points=tp.points + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    if t.stage >= t.total_stages:
+        t.status = "finished"
+        leader = (
+            db.session.query(tp.user_id)
+            .filter(tp.tournament_id == t.id, tp.alive.is_(True))
+            .order_by(tp.points.desc(), tp.seed)
+            .first()
+        )
+        t.winner_id = leader[0] if leader else None
+        return None
+    return create_tournament_stage(t, t.stage + 1)
+
+
+def tournament_match_for(t, user_id):
+    """Partida da fase atual do usuário, ou None."""
+    return TournamentMatch.query.filter(
+        TournamentMatch.tournament_id == t.id,
+        TournamentMatch.stage == t.stage,
+        (TournamentMatch.player_a_id == user_id) | (TournamentMatch.player_b_id == user_id),
+    ).first()
+
+
+@app.route("/tournaments", methods=["GET", "POST"])
+def tournaments():
+    if not require_login():
+        return redirect(url_for("login"))
+
+    if request.method == "POST":
+        if not is_admin():
+            flash("Acesso negado.", "danger")
+            return redirect(url_for("tournaments"))
+        themes = [key for key, label in THEMES if key in request.form.getlist("themes")]
+        fmt = request.form.get("format", "single")
+        if not themes or fmt not in TOURNAMENT_FORMATS:
+            flash("Escolha o formato e ao menos um tema.", "warning")
+            return redirect(url_for("tournaments"))
+        t = Tournament(
+            name=request.form.get("name", "").strip() or "Torneio",
+            format=fmt,
+            themes_json=json.dumps(themes),
+            rounds_per_match=max(1, min(request.form.get("rounds", 3, type=int), 20)),
+        )
+        db.session.add(t)
+        flash("Torneio criado! Inscrições abertas.", "success")
+        return redirect(url_for("tournaments"))
+
+    items = Tournament.query.filter(Tournament.status != "finished").order_by(Tournament.id.desc()).all()
+    return render_template(
+        "tournaments.html", tournaments=items, themes=THEMES, formats=TOURNAMENT_FORMATS, admin=is_admin()
+    )
+
+
+@app.route("/tournaments/<int:tournament_id>")
+def tournament_detail(tournament_id):
+    if not require_login():
+        return redirect(url_for("login"))
+
+    t = Tournament.query.get_or_404(tournament_id)
+    user = current_user()
+    tp = TournamentPlayer
+    me = tp.query.filter_by(tournament_id=t.id, user_id=user.id).first()
+    match = tournament_match_for(t, user.id) if me and t.status == "running" else None
+    game_id = None
+    if match and match.player_b_id is not None:
+        game_id = match.game_a_id if match.player_a_id == user.id else match.game_b_id
+
+    players = db.session.query(func.count(tp.id)).filter(tp.tournament_id == t.id).scalar()
+    standings = (
+        db.session.query(User.name, tp.points, tp.alive, tp.seed)
+        .join(User, User.id == tp.user_id)
+        .filter(tp.tournament_id == t.id)
+        .order_by(tp.alive.desc(), tp.points.desc(), tp.seed)
+        .limit(20)
+        .all()
+    )
+    return render_template(
+        "tournament.html", t=t, me=me, match=match, game_id=game_id, players=players,
+        standings=standings, formats=TOURNAMENT_FORMATS, admin=is_admin(),
+    )
+
+
+@app.route("/tournaments/<int:tournament_id>/join", methods=["POST"])
+def tournament_join(tournament_id):
+    if not require_login():
+        return redirect(url_for("login"))
+
+    t = Tournament.query.get_or_404(tournament_id)
+    user = current_user()
+    if t.status != "open":
+        flash("As inscrições deste torneio estão encerradas.", "warning")
+    elif not TournamentPlayer.query.filter_by(tournament_id=t.id, user_id=user.id).first():
+        db.session.add(TournamentPlayer(tournament_id=t.id, user_id=user.id))
+        flash("Inscrição confirmada!", "success")
+    return redirect(url_for("tournament_detail", tournament_id=t.id))
+
+
+@app.route("/admin/tournaments/<int:tournament_id>/advance", methods=["POST"])
+def admin_tournament_advance(tournament_id):
+    if not is_admin():
+        flash("Acesso negado.", "danger")
+        return redirect(url_for("index"))
+
+    t = Tournament.query.get_or_404(tournament_id)
+    if t.status == "open":
+        if start_tournament(t):
+            flash("Torneio iniciado!", "success")
+        else:
+            flash("São necessários ao menos 2 inscritos.", "warning")
+    elif t.status == "running":
+        advance_tournament(t)
+        flash("Torneio encerrado!" if t.status == "finished" else f"Fase {t.stage} gerada.", "success")
+    return redirect(url_for("tournament_detail", tournament_id=t.id))
+
+
+# ----------------------
+# Rankings por período (dia / semana / mês)
+# ----------------------
+# game_guess soma os pontos em user_daily_scores (usuário, dia). Um ranking
+# de qualquer janela soma só os baldes diários dela (no máximo 31 por
+# jogador), sem varrer games nem rounds. Janelas já fechadas não mudam, então
+# ficam em cache por mais tempo que a janela corrente.
+PERIODS = {"day": "Hoje", "week": "Semana", "month": "Mês"}
+PERIOD_RANKING_SIZE = 50
+PERIOD_CACHE_TTL = 30          # segundos, janela em andamento
+PERIOD_CACHE_TTL_CLOSED = 3600  # segundos, janela encerrada
+PERIOD_CACHE_SIZE = 256         # janelas guardadas (?date= vem do usuário)
+
+
+def record_daily_score(user_id, points, day=None):
+    upsert(
+        UserDailyScore,
+        {"user_id": user_id, "day": day or datetime.utcnow().date(), "score": points},
+        key=("user_id", "day"),
+        increment=("score",),
+    )
+
+
+def period_window(period, ref):
+    """(primeiro dia, último dia) da janela que contém ref."""
+    if period == "day":
+        return ref, ref
+    if period == "week":
+        start = ref - timedelta(days=ref.weekday())  # segunda-feira
+        return start, start + timedelta(days=6)
+    start = ref.replace(day=1)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start, next_month - timedelta(days=1)
+
+
+period_cache = {}   # (período, início) -> (expira_em, linhas, limite_buscado), em ordem de inserção
+
+
+def period_ranking(period, ref, limit=PERIOD_RANKING_SIZE):
+    start, end = period_window(period, ref)
+    now = time.monotonic()
+    cached = period_cache.get((period, start))
+    # Vale se a busca foi de pelo menos limit linhas, ou se veio menos que o pedido (janela completa)
+    if cached and cached[0] > now and (cached[2] >= limit or len(cached[1]) < cached[2]):
+        return start, end, cached[1][:limit]
+
+    fetched = max(limit, PERIOD_RANKING_SIZE)
+    total = func.sum(UserDailyScore.score).label("score")
+    top = (
+        select(UserDailyScore.user_id, total)
+        .where(UserDailyScore.day.between(start, end))
+        .group_by(UserDailyScore.user_id)
+        .order_by(total.desc(), UserDailyScore.user_id)
+        .limit(fetched)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(top.c.user_id, User.name, top.c.score)
+        .join(User, User.id == top.c.user_id)
+        .order_by(top.c.score.desc(), top.c.user_id)
+    ).all()
+    ttl = PERIOD_CACHE_TTL_CLOSED if end < datetime.utcnow().date() else PERIOD_CACHE_TTL
+    period_cache.pop((period, start), None)
+    for key in [k for k, v in period_cache.items() if v[0] <= now]:
+        del period_cache[key]
+    while len(period_cache) >= PERIOD_CACHE_SIZE:
+        del period_cache[next(iter(period_cache))]
+    period_cache[(period, start)] = (now + ttl, rows, fetched)
+    return start, end, rows[:limit]
+
+
+def parse_ref_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date() if value else datetime.utcnow().date()
+    except ValueError:
+        return None
+
+
+@app.route("/ranking/<period>")
+@read_only
+def period_ranking_page(period):
+    if not require_login():
+        return redirect(url_for("login"))
+    ref = parse_ref_date(request.args.get("date"))
+    if period not in PERIODS or ref is None:
+        return redirect(url_for("period_ranking_page", period="week"))
+
+    start, end, rows = period_ranking(period, ref)
+    prev_ref, next_ref = start - timedelta(days=1), end + timedelta(days=1)
+    return render_template(
+        "period_ranking.html", period=period, periods=PERIODS, rows=rows, start=start, end=end,
+        prev_ref=prev_ref, next_ref=next_ref if next_ref <= datetime.utcnow().date() else None,
+        user=current_user(),
+    )
+
+
+@app.route("/api/leaderboard/<period>")
+@read_only
+def api_period_leaderboard(period):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+    ref = parse_ref_date(request.args.get("date"))
+    if period not in PERIODS:
+        return {"error": "unknown_period"}, 404
+    if ref is None:
+        return {"error": "invalid_date"}, 400
+
+    limit = max(1, min(request.args.get("limit", PERIOD_RANKING_SIZE, type=int), PERIOD_RANKING_SIZE))
+    start, end, rows = period_ranking(period, ref, limit)
+    return {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "rows": [{"position": i, "user_id": uid, "name": name, "score": score}
+                 for i, (uid, name, score) in enumerate(rows, start=1)],
+    }
+
+
+def backfill_daily_scores(chunk_size=THEME_BACKFILL_CHUNK):
+    """Refaz user_daily_scores a partir das rodadas pontuadas, em blocos por id."""
+    cutoff = db.session.query(func.max(Round.id)).scalar() or 0
+    db.session.query(UserDailyScore).delete()
+    db.session.commit()
+
+    last_id, total = 0, 0
+    while last_id < cutoff:
+        rows = db.session.execute(
+            select(Round.id, Game.user_id, Round.started_at, Game.created_at, Round.user_points)
+            .join(Game, Game.id == Round.game_id)
+            .where(Round.user_points > 0, Round.id > last_id, Round.id <= cutoff)
+            .order_by(Round.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        agg = {}
+        for _, user_id, started_at, created_at, points in rows:
+            key = (user_id, (started_at or created_at).date())
+            agg[key] = agg.get(key, 0) + points
+        for (user_id, day), points in agg.items():
+            record_daily_score(user_id, points, day)
+        db.session.commit()
+        last_id = rows[-1][0]
+        total += sum(n for n, _, _, _ in agg.values())
+    return total
+
 
 @app.route("/weekly_ranking")
+@read_only
 def weekly_ranking():
     if not require_login():
         return redirect(url_for("login"))
 
-    user = User.query.get(session["user_id"])
+    user = current_user()
     if not user:
         flash("Usuário não encontrado.", "danger")
         return redirect(url_for("login"))
@@ -930,7 +3390,7 @@ def quiz_start_page():
         flash("O quiz ainda não tem perguntas cadastradas.", "warning")
         return redirect(url_for("index"))
 
-    user = User.query.get(session["user_id"])  # pega o usuário logado
+    user = current_user()  # pega o usuário logado
 
     return render_template(
         "quiz_start.html",
@@ -1008,23 +3468,21 @@ def quiz_result():
 
     score = session.get('quiz_score', 0)
     total = len(session.get('quiz_question_ids', []))
-    user = User.query.get(session["user_id"])
-
-    # Atualiza ou cria o registro de QuizScore
-    quiz_score = QuizScore.query.filter_by(user_id=user.id).first()
-
-    if quiz_score:
-        quiz_score.score += score  # soma ao que já tinha
-        quiz_score.played_at = datetime.utcnow()
-    else:
-        quiz_score = QuizScore(
-            user_id=user.id,
-            score=score,
-            played_at=datetime.utcnow()
-        )
-        db.session.add(quiz_score)
-
-    db.session.commit()
+    user = current_user()
+
+    # Soma ao que já tinha (ou cria) num único INSERT ... ON CONFLICT
+    played_at = datetime.utcnow()
+    upsert(
+        QuizScore,
+        {"user_id": user.id, "score": score, "played_at": played_at},
+        key=("user_id",),
+        increment=("score",),
+        replace=("played_at",),
+    )
+    new_total = db.session.query(QuizScore.score).filter_by(user_id=user.id).scalar()
+    row = QuizRankRow(user.id, user.name, new_total, played_at)
+    after_commit(lambda: quiz_top.offer(row))
+    after_commit(lambda: rank_boards.set("quiz", row.user_id, row.score))
 
     # Limpa sessão do quiz
     for key in ['quiz_score', 'quiz_current_index', 'quiz_question_ids']:
@@ -1033,20 +3491,279 @@ def quiz_result():
     return render_template("quiz_result.html", score=score, total=total, user=user)
 
 
+QUIZ_TOP_N = 10
+QUIZ_TOP_TTL = 60.0   # segundos até recarregar do banco (pega pontos de outros workers)
+
+QuizRankRow = namedtuple("QuizRankRow", "user_id name score played_at")
+
+
+class QuizTopCache:
+    """Top N do quiz em memória, atualizado no lugar quando alguém entra no corte."""
+
+    def __init__(self, n=QUIZ_TOP_N):
+        self.n = n
+        self.rows = []
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(row):
+        return (-row.score, -row.played_at.timestamp())
+
+    def get(self):
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at >= QUIZ_TOP_TTL:
+            rows = [
+                QuizRankRow(*r) for r in
+                db.session.query(QuizScore.user_id, User.name, QuizScore.score, QuizScore.played_at)
+                .join(User, User.id == QuizScore.user_id)
+                .order_by(QuizScore.score.desc(), QuizScore.played_at.desc())
+                .limit(self.n)
+            ]
+            with self.lock:
+                self.rows, self.loaded_at = rows, now
+        return self.rows
+
+    def offer(self, row):
+        with self.lock:
+            if self.loaded_at is None:
+                return
+            rows = [r for r in self.rows if r.user_id != row.user_id]
+            # Pontuação acumulada só cresce: quem não passa do corte não muda o top
+            if len(rows) < self.n or self._key(row) < self._key(rows[-1]):
+                rows.append(row)
+                rows.sort(key=self._key)
+                self.rows = rows[:self.n]
+
+
+quiz_top = QuizTopCache()
+
+
+# ----------------------
+# Posição no ranking ("minha posição") em O(log n)
+# ----------------------
+# Cada worker mantém, por ranking, uma árvore de Fenwick indexada pela
+# pontuação (quantos jogadores têm cada pontuação) e, por pontuação, a lista
+# ordenada de ids empatados. Posição e k-ésimo colocado saem em O(log n) sem
+# ler a tabela. Os pontos feitos neste worker entram depois do commit; o resto
+# chega na reconstrução periódica a partir do banco.
+RANK_REBUILD = 300      # segundos entre reconstruções a partir do banco
+RANK_NEIGHBOURS = 10
+
+
+class RankBoard:
+    def __init__(self, scores=()):
+        self.scores = {}    # user_id -> pontuação
+        self.members = {}   # pontuação -> [user_id, ...] ordenada
+        self.size = 1024
+        self.tree = [0] * (self.size + 1)
+        self.total = 0
+        self.lock = threading.Lock()
+        for user_id, score in scores:
+            if score > 0:
+                self.scores[user_id] = score
+                self.members.setdefault(score, []).append(user_id)
+        for ids in self.members.values():
+            ids.sort()
+        self.total = len(self.scores)
+        self._rebuild(max(self.members, default=0))
+
+    # --- Fenwick (índice 1 = pontuação 0)
+    def _rebuild(self, max_score):
+        """Refaz a árvore (dobrando o tamanho até caber max_score) em O(n)."""
+        size = self.size
+        while max_score + 1 > size:
+            size *= 2
+        counts = [0] * (size + 1)
+        for s, ids in self.members.items():
+            counts[s + 1] = len(ids)
+        # Construção em O(n) a partir das contagens
+        for i in range(1, size + 1):
+            j = i + (i & -i)
+            if j <= size:
+                counts[j] += counts[i]
+        self.size, self.tree = size, counts
+
+    def _bump(self, score, delta):
+        i = score + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, score):
+        """Jogadores com pontuação <= score."""
+        i, n = min(score + 1, self.size), 0
+        while i > 0:
+            n += self.tree[i]
+            i -= i & -i
+        return n
+
+    def _kth(self, k):
+        """Pontuação do k-ésimo jogador em ordem crescente (1-based)."""
+        pos, step = 0, self.size
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] < k:
+                pos = nxt
+                k -= self.tree[nxt]
+            step >>= 1
+        return pos  # índice pos + 1 -> pontuação pos
+
+    def _insert(self, user_id, score):
+        if score <= 0:
+            return
+        self.scores[user_id] = score
+        bisect.insort(self.members.setdefault(score, []), user_id)
+        self.total += 1
+        if score + 1 > self.size:
+            self._rebuild(score)
+        else:
+            self._bump(score, 1)
+
+    def _remove(self, user_id):
+        score = self.scores.pop(user_id, None)
+        if score is None:
+            return
+        ids = self.members[score]
+        del ids[bisect.bisect_left(ids, user_id)]
+        if not ids:
+            del self.members[score]
+        self.total -= 1
+        self._bump(score, -1)
+
+    def set(self, user_id, score):
+        with self.lock:
+            self._remove(user_id)
+            self._insert(user_id, score)
+
+    def add(self, user_id, delta):
+        with self.lock:
+            score = self.scores.get(user_id, 0) + delta
+            self._remove(user_id)
+            self._insert(user_id, score)
+
+    def _at(self, position):
+        """(user_id, pontuação) na posição (1 = primeiro; empate desempata por id)."""
+        k = self.total - position + 1
+        score = self._kth(k)
+        before = self._count_upto(score - 1) if score else 0
+        ids = self.members[score]
+        return ids[len(ids) - 1 - (k - before - 1)], score
+
+    def around(self, user_id, n=RANK_NEIGHBOURS):
+        """(posição, pontuação, [(posição, user_id, pontuação), ...]) ou None."""
+        with self.lock:
+            score = self.scores.get(user_id)
+            if score is None:
+                return None
+            ids = self.members[score]
+            position = self.total - self._count_upto(score) + bisect.bisect_left(ids, user_id) + 1
+            rows = []
+            for p in range(max(1, position - n), min(self.total, position + n) + 1):
+                uid, s = self._at(p)
+                rows.append((p, uid, s))
+            return position, score, rows
+
+
+def load_all_time_board():
+    rows = (
+        db.session.query(Game.user_id, func.sum(Game.user_score))
+        .group_by(Game.user_id)
+        .having(func.sum(Game.user_score) > 0)
+    )
+    return None, rows
+
+
+def current_week_start():
+    today = datetime.utcnow().date()
+    return today - timedelta(days=today.weekday())  # segunda-feira
+
+
+def load_weekly_board():
+    event = active_weekly_event()
+    week_start = current_week_start()
+    if not event:
+        return (None, week_start), []
+    rows = (
+        db.session.query(WeeklyScore.player_id, func.sum(WeeklyScore.score))
+        .filter(WeeklyScore.event_id == event.id,
+                WeeklyScore.play_date.between(week_start, week_start + timedelta(days=6)))
+        .group_by(WeeklyScore.player_id)
+    )
+    return (event.id, week_start), rows
+
+
+def load_quiz_board():
+    return None, db.session.query(QuizScore.user_id, QuizScore.score)
+
+
+class RankBoards:
+    """Rankings em memória por nome; reconstrói quando vencem ou mudam de período."""
+
+    loaders = {"all": load_all_time_board, "weekly": load_weekly_board, "quiz": load_quiz_board}
+
+    def __init__(self):
+        self.boards = {}    # nome -> (período, RankBoard, montado_em)
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        entry = self.boards.get(name)
+        now = time.monotonic()
+        if entry is None or now - entry[2] >= RANK_REBUILD or (
+            name == "weekly" and entry[0][1] != current_week_start()
+        ):
+            with on_replica():
+                period, rows = self.loaders[name]()
+            board = RankBoard((user_id, int(score or 0)) for user_id, score in rows)
+            with self.lock:
+                self.boards[name] = entry = (period, board, now)
+        return entry[1]
+
+    def add(self, name, user_id, delta, period=None):
+        """Soma delta ao placar; com period, só se o ranking montado é desse período."""
+        entry = self.boards.get(name)
+        if entry is not None and (period is None or entry[0] == period):
+            entry[1].add(user_id, delta)
+
+    def set(self, name, user_id, score):
+        entry = self.boards.get(name)
+        if entry is not None:
+            entry[1].set(user_id, score)
+
+
+rank_boards = RankBoards()
+
+
+@app.route("/api/rank/<board>")
+def api_rank(board):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+    if board not in RankBoards.loaders:
+        return {"error": "unknown_board"}, 404
+
+    found = rank_boards.get(board).around(session["user_id"])
+    if found is None:
+        return {"board": board, "position": None, "neighbours": []}
+    position, score, rows = found
+    names = dict(db.session.query(User.id, User.name).filter(User.id.in_([uid for _, uid, _ in rows])))
+    return {
+        "board": board,
+        "position": position,
+        "score": score,
+        "neighbours": [
+            {"position": p, "user_id": uid, "name": names.get(uid), "score": s, "me": uid == session["user_id"]}
+            for p, uid, s in rows
+        ],
+    }
+
+
 @app.route('/quiz/ranking')
+@read_only
 def quiz_ranking():
-    # Pegar top 10 pontuações acumuladas e já carregar o usuário relacionado
-    top_scores = (
-        QuizScore.query
-        .options(joinedload(QuizScore.user))  # evita N+1 queries
-        .order_by(QuizScore.score.desc(), QuizScore.played_at.desc())
-        .limit(10)
-        .all()
-    )
+    # Top 10 acumulado vem do cache; o banco só é lido quando o cache expira
+    top_scores = quiz_top.get()
 
-    user = None
-    if "user_id" in session:
-        user = User.query.get(session["user_id"])
+    user = current_user()
 
     return render_template('quiz_ranking.html', scores=top_scores, user=user)
 
@@ -1066,8 +3783,7 @@ def logout():
 
 @app.route("/") 
 def index():
-    user = None 
-    if "user_id" in session: user = User.query.get(session["user_id"]) 
+    user = current_user()
     return render_template("index.html", user=user, themes=THEMES)
 
 
@@ -1075,7 +3791,7 @@ def index():
 @app.route("/reset_password/<token>", methods=["GET", "POST"])
 def reset_password(token):
     try:
-        email = s.loads(token, salt="password-reset", max_age=3600)
+        email = get_serializer().loads(token, salt="password-reset", max_age=3600)
     except Exception:
         flash("Link inválido ou expirado.", "danger")
         return redirect(url_for("forgot_password"))
@@ -1083,7 +3799,6 @@ def reset_password(token):
     if request.method == "POST":
         new_pwd = request.form["password"]
         user.set_password(new_pwd)
-        db.session.commit()
         flash("Senha redefinida com sucesso! Faça login.", "success")
         return redirect(url_for("login"))
     return render_template("reset_password.html")
@@ -1094,15 +3809,14 @@ def forgot_password():
         email = request.form["email"].strip().lower()
         user = User.query.filter_by(email=email).first()
         if user:
-            token = s.dumps(email, salt="password-reset")
+            token = get_serializer().dumps(email, salt="password-reset")
             reset_url = url_for("reset_password", token=token, _external=True)
             try:
-                msg = Message(
+                send_mail(
                     subject="Redefinição de senha - PERFUT",
                     recipients=[email],
                     body=f"Olá {user.name},\n\nPara redefinir sua senha clique no link abaixo (expira em 1 hora):\n{reset_url}\n\nSe não foi você, ignore este e-mail."
                 )
-                mail.send(msg)
                 flash("Enviamos um link de redefinição para seu e-mail.", "info")
             except Exception as e:
                 print("Erro ao enviar email:", e)
@@ -1113,6 +3827,7 @@ def forgot_password():
     return render_template("forgot_password.html")
 
 @app.route("/ranking")
+@read_only
 def ranking():
     if "user_id" not in session:
         flash("Faça login para ver o ranking.", "warning")
@@ -1150,14 +3865,6 @@ def ranking():
 
     rankings = []
     for user_id, name, coins, level, total_score in rows:
-        # Atualiza nível do usuário se necessário
-        new_level = total_score // 100 + 1
-        if level != new_level:
-            user = User.query.get(user_id)
-            user.level = new_level
-            db.session.commit()
-            level = new_level
-
         # Busca badge correspondente ao nível
         badge = (
             db.session.query(Badge)
@@ -1169,12 +3876,12 @@ def ranking():
         rankings.append((name, int(total_score), level, badge_name))
 
     # Usuário atual
-    current_user = User.query.get(session["user_id"])
-    if not current_user:
+    user = current_user()
+    if not user:
         flash("Usuário não encontrado.", "danger")
         return redirect(url_for("login"))
 
-    return render_template("ranking.html", rankings=rankings, user=current_user)
+    return render_template("ranking.html", rankings=rankings, user=user)
 
 
 
@@ -1189,18 +3896,11 @@ def game_setup():
     if not require_login():
         return redirect(url_for("login"))
     
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     if request.method == "POST":
         # Custo da partida
         cost = 5
-        if user.coins < cost:
-            flash(f"Você precisa de {cost} moedas para iniciar uma partida.", "warning")
-            return redirect(url_for("index"))
-        
-        # Deduz as moedas
-        user.coins -= cost
-        db.session.commit()
 
         selected = request.form.getlist("themes")
         valid_themes = [key for key, label in THEMES]
@@ -1208,7 +3908,12 @@ def game_setup():
         if not selected:
             flash("Selecione ao menos um tema.", "warning")
             return redirect(url_for("game_setup"))
-        
+
+        # Deduz as moedas
+        if debit(user, cost, "game_setup") is None:
+            flash(f"Você precisa de {cost} moedas para iniciar uma partida.", "warning")
+            return redirect(url_for("index"))
+
         rounds_count = int(request.form.get("rounds", 5))  # lê o input do form
 
         g = Game(
@@ -1217,7 +3922,7 @@ def game_setup():
             themes_json=json.dumps(selected)
         )
         db.session.add(g)
-        db.session.commit()
+        db.session.flush()
         flash(f"Você gastou {cost} moedas para iniciar a partida.", "info")
         return redirect(url_for("game_play", game_id=g.id))
     
@@ -1237,7 +3942,7 @@ def game_result(game_id):
         return redirect(url_for("login"))
 
     game = Game.query.get_or_404(game_id)
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     # Busca badges do banco
     badges = Badge.query.order_by(Badge.level_required).all()
@@ -1263,34 +3968,110 @@ def game_result(game_id):
 
 
 
+def theme_card_candidates(theme):
+    """(id, dificuldade) das cartas do tema, direto da tabela."""
+    return db.session.execute(select(Card.id, Card.difficulty).where(Card.theme == theme)).all()
+
+
+def open_round(g, current_number):
+    """Devolve a rodada de número current_number, sorteando a carta se ainda não existir."""
+    current = Round.query.filter_by(game_id=g.id, number=current_number).first()
+    if current:
+        return current
+
+    if g.mode == "duel":
+        duel = Duel.query.filter(
+            (Duel.creator_id == g.user_id) | (Duel.opponent_id == g.user_id)
+        ).first()
+
+        # Cria lista de cartas do duelo se ainda não existir
+        if not getattr(duel, "cards_order_json", None):
+            cards = []
+            themes = g.themes
+            for i in range(duel.rounds_count):
+                theme = themes[i % len(themes)]
+                card = Card.query.filter_by(theme=theme, difficulty=1).order_by(db.func.random()).first()
+                cards.append(card.id)
+            duel.cards_order_json = json.dumps(cards)
+
+        cards_order = json.loads(duel.cards_order_json)
+        card_id = cards_order[current_number - 1]
+        card = Card.query.get(card_id)
+    elif g.mode == "tournament":
+        # Torneio: os dois jogadores da partida usam o baralho sorteado no pareamento
+        match = TournamentMatch.query.filter(
+            (TournamentMatch.game_a_id == g.id) | (TournamentMatch.game_b_id == g.id)
+        ).first()
+        deck = json.loads(match.deck_json) if match else []
+        card = db.session.get(Card, deck[current_number - 1]) if current_number <= len(deck) else None
+    elif g.mode == "weekly":
+        # Evento semanal: todos jogam as mesmas cartas no dia
+        deck = weekly_deck_for(weekly_event_id_for_game(g), g.created_at.date()) or []
+        card = db.session.get(Card, deck[current_number - 1]) if current_number <= len(deck) else None
+    else:
+        # Solo: carta sem repetição na partida e, se possível, inédita para o usuário
+        theme = g.themes[(current_number - 1) % len(g.themes)]
+        used_card_ids = {r.card_id for r in g.rounds}
+        seen = load_seen_filter(g.user_id, theme)
+        # Sorteio em memória no catálogo; o banco só busca a carta pelo id. Se o
+        # catálogo estiver atrás do banco (carta apagada, tema sem cartas), o
+        # sorteio é refeito sobre a tabela.
+        sources = [card_catalog.theme_cards] if card_catalog.available() else []
+        sources.append(theme_card_candidates)
+        card = None
+        for source in sources:
+            candidates = source(theme)
+            # Prefere as fáceis; se acabarem (ex.: após rebucket-difficulty), usa qualquer uma
+            card_id = pick_card_id(candidates, used_card_ids, difficulty=1, seen=seen)
+            if card_id is None and seen.count:
+                # Tema esgotado para o usuário: recomeça o filtro
+                seen.clear()
+                card_id = pick_card_id(candidates, used_card_ids, difficulty=1)
+            card = db.session.get(Card, card_id) if card_id else None
+            if card:
+                break
+        if card:
+            store_seen_card(g.user_id, theme, card.id, seen)
+
+    if not card:
+        return None
+
+    # Embaralha as dicas
+    hints_order = card.hints[:]
+    random.shuffle(hints_order)
+
+    current = Round(
+        game_id=g.id,
+        number=current_number,
+        card_id=card.id,
+        started_at=datetime.utcnow(),
+        ends_at=datetime.utcnow() + timedelta(seconds=300),
+        hints_order_json=json.dumps(hints_order, ensure_ascii=False)
+    )
+    db.session.add(current)
+    db.session.flush()
+    return current
+
+
 @app.route("/game/play/<int:game_id>")
 def game_play(game_id):
     if not require_login():
         return redirect(url_for("login"))
 
     g = Game.query.get_or_404(game_id)
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     # Determina a rodada atual
     current_number = len([r for r in g.rounds if r.finished]) + 1
     if current_number > g.rounds_count:
-        g.status = "finished"
-        db.session.commit()
+        finish_game(g)
 
         # Se for duelo, verifica status do duelo
         if g.mode == "duel":
-            duel = Duel.query.filter(
-                ((Duel.creator_id == g.user_id) | (Duel.opponent_id == g.user_id)),
-                Duel.status.in_(["active", "finished"])
-            ).order_by(Duel.id.desc()).first()
+            duel = find_user_duel(g.user_id)
 
             if duel:
-                creator_game = Game.query.filter_by(user_id=duel.creator_id).order_by(Game.id.desc()).first()
-                opponent_game = Game.query.filter_by(user_id=duel.opponent_id).order_by(Game.id.desc()).first()
-
-                if creator_game.status == "finished" and opponent_game.status == "finished":
-                    duel.status = "finished"
-                    db.session.commit()
+                if duel.status == "finished":
                     return redirect(url_for("duel_result", duel_id=duel.id))
                 else:
                     flash("Você terminou, mas aguarde seu oponente terminar o duelo.", "info")
@@ -1300,74 +4081,40 @@ def game_play(game_id):
         return redirect(url_for("game_result", game_id=g.id))
 
     # Busca ou cria a rodada atual
-    current = Round.query.filter_by(game_id=g.id, number=current_number).first()
+    current = open_round(g, current_number)
     if not current:
-        if g.mode == "duel":
-            duel = Duel.query.filter(
-                (Duel.creator_id == g.user_id) | (Duel.opponent_id == g.user_id)
-            ).first()
-
-            # Cria lista de cartas do duelo se ainda não existir
-            if not getattr(duel, "cards_order_json", None):
-                cards = []
-                themes = g.themes
-                for i in range(duel.rounds_count):
-                    theme = themes[i % len(themes)]
-                    card = Card.query.filter_by(theme=theme, difficulty=1).order_by(db.func.random()).first()
-                    cards.append(card.id)
-                duel.cards_order_json = json.dumps(cards)
-                db.session.commit()
-
-            cards_order = json.loads(duel.cards_order_json)
-            card_id = cards_order[current_number - 1]
-            card = Card.query.get(card_id)
-        else:
-            # Solo/torneio: carta sem repetição
-            theme = g.themes[(current_number - 1) % len(g.themes)]
-            used_card_ids = [r.card_id for r in g.rounds]
-            card = Card.query.filter_by(theme=theme, difficulty=1).filter(~Card.id.in_(used_card_ids)).order_by(db.func.random()).first()
-
-        if not card:
-            flash("Nenhum card disponível.", "warning")
-            return redirect(url_for("index"))
-
-        # Embaralha as dicas
-        hints_order = card.hints[:]
-        random.shuffle(hints_order)
-
-        current = Round(
-            game_id=g.id,
-            number=current_number,
-            card_id=card.id,
-            started_at=datetime.utcnow(),
-            ends_at=datetime.utcnow() + timedelta(seconds=300),
-            hints_order_json=json.dumps(hints_order, ensure_ascii=False)
-        )
-        db.session.add(current)
-        db.session.commit()
+        flash("Nenhum card disponível.", "warning")
+        return redirect(url_for("index"))
 
     # Verifica tempo da rodada
     if datetime.utcnow() > current.ends_at and not current.finished:
         current.finished = True
-        db.session.commit()
+        record_card_play(current, solved=False)
         flash(f"Tempo esgotado! Resposta era: {current.card.answer}", "danger")
         return redirect(url_for("game_play", game_id=g.id))
 
     hints_order = json.loads(current.hints_order_json or "[]")
     hints = hints_order[:current.requested_hints]
 
+    # A página só recebe da resposta o que o jogador já tem direito de ver
     show_answer = current.finished and current.user_guess is not None
+    answer = current.card.answer
+    extra_hint = {"length": len(answer), "initial": answer[:1]} if current.used_extra_hints > 0 else None
     seconds_left = max(0, int((current.ends_at - datetime.utcnow()).total_seconds()))
     round_points = card_points(current.requested_hints)
 
+    duel = find_user_duel(g.user_id) if g.mode == "duel" else None
+
     return render_template(
         "game.html",
         game=g,
+        duel=duel,
         round=current,
-        card=current.card,
+        theme=current.card.theme,
         hints=hints,
+        extra_hint=extra_hint,
         seconds_left=seconds_left,
-        show_answer=show_answer,
+        answer=answer if show_answer else None,
         user=user,
         card_points=round_points
     )
@@ -1375,6 +4122,36 @@ def game_play(game_id):
 
 
 
+def apply_guess(r, guess, user):
+    """Registra o chute, pontua a rodada e atualiza o nível. Devolve se acertou."""
+    g = r.game
+    r.user_guess = guess.strip()
+    if r.requested_hints == 0:
+        r.requested_hints = 1
+    correct = answer_matches(normalize(r.user_guess), r.card)
+    r.user_points = card_points(r.requested_hints) if correct else 0
+    g.user_score += r.user_points
+    if r.user_points:
+        points, user_id = r.user_points, g.user_id
+        record_daily_score(user_id, points)
+        after_commit(lambda: rank_boards.add("all", user_id, points))
+        if g.mode == "weekly":
+            record_weekly_points(g, points)
+    r.finished = True
+    record_duel_event(g, r, "hit" if correct else "miss")
+    record_card_play(r, solved=correct)
+    update_user_level(user)
+    return correct
+
+
+def apply_skip(r):
+    """Encerra a rodada sem pontos."""
+    r.finished = True
+    r.user_points = 0
+    record_duel_event(r.game, r, "skip")
+    record_card_play(r, solved=False)
+
+
 @app.route("/game/guess/<int:round_id>", methods=["POST"])
 def game_guess(round_id):
     if not require_login():
@@ -1385,22 +4162,8 @@ def game_guess(round_id):
     # pega o usuário da partida
     if r.finished:
         return redirect(url_for("game_play", game_id=g.id))
-    guess = request.form.get("guess", "").strip()
-    r.user_guess = guess
-    if r.requested_hints == 0:
-        r.requested_hints = 1
-    # Verifica se acertou
-    correct = normalize(guess) == normalize(r.card.answer)
-    r.user_points = card_points(r.requested_hints) if correct else 0
-    g.user_score += r.user_points
-    r.finished = True
-    db.session.commit()
-
-    # Atualiza o nível do usuário
     old_level = user.level
-    total_score = sum(game.user_score for game in user.games)
-    user.level = total_score // 100 + 1
-    db.session.commit()
+    correct = apply_guess(r, request.form.get("guess", ""), user)
 
     # Mensagem de nível up
     if user.level > old_level:
@@ -1427,7 +4190,6 @@ def game_hint(round_id):
     # Limita o máximo de 10 dicas normais
     if r.requested_hints < 10:
         r.requested_hints += 1
-        db.session.commit()
         flash("Dica liberada! Veja abaixo.", "info")
     else:
         flash("Máximo de dicas atingido.", "warning")
@@ -1443,7 +4205,7 @@ def game_extra_hint(round_id):
         return redirect(url_for("login"))
     
     r = Round.query.get_or_404(round_id)
-    user = User.query.get(session["user_id"])
+    user = current_user()
     
     # Verifica se já foi usada a dica extra
     if r.used_extra_hints >= 1:
@@ -1451,13 +4213,11 @@ def game_extra_hint(round_id):
         return redirect(url_for("game_play", game_id=r.game_id))
     
     cost = 5
-    if user.coins < cost:
+    if debit(user, cost, "extra_hint") is None:
         flash("Moedas insuficientes para dica extra.", "warning")
         return redirect(url_for("game_play", game_id=r.game_id))
-    
-    user.coins -= cost
+
     r.used_extra_hints = 1  # marca como usada
-    db.session.commit()
     flash("Dica extra liberada! Veja abaixo.", "success")
     return redirect(url_for("game_play", game_id=r.game_id))
 
@@ -1530,23 +4290,20 @@ def game_skip(round_id):
 
     r = Round.query.get_or_404(round_id)
     g = r.game
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     if r.finished:
         flash("Esta rodada já foi finalizada.", "warning")
         return redirect(url_for("game_play", game_id=g.id))
 
     # Marca a rodada como finalizada sem pontos
-    r.finished = True
-    r.user_points = 0
-    db.session.commit()
+    apply_skip(r)
     flash(f"Rodada {r.number} pulada! Sem pontos ganhos.", "info")
 
     # Verifica se há próxima rodada
     next_number = r.number + 1
     if next_number > g.rounds_count:
-        g.status = "finished"
-        db.session.commit()
+        finish_game(g)
         flash("Última rodada concluída!", "info")
 
         # Verifica se é um duelo
@@ -1596,20 +4353,916 @@ def admin_add_card():
             hints_json=json.dumps(hints, ensure_ascii=False),
             difficulty=int(request.form.get("difficulty", 1))
         )
+        c.aliases = request.form.get("aliases", "").split(",")
         db.session.add(c)
-        db.session.commit()
+        db.session.flush()
+        card_row = (c.id, c.theme, c.answer)
+        after_commit(lambda: answer_index.add(*card_row))
+        after_commit(build_card_catalog)
         flash("Cartinha criada!", "success")
         return redirect(url_for("admin_add_card"))
     return render_template("admin_add_card.html", themes=THEMES)
 
+
+# ----------------------
+# Busca de cartas (admin)
+# ----------------------
+# Índice de texto sobre título, resposta e dicas, mantido por triggers no
+# próprio banco: FTS5 (tabela externa cards_fts) no SQLite e uma coluna
+# tsvector com índice GIN no PostgreSQL. A listagem pagina por id (keyset).
+# O FTS5 guarda índices de prefixo de 2 a 4 letras: "mar" não varre o vocabulário.
+CARD_BROWSER_PAGE_SIZE = 50
+_PG_ACCENTS = ("áàâãäéèêëíìîïóòôõöúùûüç", "aaaaaeeeeiiiiooooouuuuc")
+
+CARD_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5("
+        "title, answer, hints_json, content='cards', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+        "CREATE TRIGGER IF NOT EXISTS cards_fts_ai AFTER INSERT ON cards BEGIN "
+        "INSERT INTO cards_fts(rowid, title, answer, hints_json) "
+        "VALUES (new.id, new.title, new.answer, new.hints_json); END",
+        "CREATE TRIGGER IF NOT EXISTS cards_fts_ad AFTER DELETE ON cards BEGIN "
+        "INSERT INTO cards_fts(cards_fts, rowid, title, answer, hints_json) "
+        "VALUES ('delete', old.id, old.title, old.answer, old.hints_json); END",
+        "CREATE TRIGGER IF NOT EXISTS cards_fts_au AFTER UPDATE OF title, answer, hints_json ON cards BEGIN "
+        "INSERT INTO cards_fts(cards_fts, rowid, title, answer, hints_json) "
+        "VALUES ('delete', old.id, old.title, old.answer, old.hints_json); "
+        "INSERT INTO cards_fts(rowid, title, answer, hints_json) "
+        "VALUES (new.id, new.title, new.answer, new.hints_json); END",
+    ],
+    "postgresql": [
+        "ALTER TABLE cards ADD COLUMN IF NOT EXISTS search tsvector",
+        "CREATE OR REPLACE FUNCTION cards_search_sync() RETURNS trigger AS $$ BEGIN "
+        "NEW.search := to_tsvector('simple', translate(lower("
+        "coalesce(NEW.title, '') || ' ' || coalesce(NEW.answer, '') || ' ' || coalesce(NEW.hints_json, '')"
+        f"), '{_PG_ACCENTS[0]}', '{_PG_ACCENTS[1]}')); "
+        "RETURN NEW; END $$ LANGUAGE plpgsql",
+        "DROP TRIGGER IF EXISTS cards_search_sync ON cards",
+        "CREATE TRIGGER cards_search_sync BEFORE INSERT OR UPDATE OF title, answer, hints_json ON cards "
+        "FOR EACH ROW EXECUTE FUNCTION cards_search_sync()",
+        "CREATE INDEX IF NOT EXISTS ix_cards_search ON cards USING gin (search)",
+    ],
+}
+
+CARD_SEARCH_REBUILD = {
+    "sqlite": "INSERT INTO cards_fts(cards_fts) VALUES ('rebuild')",
+    "postgresql": "UPDATE cards SET title = title",   # dispara o trigger em todas as linhas
+}
+
+cards_fts = sa_table("cards_fts", sa_column("rowid"))
+
+
+def install_card_search(connection, rebuild=False):
+    """Cria índice e triggers de busca (idempotente); rebuild reindexa as cartas existentes."""
+    dialect = connection.dialect.name
+    for stmt in CARD_SEARCH_DDL.get(dialect, []):
+        connection.exec_driver_sql(stmt)
+    if rebuild and dialect in CARD_SEARCH_REBUILD:
+        connection.exec_driver_sql(CARD_SEARCH_REBUILD[dialect])
+
+
+# create_all/init-db já criam a busca junto com a tabela cards
+sa_event.listen(Card.__table__, "after_create", lambda target, connection, **kw: install_card_search(connection))
+
+
+def search_cards(q="", theme=None, before_id=None, limit=CARD_BROWSER_PAGE_SIZE):
+    """Cartas que batem com q (prefixo de cada palavra), da mais nova para a mais antiga."""
+    cols = (Card.id, Card.theme, Card.title, Card.answer, Card.difficulty)
+    terms = normalize(q).split()
+    dialect = db.session.get_bind().dialect.name
+
+    if terms and dialect == "sqlite":
+        # O FTS5 percorre o próprio índice em ordem de rowid: LIMIT para cedo
+        match = " ".join(f'"{term}"*' for term in terms)
+        stmt = (
+            select(*cols)
+            .select_from(cards_fts.join(Card.__table__, Card.id == cards_fts.c.rowid))
+            .where(literal_column("cards_fts").op("MATCH")(match))
+        )
+        key = cards_fts.c.rowid
+    else:
+        stmt = select(*cols)
+        key = Card.id
+        if terms and dialect == "postgresql":
+            tsquery = " & ".join(f"{term}:*" for term in terms)
+            stmt = stmt.where(literal_column("cards.search").op("@@")(func.to_tsquery("simple", tsquery)))
+        elif terms:
+            for term in terms:
+                like = f"%{term}%"
+                stmt = stmt.where(Card.title.ilike(like) | Card.answer_norm.like(like) | Card.hints_json.ilike(like))
+
+    if theme:
+        stmt = stmt.where(Card.theme == theme)
+    if before_id:
+        stmt = stmt.where(key < before_id)
+    return db.session.execute(stmt.order_by(key.desc()).limit(limit)).all()
+
+
+@app.route("/admin/cards")
+def admin_cards():
+    if not is_admin():
+        flash("Acesso negado.", "danger")
+        return redirect(url_for("index"))
+
+    q = request.args.get("q", "").strip()
+    theme = request.args.get("theme") or None
+    before_id = request.args.get("before", type=int)
+
+    cards = search_cards(q, theme, before_id, CARD_BROWSER_PAGE_SIZE + 1)
+    has_more = len(cards) > CARD_BROWSER_PAGE_SIZE
+    cards = cards[:CARD_BROWSER_PAGE_SIZE]
+    next_before = cards[-1].id if has_more else None
+    return render_template("admin_cards.html", cards=cards, q=q, theme=theme, themes=THEMES, next_before=next_before)
+
+
+@app.route("/admin/cards/<int:card_id>", methods=["GET", "POST"])
+def admin_edit_card(card_id):
+    if not is_admin():
+        flash("Acesso negado.", "danger")
+        return redirect(url_for("index"))
+
+    c = Card.query.get_or_404(card_id)
+    if request.method == "POST":
+        hints = [request.form.get(f"hint{i}", "").strip() for i in range(1, 11)]
+        c.theme = request.form["theme"]
+        c.title = request.form["title"]
+        c.answer = request.form["answer"]   # antes dos apelidos: eles descartam a própria resposta
+        c.aliases = request.form.get("aliases", "").split(",")
+        c.hints_json = json.dumps([h for h in hints if h], ensure_ascii=False)
+        c.difficulty = int(request.form.get("difficulty", 1))
+        after_commit(answer_index.reset)
+        after_commit(build_card_catalog)
+        flash("Cartinha atualizada!", "success")
+        return redirect(url_for("admin_edit_card", card_id=c.id))
+    return render_template("admin_add_card.html", themes=THEMES, card=c)
+
+
+# ----------------------
+# Exportação (CSV / NDJSON)
+# ----------------------
+EXPORT_BATCH = 1000
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_statement(name, event_id=None):
+    """Retorna (cabeçalho, select) da exportação pedida, ou None."""
+    if name == "ranking":
+        total = func.coalesce(func.sum(Game.user_score), 0).label("total_score")
+        stmt = (
+            select(User.id, User.name, User.level, User.coins, total)
+            .join(Game, Game.user_id == User.id)
+            .group_by(User.id, User.name, User.level, User.coins)
+            .order_by(User.level.desc(), total.desc(), User.id)
+        )
+        return ["user_id", "name", "level", "coins", "total_score"], stmt
+
+    if name == "weekly":
+        stmt = (
+            select(WeeklyScore.event_id, WeeklyScore.player_id, User.name, WeeklyScore.play_date, WeeklyScore.score)
+            .join(User, User.id == WeeklyScore.player_id)
+            .order_by(WeeklyScore.event_id, WeeklyScore.play_date, WeeklyScore.score.desc(), WeeklyScore.id)
+        )
+        if event_id:
+            stmt = stmt.where(WeeklyScore.event_id == event_id)
+        return ["event_id", "user_id", "name", "play_date", "score"], stmt
+
+    if name == "rounds":
+        stmt = (
+            select(
+                Round.id, Round.game_id, Game.user_id, Game.mode, Round.number, Round.card_id,
+                Round.requested_hints, Round.used_extra_hints, Round.user_points, Round.finished, Round.started_at,
+            )
+            .join(Game, Game.id == Round.game_id)
+            .order_by(Round.id)
+        )
+        return ["round_id", "game_id", "user_id", "mode", "number", "card_id",
+                "hints", "extra_hints", "points", "finished", "started_at"], stmt
+
+    return None
+
+
+def export_rows(stmt):
+    # yield_per usa cursor no servidor (stream_results): memória constante
+    return db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH))
+
+
+def export_lines(header, rows, fmt):
+    """Gera o arquivo em blocos de EXPORT_BATCH linhas."""
+    import csv
+
+    buf = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buf)
+        writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        if fmt == "csv":
+            writer.writerow(row)
+        else:
+            buf.write(json.dumps(dict(zip(header, row)), default=str, ensure_ascii=False))
+            buf.write("\n")
+        if i % EXPORT_BATCH == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+@app.route("/admin/export/<name>.<fmt>")
+@manual_commit
+@read_only
+def admin_export(name, fmt):
+    if not is_admin():
+        flash("Acesso negado.", "danger")
+        return redirect(url_for("index"))
+
+    export = export_statement(name, request.args.get("event_id", type=int))
+    if not export or fmt not in EXPORT_FORMATS:
+        return {"error": "not_found"}, 404
+
+    header, stmt = export
+    filename = f"perfut_{name}_{datetime.utcnow():%Y%m%d}.{fmt}"
+    return Response(
+        stream_with_context(export_lines(header, export_rows(stmt), fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}", "X-Accel-Buffering": "no"},
+    )
+
+
+# ----------------------
+# API (JSON)
+# ----------------------
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+
+def encode_history_cursor(game):
+    return f"{game.created_at.isoformat()}_{game.id}"
+
+
+def decode_history_cursor(cursor):
+    created_at, _, game_id = cursor.rpartition("_")
+    return datetime.fromisoformat(created_at), int(game_id)
+
+
+@app.route("/api/users/me/games")
+@read_only
+def api_my_games():
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+
+    try:
+        limit = min(int(request.args.get("limit", HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+    limit = max(limit, 1)
+
+    q = Game.query.filter(Game.user_id == session["user_id"])
+
+    mode = request.args.get("mode")
+    if mode:
+        q = q.filter(Game.mode == mode)
+
+    # themes_json é uma lista JSON; o tema aparece entre aspas
+    theme = request.args.get("theme")
+    if theme:
+        q = q.filter(Game.themes_json.contains(json.dumps(theme, ensure_ascii=False)))
+
+    # Keyset: continua a partir do último (created_at, id) da página anterior
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            cursor_at, cursor_id = decode_history_cursor(cursor)
+        except ValueError:
+            return {"error": "invalid_cursor"}, 400
+        q = q.filter(tuple_(Game.created_at, Game.id) < (cursor_at, cursor_id))
+
+    games = q.order_by(Game.created_at.desc(), Game.id.desc()).limit(limit + 1).all()
+    has_more = len(games) > limit
+    games = games[:limit]
+
+    # Resumo das rodadas de todos os jogos da página numa única consulta
+    summaries = {}
+    if games:
+        rows = (
+            db.session.query(
+                Round.game_id,
+                func.count(Round.id),
+                func.sum(case((Round.user_points > 0, 1), else_=0)),
+                func.coalesce(func.sum(Round.requested_hints), 0),
+            )
+            .filter(Round.game_id.in_([g.id for g in games]))
+            .group_by(Round.game_id)
+            .all()
+        )
+        summaries = {game_id: (played, int(hits or 0), int(hints)) for game_id, played, hits, hints in rows}
+
+    items = []
+    for g in games:
+        played, hits, hints = summaries.get(g.id, (0, 0, 0))
+        items.append({
+            "id": g.id,
+            "mode": g.mode,
+            "status": g.status,
+            "score": g.user_score,
+            "themes": g.themes,
+            "created_at": g.created_at.isoformat(),
+            "rounds": {"total": g.rounds_count, "played": played, "hits": hits, "hints": hints},
+        })
+
+    return {
+        "games": items,
+        "next_cursor": encode_history_cursor(games[-1]) if has_more else None,
+    }
+
+
+def theme_profile(user_id):
+    """Linhas de user_theme_stats do usuário, na ordem de THEMES."""
+    stats = {s.theme: s for s in UserThemeStat.query.filter_by(user_id=user_id)}
+    return [(key, label, stats.get(key)) for key, label in THEMES]
+
+
+@app.route("/api/users/me/themes")
+@read_only
+def api_my_themes():
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+
+    return {"themes": [
+        {
+            "theme": key,
+            "label": label,
+            "rounds": s.rounds if s else 0,
+            "solves": s.solves if s else 0,
+            "accuracy": round(s.accuracy, 3) if s else 0.0,
+            "mean_hints": round(s.mean_hints, 2) if s else 0.0,
+            "points": s.points_total if s else 0,
+        }
+        for key, label, s in theme_profile(session["user_id"])
+    ]}
+
+
+@app.route("/profile")
+@read_only
+def profile():
+    if not require_login():
+        return redirect(url_for("login"))
+    user = current_user()
+    return render_template("profile.html", user=user, themes=theme_profile(user.id))
+
+
+# Sugestões de resposta (autocomplete)
+SUGGEST_MIN_CHARS = 2
+SUGGEST_LIMIT = 8
+SUGGEST_REFRESH = 60.0   # segundos entre buscas de cartas novas criadas em outro worker
+
+
+class AnswerIndex:
+    """Respostas normalizadas por tema em listas ordenadas, buscadas com bisect.
+
+    Cada resposta entra pela forma completa e por cada início de palavra
+    ("messi" encontra "Lionel Messi"). Cartas novas entram com insort, sem
+    reconstruir o índice.
+    """
+
+    def __init__(self):
+        self.keys = {}      # tema -> [chave normalizada, ...] ordenada
+        self.answers = {}   # tema -> [resposta original, ...] no mesmo índice
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.refreshed_at = None
+
+    def add(self, card_id, theme, answer):
+        norm = normalize(answer)
+        if not norm:
+            return
+        words = norm.split(" ")
+        with self.lock:
+            keys = self.keys.setdefault(theme, [])
+            answers = self.answers.setdefault(theme, [])
+            for i in range(len(words)):
+                key = " ".join(words[i:])
+                pos = bisect.bisect_left(keys, key)
+                keys.insert(pos, key)
+                answers.insert(pos, answer)
+            self.last_id = max(self.last_id, card_id)
+
+    def reset(self):
+        """Descarta o índice (ex.: resposta editada); a próxima busca recarrega tudo."""
+        with self.lock:
+            self.keys, self.answers = {}, {}
+            self.last_id = 0
+            self.refreshed_at = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.refreshed_at is not None and now - self.refreshed_at < SUGGEST_REFRESH:
+            return
+        if card_catalog.available():
+            rows = card_catalog.answers(after_id=self.last_id)
+        else:
+            rows = (
+                db.session.query(Card.id, Card.theme, Card.answer)
+                .filter(Card.id > self.last_id)
+                .order_by(Card.id)
+                .all()
+            )
+        for row in rows:
+            self.add(*row)
+        self.refreshed_at = now
+
+    def suggest(self, theme, prefix, limit=SUGGEST_LIMIT):
+        keys = self.keys.get(theme, [])
+        answers = self.answers.get(theme, [])
+        out, seen = [], set()
+        i = bisect.bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix) and len(out) < limit:
+            if answers[i] not in seen:
+                seen.add(answers[i])
+                out.append(answers[i])
+            i += 1
+        # Ordem alfabética fixa: não depende da carta da rodada atual
+        return sorted(out, key=normalize)
+
+
+answer_index = AnswerIndex()
+
+
+@app.route("/api/answers/suggest")
+def api_answer_suggest():
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+
+    prefix = normalize(request.args.get("q", ""))
+    theme = request.args.get("theme")
+    if not theme and request.args.get("round_id", type=int):
+        r = db.session.get(Round, request.args.get("round_id", type=int))
+        theme = r.card.theme if r and r.game.user_id == session["user_id"] else None
+    if not theme or len(prefix) < SUGGEST_MIN_CHARS:
+        return {"suggestions": []}
+
+    answer_index.refresh()
+    return {"suggestions": answer_index.suggest(theme, prefix)}
+
+
+# --- API v1: rodada de jogo sem Post/Redirect/Get
+# Cada ação devolve só o que mudou (dica nova, pontos, próxima rodada), para o
+# cliente atualizar a tela no lugar em vez de recarregar game_play inteiro.
+def round_state(r):
+    """Estado visível de uma rodada (o mesmo que game.html mostra)."""
+    hints = json.loads(r.hints_order_json or "[]")
+    state = {
+        "id": r.id,
+        "number": r.number,
+        "theme": r.card.theme,
+        "hints": hints[:r.requested_hints],
+        "requested_hints": r.requested_hints,
+        "card_points": card_points(r.requested_hints),
+        "seconds_left": max(0, int((r.ends_at - datetime.utcnow()).total_seconds())),
+        "finished": r.finished,
+        "extra": extra_hint_state(r) if r.used_extra_hints else None,
+    }
+    if r.finished:
+        state["answer"] = r.card.answer
+    return state
+
+
+def extra_hint_state(r):
+    return {"letters": len(r.card.answer), "initial": r.card.answer[:1]}
+
+
+def api_round(round_id):
+    """Rodada do usuário logado, ou None (inexistente ou de outra pessoa)."""
+    r = db.session.get(Round, round_id)
+    if r is None or r.game.user_id != session["user_id"]:
+        return None
+    return r
+
+
+def api_round_closed(r):
+    """Encerra a rodada se o tempo acabou. Devolve o delta JSON, ou None se ela segue aberta.
+
+    Responde 200 (e não 409) porque pode abrir a próxima rodada, que precisa
+    ser gravada pela unidade de trabalho.
+    """
+    if not r.finished and datetime.utcnow() > r.ends_at:
+        r.finished = True
+        record_card_play(r, solved=False)
+        return {"closed": "time_up", "answer": r.card.answer, **api_advance(r.game)}
+    if r.finished:
+        return {"closed": "round_finished", "answer": r.card.answer, **api_advance(r.game)}
+    return None
+
+
+def api_advance(g):
+    """Abre a próxima rodada, ou marca a partida como encerrada."""
+    number = sum(1 for r in g.rounds if r.finished) + 1
+    if number > g.rounds_count:
+        finish_game(g)
+        # game_play decide entre resultado solo e espera/resultado do duelo
+        return {"score": g.user_score, "game_finished": True, "next_round": None,
+                "next_url": url_for("game_play", game_id=g.id)}
+    nxt = open_round(g, number)
+    return {"score": g.user_score, "game_finished": False,
+            "next_round": round_state(nxt) if nxt else None}
+
+
+@app.route("/api/v1/games/<int:game_id>")
+def api_v1_game(game_id):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+    g = db.session.get(Game, game_id)
+    if g is None or g.user_id != session["user_id"]:
+        return {"error": "not_found"}, 404
+    return {
+        "id": g.id,
+        "mode": g.mode,
+        "rounds_count": g.rounds_count,
+        **api_advance(g),
+    }
+
+
+@app.route("/api/v1/rounds/<int:round_id>/hint", methods=["POST"])
+def api_v1_hint(round_id):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+    r = api_round(round_id)
+    if r is None:
+        return {"error": "not_found"}, 404
+    closed = api_round_closed(r)
+    if closed:
+        return closed
+    if r.requested_hints >= 10:
+        return {"error": "max_hints"}, 409
+
+    r.requested_hints += 1
+    hints = json.loads(r.hints_order_json or "[]")
+    return {
+        "hint": hints[r.requested_hints - 1] if r.requested_hints <= len(hints) else None,
+        "requested_hints": r.requested_hints,
+        "card_points": card_points(r.requested_hints),
+    }
+
+
+@app.route("/api/v1/rounds/<int:round_id>/extra_hint", methods=["POST"])
+def api_v1_extra_hint(round_id):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+    r = api_round(round_id)
+    if r is None:
+        return {"error": "not_found"}, 404
+    closed = api_round_closed(r)
+    if closed:
+        return closed
+    if r.used_extra_hints >= 1:
+        return {"error": "extra_hint_used"}, 409
+
+    coins = debit(current_user(), 5, "extra_hint")
+    if coins is None:
+        return {"error": "insufficient_coins"}, 402
+    r.used_extra_hints = 1
+    return {"extra": extra_hint_state(r), "coins": coins}
+
+
+@app.route("/api/v1/rounds/<int:round_id>/guess", methods=["POST"])
+def api_v1_guess(round_id):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+    r = api_round(round_id)
+    if r is None:
+        return {"error": "not_found"}, 404
+    closed = api_round_closed(r)
+    if closed:
+        return closed
+
+    user = current_user()
+    old_level = user.level
+    data = request.get_json(silent=True) or request.form
+    correct = apply_guess(r, data.get("guess", ""), user)
+    return {
+        "correct": correct,
+        "points": r.user_points,
+        "answer": r.card.answer,
+        "level": user.level,
+        "level_up": user.level > old_level,
+        **api_advance(r.game),
+    }
+
+
+@app.route("/api/v1/rounds/<int:round_id>/skip", methods=["POST"])
+def api_v1_skip(round_id):
+    if "user_id" not in session:
+        return {"error": "login_required"}, 401
+    r = api_round(round_id)
+    if r is None:
+        return {"error": "not_found"}, 404
+    closed = api_round_closed(r)
+    if closed:
+        return closed
+
+    apply_skip(r)
+    return {"answer": r.card.answer, **api_advance(r.game)}
+
+
+# ----------------------
+# Atualização de esquema
+# ----------------------
+# create_all() só cria tabelas que faltam; colunas novas em tabelas que já
+# existem entram por "flask upgrade-db", que também preenche os dados delas.
+SCHEMA_UPGRADES = [
+    (Card, ("answer_norm", "aliases_json")),
+    (Duel, ("created_at", "finished_at", "winner_id")),
+    (DuelScore, ("badge",)),
+]
+
+
+def add_missing_columns(model, columns):
+    """ALTER TABLE ... ADD COLUMN para as colunas do modelo que o banco ainda não tem."""
+    table = model.__table__
+    existing = {c["name"] for c in sa_inspect(db.engine).get_columns(table.name)}
+    added = []
+    for name in columns:
+        if name in existing:
+            continue
+        col = table.c[name]
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {col.type.compile(dialect=db.engine.dialect)}"
+        for fk in col.foreign_keys:
+            ddl += f" REFERENCES {fk.column.table.name} ({fk.column.name})"
+        db.session.execute(db.text(ddl))
+        added.append(name)
+    db.session.commit()
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
+    return added
+
+
+def normalize_card_answers(chunk_size=1000):
+    """Preenche answer_norm nas cartas antigas, em blocos."""
+    done = 0
+    while True:
+        cards = Card.query.filter(Card.answer_norm.is_(None)).order_by(Card.id).limit(chunk_size).all()
+        if not cards:
+            break
+        for c in cards:
+            c.answer_norm = normalize(c.answer)
+        db.session.commit()
+        done += len(cards)
+    return done
+
+
+def backfill_duel_results():
+    """Vencedor e badges dos duelos encerrados antes de finalize_duel existir."""
+    badges = db.session.execute(
+        select(Badge.name, Badge.level_required).order_by(Badge.level_required.desc())
+    ).all()
+    done = 0
+    for duel in Duel.query.filter(Duel.status == "finished", Duel.winner_id.is_(None)):
+        scores = {s.user_id: s for s in duel.scores}
+        creator, opponent = scores.get(duel.creator_id), scores.get(duel.opponent_id)
+        if not (creator and opponent):
+            continue
+        if creator.score != opponent.score:
+            duel.winner_id = duel.creator_id if creator.score > opponent.score else duel.opponent_id
+            done += 1
+    for score in DuelScore.query.filter(DuelScore.badge.is_(None)):
+        score.badge = next((name for name, level in badges if (score.score or 0) >= level), "")
+    db.session.commit()
+    return done
+
+
+def quiz_scores_unique():
+    """Se quiz_scores já tem unicidade em user_id (índice ou constraint)."""
+    insp = sa_inspect(db.engine)
+    return any(ix["unique"] and ix["column_names"] == ["user_id"] for ix in insp.get_indexes("quiz_scores")) or any(
+        uc["column_names"] == ["user_id"] for uc in insp.get_unique_constraints("quiz_scores")
+    )
+
+
+def dedupe_quiz_scores():
+    """Junta linhas duplicadas de quiz_scores e cria o índice único em user_id.
+
+    O upsert de quiz_result (ON CONFLICT (user_id)) depende desse índice, que
+    bancos anteriores à coluna unique não têm. Devolve quantos usuários tinham
+    linhas duplicadas.
+    """
+    if quiz_scores_unique():
+        return 0
+    dupes = (
+        db.session.query(QuizScore.user_id)
+        .group_by(QuizScore.user_id)
+        .having(func.count(QuizScore.id) > 1)
+        .all()
+    )
+    for (user_id,) in dupes:
+        rows = QuizScore.query.filter_by(user_id=user_id).order_by(QuizScore.id).all()
+        keep = rows[0]
+        keep.score = sum(r.score for r in rows)
+        keep.played_at = max(r.played_at for r in rows)
+        for r in rows[1:]:
+            db.session.delete(r)
+    db.session.commit()
+    db.session.execute(db.text("CREATE UNIQUE INDEX IF NOT EXISTS ux_quiz_scores_user_id ON quiz_scores (user_id)"))
+    db.session.commit()
+    return len(dupes)
+
+
+def upgrade_schema():
+    """Aplica SCHEMA_UPGRADES e os preenchimentos; pode rodar de novo sem efeito."""
+    db.create_all()
+    for model, columns in SCHEMA_UPGRADES:
+        for name in add_missing_columns(model, columns):
+            print(f"{model.__tablename__}.{name} adicionada")
+    print(f"{dedupe_quiz_scores()} usuários com pontuação de quiz duplicada unificados")
+    print(f"{normalize_card_answers()} cartas normalizadas")
+    print(f"{backfill_duel_results()} duelos encerrados com vencedor preenchido")
+    print(f"Catálogo com {build_card_catalog()} cartas gravado em {catalog_path()}")
+
+
 # --- CLI
 @app.cli.command("init-db")
 def init_db():
     db.drop_all()
     db.create_all()
+    # Um catálogo de um banco anterior apontaria para cartas que não existem mais
+    build_card_catalog()
     print("Banco criado e pronto!")
 
+
+@app.cli.command("recalc-levels")
+@click.option("--chunk-size", default=LEVEL_RECALC_CHUNK, help="Usuários por UPDATE.")
+def recalc_levels_command(chunk_size):
+    """Recalcula o nível de todos os usuários a partir das partidas."""
+    t0 = time.perf_counter()
+    changed = recalc_levels(chunk_size)
+    print(f"{changed} níveis atualizados em {time.perf_counter() - t0:.2f}s")
+
+
+@app.cli.command("compact-coin-ledger")
+@click.option("--keep-days", default=COIN_LEDGER_KEEP_DAYS, help="Dias de ledger mantidos sem compactar.")
+def compact_coin_ledger_command(keep_days):
+    """Consolida o ledger de moedas antigo em snapshots de saldo."""
+    removed = compact_coin_ledger(keep_days)
+    print(f"{removed} lançamentos compactados")
+
+
+@app.cli.command("normalize-answers")
+@click.option("--chunk-size", default=1000)
+def normalize_answers_command(chunk_size):
+    """Preenche answer_norm nas cartas antigas."""
+    print(f"{normalize_card_answers(chunk_size)} cartas normalizadas")
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Adiciona colunas novas em tabelas existentes e preenche os dados delas."""
+    upgrade_schema()
+
+
+@app.cli.command("rebucket-difficulty")
+@click.option("--min-plays", default=DIFFICULTY_MIN_PLAYS, help="Jogadas mínimas para reclassificar.")
+def rebucket_difficulty_command(min_plays):
+    """Recalcula a dificuldade das cartas a partir de card_stats."""
+    changed = rebucket_difficulty(min_plays)
+    print(f"{changed} cartas reclassificadas")
+
+
+@app.cli.command("build-weekly-deck")
+def build_weekly_deck_command():
+    """Sorteia o baralho de hoje do evento semanal ativo (para rodar via agendador)."""
+    event = active_weekly_event()
+    deck = weekly_deck_for(event.id if event else None, datetime.utcnow().date())
+    if deck is None:
+        print("Nenhum evento ativo")
+        return
+    print(f"Baralho de hoje: {deck}")
+
+
+@app.cli.command("dedupe-quiz-scores")
+def dedupe_quiz_scores_command():
+    """Junta linhas duplicadas de quiz_scores e cria o índice único em user_id."""
+    print(f"{dedupe_quiz_scores()} usuários com pontuação duplicada unificados")
+
+
+@app.cli.command("export")
+@click.argument("name", type=click.Choice(["ranking", "weekly", "rounds"]))
+@click.option("--format", "fmt", type=click.Choice(list(EXPORT_FORMATS)), default="csv")
+@click.option("--event-id", type=int, default=None, help="Filtra a exportação weekly por evento.")
+@click.option("--out", default="-", help="Arquivo de saída (padrão: stdout).")
+def export_command(name, fmt, event_id, out):
+    """Exporta ranking, resultados semanais ou o log de rodadas em streaming."""
+    header, stmt = export_statement(name, event_id)
+    f = sys.stdout if out == "-" else open(out, "w", newline="", encoding="utf-8")
+    try:
+        for chunk in export_lines(header, export_rows(stmt), fmt):
+            f.write(chunk)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+@app.cli.command("rollup-daily-stats")
+@click.option("--day", help="Dia (AAAA-MM-DD); padrão: ontem.")
+@click.option("--days", default=1, help="Quantos dias recalcular, terminando em --day.")
+def rollup_daily_stats_command(day, days):
+    """Recalcula daily_stats de dias fechados (pode rodar de novo sem duplicar)."""
+    last = datetime.strptime(day, "%Y-%m-%d").date() if day else datetime.utcnow().date() - timedelta(days=1)
+    for i in range(days - 1, -1, -1):
+        d = last - timedelta(days=i)
+        metrics = rollup_daily_stats(d)
+        print(d, ", ".join(f"{k}={v}" for k, v in sorted(metrics.items())))
+
+
+@app.cli.command("backfill-theme-stats")
+@click.option("--chunk-size", default=THEME_BACKFILL_CHUNK)
+def backfill_theme_stats_command(chunk_size):
+    """Preenche user_theme_stats com o histórico de rodadas (roda uma vez)."""
+    total = backfill_theme_stats(chunk_size)
+    print(f"{total} rodadas agregadas em user_theme_stats")
+
+
+@app.cli.command("backfill-daily-scores")
+@click.option("--chunk-size", default=THEME_BACKFILL_CHUNK)
+def backfill_daily_scores_command(chunk_size):
+    """Preenche user_daily_scores com o histórico de rodadas (roda uma vez)."""
+    total = backfill_daily_scores(chunk_size)
+    print(f"{total} rodadas pontuadas agregadas em user_daily_scores")
+
+
+@app.cli.command("build-card-search")
+def build_card_search_command():
+    """Cria (se faltar) o índice de busca de cartas e reindexa todas."""
+    install_card_search(db.session.connection(), rebuild=True)
+    db.session.commit()
+    print("Índice de busca de cartas reconstruído.")
+
+
+@app.cli.command("build-catalog")
+def build_catalog_command():
+    """Gera o snapshot binário da tabela cards (lido via mmap pelos workers)."""
+    n = build_card_catalog()
+    print(f"Catálogo com {n} cartas gravado em {catalog_path()}")
+
+
+@app.cli.command("advance-tournament")
+@click.argument("tournament_id", type=int)
+def advance_tournament_command(tournament_id):
+    """Inicia a copa (se aberta) ou encerra a fase atual e gera a próxima."""
+    t = db.session.get(Tournament, tournament_id)
+    if t is None:
+        print("Torneio não encontrado.")
+        return
+    if t.status == "open":
+        start_tournament(t)
+    elif t.status == "running":
+        advance_tournament(t)
+    db.session.commit()
+    print(f"Torneio {t.id}: {t.status}, fase {t.stage}/{t.total_stages}")
+
+
+# --- Startup
+WARMUP_TEMPLATES = ["base.html", "index.html", "game.html", "game_mode.html", "ranking.html", "quiz.html"]
+
+
+def warmup():
+    """Aquece o que a primeira requisição pagaria: mapeamentos do ORM,
+    templates mais usados e os caches de leitura.
+
+    Com preload_app (gunicorn.conf.py) roda uma vez no master e os workers
+    herdam tudo pelo fork.
+    """
+    from sqlalchemy.orm import configure_mappers
+
+    configure_mappers()
+    for name in WARMUP_TEMPLATES:
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        try:
+            if not os.path.exists(catalog_path()):
+                build_card_catalog()
+            # Mapeia e confere com a tabela cards (regera se ficou para trás)
+            card_catalog.available()
+            answer_index.refresh()
+            for name in RankBoards.loaders:
+                rank_boards.get(name)
+            quiz_top.get()
+        except Exception:
+            # Banco fora do ar ou sem migração no boot: o master sobe mesmo assim
+            # e os workers montam os caches na primeira requisição.
+            app.logger.exception("warmup falhou; caches serão montados sob demanda")
+            answer_index.reset()
+            rank_boards.boards.clear()
+            quiz_top.loaded_at = None
+        finally:
+            db.session.remove()
+            # Conexões abertas aqui não podem ser herdadas pelos workers
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+create_app()
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
+    warmup()
     app.run(host="0.0.0.0", port=8080, debug=False)
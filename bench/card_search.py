@@ -0,0 +1,58 @@
+"""Mede a busca do admin sobre muitas cartas (inseridas e desfeitas no fim).
+
+Usa o banco de DATABASE_URL; nada é gravado.
+
+Uso: python bench/card_search.py --cards 100000 --queries 200
+"""
+import json
+import os
+import random
+import sys
+import time
+
+import click
+from sqlalchemy import insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import CARD_BROWSER_PAGE_SIZE, THEMES, Card, app, db, install_card_search, search_cards  # noqa: E402
+
+
+@click.command()
+@click.option("--cards", default=100000)
+@click.option("--queries", default=200)
+def main(cards, queries):
+    with app.app_context():
+        install_card_search(db.session.connection())
+        rng = random.Random(7)
+        syllables = ["ma", "ri", "so", "pa", "lo", "gre", "mio", "fla", "men", "go", "vas", "co", "ro", "nal", "do"]
+
+        def word():
+            return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+
+        themes = [key for key, _ in THEMES]
+        t0 = time.perf_counter()
+        db.session.execute(insert(Card.__table__), [
+            {"theme": rng.choice(themes), "title": f"{word()} {word()}", "answer": f"{word()} {word()}",
+             "answer_norm": "", "hints_json": json.dumps([word() for _ in range(5)]), "difficulty": 1}
+            for _ in range(cards)
+        ])
+        t1 = time.perf_counter()
+        try:
+            samples = [word()[:rng.randint(3, 6)] for _ in range(queries)]
+            timings = []
+            for q in samples:
+                s0 = time.perf_counter()
+                page = search_cards(q, limit=CARD_BROWSER_PAGE_SIZE + 1)
+                if len(page) > CARD_BROWSER_PAGE_SIZE:
+                    search_cards(q, before_id=page[-2].id, limit=CARD_BROWSER_PAGE_SIZE + 1)
+                timings.append(time.perf_counter() - s0)
+            timings.sort()
+            print(f"{cards} cartas inseridas em {t1 - t0:.1f}s; {queries} buscas (2 páginas): "
+                  f"mediana {1000 * timings[len(timings) // 2]:.1f} ms, p95 {1000 * timings[int(len(timings) * 0.95)]:.1f} ms")
+        finally:
+            db.session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Mede o fan-out do DuelHub com muitos inscritos ociosos num worker.
+
+Uso: python bench/duel_stream.py --subscribers 5000 --duels 2500
+"""
+import os
+import sys
+import threading
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import DuelHub  # noqa: E402
+
+
+@click.command()
+@click.option("--subscribers", default=5000, help="Conexões ociosas simuladas.")
+@click.option("--duels", default=2500, help="Duelos distintos.")
+def main(subscribers, duels):
+    hub = DuelHub()
+    hub.thread = threading.current_thread()  # sem thread de leitura do banco
+    t0 = time.perf_counter()
+    subs = [(i % duels, hub.subscribe(i % duels)) for i in range(subscribers)]
+    t1 = time.perf_counter()
+    for duel_id in range(duels):
+        hub.publish(duel_id, {"id": 1, "user_id": 0, "round": 1, "kind": "hit", "points": 10})
+    t2 = time.perf_counter()
+    delivered = sum(q.qsize() for _, q in subs)
+    for duel_id, q in subs:
+        hub.unsubscribe(duel_id, q)
+    print(f"{subscribers} inscritos: subscribe {1000 * (t1 - t0):.1f} ms, "
+          f"publish em {duels} duelos {1000 * (t2 - t1):.1f} ms, {delivered} eventos entregues")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Mede chutes por segundo com normalize + apelidos + tolerância a erros.
+
+Uso: python bench/guess.py --cards 5000 --guesses 50000
+"""
+import os
+import random
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import Card, answer_matches, normalize  # noqa: E402
+
+
+@click.command()
+@click.option("--cards", default=5000, help="Tamanho do pool de cartas.")
+@click.option("--guesses", default=50000)
+def main(cards, guesses):
+    rng = random.Random(42)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+
+    def word():
+        return "".join(rng.choice(letters) for _ in range(rng.randint(4, 9)))
+
+    pool = []
+    for _ in range(cards):
+        c = Card(theme="clube", title="", hints_json="[]", answer=" ".join(word() for _ in range(rng.randint(1, 3))).title())
+        c.aliases = [word()]
+        pool.append(c)
+
+    samples = []
+    for _ in range(guesses):
+        c = rng.choice(pool)
+        kind = rng.random()
+        if kind < 0.4:
+            guess = c.answer
+        elif kind < 0.7:
+            i = rng.randrange(len(c.answer))
+            guess = c.answer[:i] + rng.choice(letters) + c.answer[i + 1:]
+        else:
+            guess = word()
+        samples.append((guess, c))
+
+    t0 = time.perf_counter()
+    hits = sum(answer_matches(normalize(guess), c) for guess, c in samples)
+    elapsed = time.perf_counter() - t0
+    print(f"{guesses} chutes em {elapsed:.3f}s ({guesses / elapsed:,.0f}/s), {hits} aceitos, pool de {cards} cartas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Mede montagem, atualização e consulta de posição num ranking em memória.
+
+Uso: python bench/rank.py --players 500000 --lookups 10000
+"""
+import os
+import random
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import RANK_NEIGHBOURS, RankBoard  # noqa: E402
+
+
+@click.command()
+@click.option("--players", default=500000)
+@click.option("--lookups", default=10000)
+def main(players, lookups):
+    rng = random.Random(3)
+    t0 = time.perf_counter()
+    board = RankBoard((user_id, rng.randint(1, 20000)) for user_id in range(1, players + 1))
+    t1 = time.perf_counter()
+    for _ in range(lookups):
+        board.add(rng.randint(1, players), rng.randint(1, 10))
+    t2 = time.perf_counter()
+    for _ in range(lookups):
+        board.around(rng.randint(1, players))
+    t3 = time.perf_counter()
+    print(f"{players} jogadores: montagem {t1 - t0:.2f}s, "
+          f"atualização {1e6 * (t2 - t1) / lookups:.1f} µs, posição ±{RANK_NEIGHBOURS} {1e6 * (t3 - t2) / lookups:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
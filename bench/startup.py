@@ -0,0 +1,40 @@
+"""Mede tempo de import e latência da primeira requisição, com e sem warmup.
+
+Cada rodada é um processo novo, para medir o import a frio.
+
+Uso: python bench/startup.py --runs 5
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CODE = (
+    "import time; t0 = time.perf_counter(); import app as m; t1 = time.perf_counter()\n"
+    "if {warm}: m.warmup()\n"
+    "c = m.app.test_client(); t2 = time.perf_counter(); c.get('/quiz/ranking'); t3 = time.perf_counter()\n"
+    "print((t1 - t0) * 1000, (t3 - t2) * 1000)"
+)
+
+
+@click.command()
+@click.option("--runs", default=5)
+def main(runs):
+    for warm in (False, True):
+        imports, firsts = [], []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", CODE.format(warm=warm)], cwd=ROOT,
+                                 capture_output=True, text=True, check=True).stdout.split()
+            imports.append(float(out[0]))
+            firsts.append(float(out[1]))
+        label = "com warmup" if warm else "sem warmup"
+        print(f"{label}: import {statistics.median(imports):.1f} ms, "
+              f"primeira requisição {statistics.median(firsts):.1f} ms (mediana de {runs})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Mede início e avanço de fase de uma copa grande (tudo desfeito no fim).
+
+Usa o banco de DATABASE_URL; nada é gravado.
+
+Uso: python bench/tournament.py --players 10000 --format single
+"""
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+import click
+from sqlalchemy import insert, update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import (  # noqa: E402
+    THEMES, TOURNAMENT_FORMATS, Game, Tournament, TournamentPlayer, User, advance_tournament, app, db,
+    start_tournament,
+)
+
+
+@click.command()
+@click.option("--players", default=10000)
+@click.option("--format", "fmt", type=click.Choice(list(TOURNAMENT_FORMATS)), default="single")
+def main(players, fmt):
+    with app.app_context():
+        now = datetime.utcnow()
+        user_ids = db.session.scalars(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            [{"name": f"bench{i}", "email": f"bench{i}@bench.invalid", "password_hash": "",
+              "level": random.randint(1, 50), "coins": 0, "created_at": now} for i in range(players)],
+        ).all()
+        t = Tournament(name="bench", format=fmt, themes_json=json.dumps([key for key, _ in THEMES]))
+        db.session.add(t)
+        db.session.flush()
+        db.session.execute(insert(TournamentPlayer), [{"tournament_id": t.id, "user_id": u} for u in user_ids])
+
+        try:
+            t0 = time.perf_counter()
+            start_tournament(t)
+            db.session.flush()
+            timings = [time.perf_counter() - t0]
+            while t.status == "running":
+                # Placar aleatório para todos os jogos da fase num único UPDATE
+                db.session.execute(
+                    update(Game).where(Game.mode == "tournament", Game.status == "active")
+                    .values(user_score=(Game.id * 7919 + t.stage * 104729) % 50)
+                    .execution_options(synchronize_session=False)
+                )
+                t0 = time.perf_counter()
+                advance_tournament(t)
+                db.session.flush()
+                timings.append(time.perf_counter() - t0)
+            print(f"{players} jogadores ({fmt}): início {1000 * timings[0]:.0f} ms, "
+                  f"avanço máx {1000 * max(timings[1:]):.0f} ms em {len(timings) - 1} fases")
+        finally:
+            db.session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# Configuração do gunicorn (usada pelo Procfile)
+#
+# preload_app importa o app uma vez no master; o warmup aquece ORM, templates
+# e caches ali, e os workers herdam essa memória pelo fork em vez de cada um
+# montar a sua.
+import os
+
+preload_app = True
+
+# Cada página de duelo mantém um EventSource aberto em /duel/<id>/stream. Com o
+# worker sync padrão essa conexão ocupa o worker inteiro (e o timeout de 30s a
+# derruba); com gthread ela ocupa só uma thread, e o timeout passa a valer para
+# o processo, não para a requisição. gthread vem com o gunicorn.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+
+def on_starting(server):
+    from app import warmup
+
+    warmup()
+
+
+def post_fork(server, worker):
+    # Cada worker abre suas próprias conexões com o banco
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+# O app lê DATABASE_URL/REPLICA_DATABASE_URL na importação: dois arquivos SQLite
+# locais fazem o papel de primário e réplica.
+TMP = tempfile.mkdtemp(prefix="perfut-tests-")
+PRIMARY = os.path.join(TMP, "primary.db")
+REPLICA = os.path.join(TMP, "replica.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{PRIMARY}"
+os.environ["REPLICA_DATABASE_URL"] = f"sqlite:///{REPLICA}"
+os.environ.pop("ANALYTICS_DATABASE_URL", None)
+os.environ.pop("PERFUT_RATELIMIT_DB", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as perfut  # noqa: E402
+
+
+@pytest.fixture
+def app_ctx(monkeypatch):
+    perfut.app.config["TESTING"] = True
+    perfut.app.config["CARD_CATALOG_PATH"] = os.path.join(TMP, "cards.catalog")
+    monkeypatch.setattr(perfut, "replica_guard", perfut.ReplicaGuard())
+    monkeypatch.setattr(perfut, "DAILY_STATS_FLUSH", 10 ** 9)
+    monkeypatch.setattr(perfut, "card_catalog", perfut.CardCatalog())
+    monkeypatch.setattr(perfut, "rank_boards", perfut.RankBoards())
+    monkeypatch.setattr(perfut, "matchmaking_cache", perfut.MatchmakingCache())
+    monkeypatch.setattr(perfut.rate_limiter, "store", perfut.MemoryBuckets())
+    perfut.weekly_deck_cache.clear()
+    perfut.weekly_game_events.clear()
+    perfut.period_cache.clear()
+    perfut.daily_stats_buffer.counts.clear()
+    for path in (REPLICA, perfut.app.config["CARD_CATALOG_PATH"]):
+        if os.path.exists(path):
+            os.remove(path)
+    with perfut.app.app_context():
+        perfut.db.drop_all()
+        perfut.db.create_all()
+        yield perfut
+        perfut.db.session.remove()
+        for engine in perfut.db.engines.values():
+            engine.dispose()
+
+
+def make_user(name, coins=100):
+    """Cria o usuário no primário e devolve o id."""
+    user = perfut.User(name=name, email=f"{name}@example.com", coins=coins)
+    user.set_password("x")
+    perfut.db.session.add(user)
+    perfut.db.session.commit()
+    return user.id
+
+
+def login(user_id):
+    client = perfut.app.test_client()
+    # Um IP por usuário: o balde por IP do limitador não mistura jogadores
+    client.environ_base["REMOTE_ADDR"] = f"10.0.{user_id // 256}.{user_id % 256}"
+    with client.session_transaction() as s:
+        s["user_id"] = user_id
+    return client
+
+
+def replicate():
+    """Copia o primário sobre a réplica, no lugar da replicação de verdade."""
+    perfut.db.session.remove()
+    for engine in perfut.db.engines.values():
+        engine.dispose()
+    src, dst = sqlite3.connect(PRIMARY), sqlite3.connect(REPLICA)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
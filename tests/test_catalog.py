@@ -0,0 +1,57 @@
+import json
+
+from sqlalchemy import delete
+
+from conftest import make_user, perfut
+
+
+def add_card(answer, theme="estadio"):
+    card = perfut.Card(theme=theme, title=answer, answer=answer, hints_json=json.dumps(["dica"]), difficulty=1)
+    perfut.db.session.add(card)
+    perfut.db.session.commit()
+    return card.id
+
+
+def catalog_ids(theme="estadio"):
+    return sorted(card_id for card_id, _ in perfut.card_catalog.theme_cards(theme))
+
+
+def test_catalog_is_rebuilt_when_behind_the_table(app_ctx, monkeypatch):
+    monkeypatch.setattr(perfut, "CATALOG_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(perfut, "CATALOG_VERIFY_INTERVAL", 0)
+    first = add_card("Maracanã")
+    perfut.build_card_catalog()
+    assert catalog_ids() == [first]
+
+    # Carta inserida sem passar pelo admin (seed, SQL direto)
+    second = add_card("Pacaembu")
+    assert catalog_ids() == [first, second]
+    assert perfut.card_catalog.get(second).answer == "Pacaembu"
+
+
+def test_open_round_falls_back_to_the_table(app_ctx, monkeypatch):
+    gone = add_card("Maracanã")
+    perfut.build_card_catalog()
+    # Catálogo desatualizado e ainda não conferido: só conhece a carta apagada
+    monkeypatch.setattr(perfut.card_catalog, "_verify", lambda snap: snap)
+    perfut.db.session.execute(delete(perfut.Card).where(perfut.Card.id == gone))
+    fresh = add_card("Pacaembu")
+    assert catalog_ids() == [gone]
+
+    game = perfut.Game(user_id=make_user("ana"), themes_json=json.dumps(["estadio"]), rounds_count=1)
+    perfut.db.session.add(game)
+    perfut.db.session.commit()
+
+    r = perfut.open_round(game, 1)
+    assert r is not None and r.card_id == fresh
+
+
+def test_init_db_rebuilds_the_catalog(app_ctx, monkeypatch):
+    monkeypatch.setattr(perfut, "CATALOG_CHECK_INTERVAL", 0)
+    add_card("Maracanã")
+    perfut.build_card_catalog()
+    assert len(catalog_ids()) == 1
+
+    result = perfut.app.test_cli_runner().invoke(args=["init-db"])
+    assert result.exit_code == 0, result.output
+    assert catalog_ids() == []
@@ -0,0 +1,102 @@
+from sqlalchemy import update
+
+from conftest import login, make_user, perfut
+
+
+def start_duel(creator_score, opponent_score):
+    """Duelo ativo com uma partida de duelo por jogador; devolve (duelo, partidas)."""
+    db = perfut.db
+    creator, opponent = make_user("ana"), make_user("bia")
+    db.session.add_all([perfut.Badge(name="Craque", level_required=20),
+                        perfut.Badge(name="Reserva", level_required=0)])
+    duel = perfut.Duel(creator_id=creator, opponent_id=opponent, themes_json="[]", status="active", code="ABC123")
+    games = [
+        perfut.Game(user_id=user_id, themes_json="[]", mode="duel", user_score=score)
+        for user_id, score in ((creator, creator_score), (opponent, opponent_score))
+    ]
+    db.session.add(duel)
+    db.session.add_all(games)
+    db.session.commit()
+    return duel, games
+
+
+def stored_scores(duel_id):
+    return sorted((s.user_id, s.score, s.badge) for s in perfut.DuelScore.query.filter_by(duel_id=duel_id))
+
+
+def test_duel_waits_for_both_games(app_ctx):
+    duel, (first, _) = start_duel(30, 10)
+
+    perfut.finish_game(first)
+    perfut.db.session.commit()
+
+    assert duel.status == "active"
+    assert stored_scores(duel.id) == []
+
+
+def test_second_game_finalizes_once(app_ctx):
+    duel, (first, second) = start_duel(30, 10)
+
+    perfut.finish_game(first)
+    perfut.finish_game(second)
+    perfut.db.session.commit()
+
+    assert duel.status == "finished"
+    assert duel.finished_at is not None
+    assert duel.winner_id == duel.creator_id
+    assert stored_scores(duel.id) == [(duel.creator_id, 30, "Craque"), (duel.opponent_id, 10, "Reserva")]
+
+    # Terminar de novo (ou pelo outro jogador) não grava outro resultado
+    assert perfut.finalize_duel(duel.creator_id) is None
+    perfut.finish_game(second)
+    perfut.db.session.commit()
+    assert perfut.DuelScore.query.filter_by(duel_id=duel.id).count() == 2
+
+
+def test_tie_has_no_winner(app_ctx):
+    duel, games = start_duel(15, 15)
+
+    for game in games:
+        perfut.finish_game(game)
+    perfut.db.session.commit()
+
+    assert duel.status == "finished"
+    assert duel.winner_id is None
+
+
+def test_lost_claim_writes_nothing(app_ctx, monkeypatch):
+    duel, games = start_duel(30, 10)
+    for game in games:
+        game.status = "finished"
+    perfut.db.session.commit()
+
+    real_latest = perfut.latest_duel_game
+
+    def finalized_elsewhere(user_id):
+        # O outro jogador finaliza entre a leitura do duelo e o UPDATE condicional
+        with perfut.db.engine.begin() as conn:
+            conn.execute(update(perfut.Duel).where(perfut.Duel.id == duel.id).values(status="finished"))
+        return real_latest(user_id)
+
+    monkeypatch.setattr(perfut, "latest_duel_game", finalized_elsewhere)
+    assert perfut.finalize_duel(duel.creator_id) is None
+    perfut.db.session.commit()
+
+    assert stored_scores(duel.id) == []
+    assert perfut.db.session.get(perfut.Duel, duel.id).winner_id is None
+
+
+def test_result_page_does_not_write(app_ctx):
+    duel, games = start_duel(30, 10)
+    for game in games:
+        perfut.finish_game(game)
+    perfut.db.session.commit()
+    duel_id, creator_id = duel.id, duel.creator_id
+
+    client = login(creator_id)
+    first = client.get(f"/duel/result/{duel_id}")
+    again = client.get(f"/duel/result/{duel_id}", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.status_code == 200
+    assert again.status_code == 304
+    assert perfut.DuelScore.query.filter_by(duel_id=duel_id).count() == 2
@@ -0,0 +1,67 @@
+import json
+
+from conftest import login, make_user, perfut
+
+
+def solo_game(user_id, answer="Maracanazo", aliases=()):
+    db = perfut.db
+    card = perfut.Card(theme="estadio", title="Final de 1950", answer=answer,
+                       hints_json=json.dumps(["Rio de Janeiro", "1950"]), difficulty=1)
+    card.aliases = list(aliases)
+    game = perfut.Game(user_id=user_id, themes_json=json.dumps(["estadio"]), rounds_count=2)
+    db.session.add_all([card, game])
+    db.session.commit()
+    return game.id
+
+
+def current_round(game_id):
+    return perfut.Round.query.filter_by(game_id=game_id).order_by(perfut.Round.number.desc()).first()
+
+
+def test_play_page_does_not_contain_the_answer(app_ctx):
+    user_id = make_user("ana")
+    game_id = solo_game(user_id)
+    client = login(user_id)
+
+    page = client.get(f"/game/play/{game_id}").get_data(as_text=True)
+    assert "Maracanazo" not in page
+    assert "maracanazo" not in page
+
+
+def test_extra_hint_shows_only_length_and_initial(app_ctx):
+    user_id = make_user("bia")
+    game_id = solo_game(user_id)
+    client = login(user_id)
+    client.get(f"/game/play/{game_id}")
+
+    client.post(f"/game/extra_hint/{current_round(game_id).id}")
+    page = client.get(f"/game/play/{game_id}").get_data(as_text=True)
+
+    assert "Letras: 10" in page
+    assert "Inicial: M" in page
+    assert "Maracanazo" not in page
+
+
+
+def guess(user_id, text, answer="Maracanazo", aliases=()):
+    """Joga a primeira rodada de uma partida nova com o chute dado; devolve a rodada."""
+    game_id = solo_game(user_id, answer=answer, aliases=aliases)
+    client = login(user_id)
+    client.get(f"/game/play/{game_id}")
+    client.post(f"/game/guess/{current_round(game_id).id}", data={"guess": text})
+    return current_round(game_id)
+
+
+def test_server_accepts_typos(app_ctx):
+    r = guess(make_user("caio"), "maracanaso")
+    assert r.finished and r.user_points > 0
+
+
+def test_server_accepts_aliases(app_ctx):
+    r = guess(make_user("dani"), "Mineirazo", answer="Brasil 1 x 7 Alemanha", aliases=["Mineirazo"])
+    assert r.finished and r.user_points > 0
+
+
+def test_server_rejects_wrong_guess(app_ctx):
+    r = guess(make_user("edu"), "Pacaembu")
+    assert r.finished and not r.user_points
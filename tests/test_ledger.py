@@ -0,0 +1,58 @@
+from sqlalchemy import update
+
+from conftest import make_user, perfut
+
+
+def ledger(user_id):
+    return [
+        (row.delta, row.reason, row.balance_after)
+        for row in perfut.CoinLedger.query.filter_by(user_id=user_id).order_by(perfut.CoinLedger.id)
+    ]
+
+
+def test_debit_updates_balance_and_ledger(app_ctx):
+    user = perfut.db.session.get(perfut.User, make_user("ana", coins=100))
+
+    assert perfut.debit(user, 30, "hint") == 70
+    perfut.db.session.commit()
+
+    assert user.coins == 70
+    assert perfut.db.session.get(perfut.User, user.id).coins == 70
+    assert ledger(user.id) == [(-30, "hint", 70)]
+
+
+def test_debit_without_funds_changes_nothing(app_ctx):
+    user = perfut.db.session.get(perfut.User, make_user("bia", coins=20))
+
+    assert perfut.debit(user, 30, "hint") is None
+    perfut.db.session.commit()
+
+    assert user.coins == 20
+    assert ledger(user.id) == []
+
+
+def test_debit_checks_the_stored_balance(app_ctx):
+    user = perfut.db.session.get(perfut.User, make_user("caio", coins=100))
+    # Outro worker gasta as moedas depois que este carregou o usuário
+    perfut.db.session.execute(
+        update(perfut.User).where(perfut.User.id == user.id).values(coins=10)
+        .execution_options(synchronize_session=False)
+    )
+    assert user.coins == 100
+
+    assert perfut.debit(user, 50, "hint") is None
+    assert perfut.debit(user, 10, "hint") == 0
+    perfut.db.session.commit()
+
+    assert user.coins == 0
+    assert ledger(user.id) == [(-10, "hint", 0)]
+
+
+def test_credit_appends_to_ledger(app_ctx):
+    user = perfut.db.session.get(perfut.User, make_user("dani", coins=5))
+
+    assert perfut.credit(user, 15, "win") == 20
+    assert perfut.debit(user, 20, "hint") == 0
+    perfut.db.session.commit()
+
+    assert ledger(user.id) == [(15, "win", 20), (-20, "hint", 0)]
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+
+from conftest import login, make_user, perfut
+
+
+def enqueue(user_id, level=1):
+    entry = perfut.MatchmakingEntry(user_id=user_id, level=level)
+    perfut.db.session.add(entry)
+    perfut.db.session.commit()
+    return entry
+
+
+def drop_entry(user_id):
+    """Cancelamento em outro worker/aba: conexão própria, sem passar pela sessão nem pelo cache."""
+    with perfut.db.engine.begin() as conn:
+        conn.execute(delete(perfut.MatchmakingEntry).where(perfut.MatchmakingEntry.user_id == user_id))
+
+
+def test_two_players_are_paired_through_the_routes(app_ctx):
+    ana, bia = make_user("ana"), make_user("bia")
+    ana_client, bia_client = login(ana), login(bia)
+
+    assert ana_client.post("/duel/matchmaking").status_code == 200
+    assert ana_client.get("/duel/matchmaking/status").json["status"] == "waiting"
+
+    response = bia_client.post("/duel/matchmaking")
+    assert "/game/play/" in response.headers["Location"]
+
+    duel = perfut.Duel.query.one()
+    assert (duel.creator_id, duel.opponent_id, duel.status) == (ana, bia, "active")
+    assert perfut.MatchmakingEntry.query.count() == 0
+
+    # Quem esperava descobre o duelo pelo status
+    status = ana_client.get("/duel/matchmaking/status").json
+    assert status["status"] == "matched"
+    assert status["game_id"] == perfut.latest_duel_game(ana).id
+
+
+def test_levels_too_far_apart_wait(app_ctx):
+    enqueue(make_user("ana"), level=1)
+    entry = enqueue(make_user("bia"), level=1 + perfut.MATCH_MAX_WINDOW + 1)
+
+    assert perfut.try_match(entry) is None
+    assert perfut.MatchmakingEntry.query.count() == 2
+
+
+def test_opponent_cancel_racing_the_claim(app_ctx):
+    ana, bia = make_user("ana"), make_user("bia")
+    enqueue(ana)
+    perfut.matchmaking_cache.refresh(force=True)
+    # Ana cancela em outro worker; o cache deste ainda a tem
+    drop_entry(ana)
+
+    entry = enqueue(bia)
+    assert perfut.try_match(entry) is None
+    assert perfut.Duel.query.count() == 0
+    assert perfut.MatchmakingEntry.query.filter_by(user_id=bia).count() == 1
+
+
+def test_own_cancel_does_not_return_an_old_duel(app_ctx):
+    ana, bia, caio = make_user("ana"), make_user("bia"), make_user("caio")
+    old = perfut.Duel(creator_id=bia, opponent_id=caio, themes_json="[]", status="active", code="OLD1",
+                      created_at=datetime.utcnow() - timedelta(days=1))
+    perfut.db.session.add(old)
+    perfut.db.session.commit()
+
+    enqueue(ana)
+    entry = enqueue(bia)
+    assert entry.id  # esta requisição já leu a entrada
+    # Bia cancela em outra aba depois disso
+    drop_entry(bia)
+
+    assert perfut.try_match(entry) is None
+    assert perfut.Duel.query.count() == 1
+    assert perfut.MatchmakingEntry.query.filter_by(user_id=ana).count() == 1
@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import perfut
+
+RATE, BURST, SLOTS = perfut.RATE_LIMITS["game_guess"]
+
+
+@pytest.fixture
+def limiter(app_ctx):
+    return perfut.rate_limiter
+
+
+def free_slots(endpoint="game_guess"):
+    """Quantas vagas simultâneas estão livres (devolve as que pegou)."""
+    slot = perfut.rate_limiter.slots[endpoint]
+    taken = 0
+    while slot.acquire(blocking=False):
+        taken += 1
+    for _ in range(taken):
+        slot.release()
+    return taken
+
+
+def guess(client, forwarded_for=None):
+    headers = {"X-Forwarded-For": forwarded_for} if forwarded_for else {}
+    return client.post("/game/guess/1", data={"guess": "x"}, headers=headers)
+
+
+def test_burst_then_429(limiter):
+    client = perfut.app.test_client()
+    statuses = [guess(client).status_code for _ in range(BURST)]
+    assert 429 not in statuses
+
+    response = guess(client)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert free_slots() == SLOTS
+
+
+def test_spoofed_forwarded_for_does_not_reset_the_bucket(limiter):
+    client = perfut.app.test_client()
+    # O cliente escolhe o começo do cabeçalho; o proxy acrescenta o IP real no fim
+    statuses = [guess(client, f"198.51.100.{i}, 203.0.113.7").status_code for i in range(BURST + 1)]
+    assert statuses[-1] == 429
+
+    # Outro IP real tem o próprio balde
+    assert guess(client, "203.0.113.8").status_code != 429
+
+
+def test_concurrency_limit(limiter):
+    slot = limiter.slots["game_guess"]
+    for _ in range(SLOTS):
+        assert slot.acquire(blocking=False)
+    try:
+        assert guess(perfut.app.test_client()).status_code == 429
+    finally:
+        for _ in range(SLOTS):
+            slot.release()
+
+
+def test_slot_released_when_buckets_fail(limiter, monkeypatch):
+    def broken(key, rate, burst):
+        raise RuntimeError("store fora do ar")
+
+    monkeypatch.setattr(limiter.store, "take", broken)
+    with perfut.app.test_request_context("/game/guess/1", method="POST"):
+        with pytest.raises(RuntimeError):
+            limiter.check("game_guess", ["ip:127.0.0.1"])
+    assert free_slots() == SLOTS
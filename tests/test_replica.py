@@ -0,0 +1,98 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from conftest import REPLICA, login, make_user, perfut, replicate
+
+
+def sync_replica():
+    """Verificação (grava o heartbeat no primário) seguida da cópia: réplica em dia."""
+    perfut.replica_guard.usable()
+    replicate()
+
+
+def leaderboard(client):
+    perfut.period_cache.clear()
+    return {row["user_id"]: row["score"] for row in client.get("/api/leaderboard/day").json["rows"]}
+
+
+def test_selects_go_to_replica_only_when_flagged(app_ctx):
+    db = perfut.db
+    replica, primary = db.engines["replica"], db.engines[None]
+
+    def bind(model, clause):
+        # Como o ORM chama get_bind: com o mapper da entidade principal
+        return db.session.get_bind(mapper=model, clause=clause)
+
+    assert bind(perfut.User, select(perfut.User)) is primary
+    perfut.g.read_replica = True
+    try:
+        assert bind(perfut.User, select(perfut.User)) is replica
+        assert bind(perfut.User, update(perfut.User).values(coins=1)) is primary
+        # Tabelas de outro bind não mudam de banco
+        assert bind(perfut.DailyStat, select(perfut.DailyStat)) is db.engines["analytics"]
+    finally:
+        perfut.g.read_replica = False
+
+
+def test_read_only_route_reads_replica(app_ctx, monkeypatch):
+    monkeypatch.setattr(perfut, "REPLICA_CHECK_INTERVAL", 0)
+    user_id = make_user("ana")
+    perfut.record_daily_score(user_id, 10)
+    perfut.db.session.commit()
+    sync_replica()
+
+    perfut.record_daily_score(user_id, 5)
+    perfut.db.session.commit()
+
+    client = login(user_id)
+    assert leaderboard(client) == {user_id: 10}
+
+    replicate()
+    assert leaderboard(client) == {user_id: 15}
+
+
+def test_lagging_replica_falls_back_to_primary(app_ctx, monkeypatch):
+    monkeypatch.setattr(perfut, "REPLICA_CHECK_INTERVAL", 0)
+    user_id = make_user("bia")
+    perfut.record_daily_score(user_id, 10)
+    perfut.db.session.commit()
+    replicate()
+    perfut.record_daily_score(user_id, 5)
+    perfut.db.session.commit()
+
+    # Réplica parada há um minuto
+    old = (datetime.utcnow() - timedelta(minutes=1)).isoformat(sep=" ")
+    with sqlite3.connect(REPLICA) as conn:
+        conn.execute("UPDATE replica_heartbeat SET beat_at = ?", (old,))
+    perfut.db.engines["replica"].dispose()
+
+    assert not perfut.replica_guard.usable()
+    assert leaderboard(login(user_id)) == {user_id: 15}
+
+
+def test_broken_replica_falls_back_to_primary(app_ctx, monkeypatch):
+    monkeypatch.setattr(perfut, "REPLICA_CHECK_INTERVAL", 0)
+    user_id = make_user("caio")
+    perfut.record_daily_score(user_id, 7)
+    perfut.db.session.commit()
+    replicate()
+    perfut.db.engines["replica"].dispose()
+    with open(REPLICA, "wb") as f:
+        f.write(b"not a database")
+
+    assert not perfut.replica_guard.usable()
+    assert leaderboard(login(user_id)) == {user_id: 7}
+
+
+def test_user_loaded_from_primary_on_read_only_route(app_ctx, monkeypatch):
+    monkeypatch.setattr(perfut, "REPLICA_CHECK_INTERVAL", 0)
+    make_user("dani")
+    sync_replica()
+    assert perfut.replica_guard.usable()
+
+    # Cadastro que ainda não chegou na réplica
+    newcomer_id = make_user("edu")
+    response = login(newcomer_id).get("/profile")
+    assert response.status_code == 200
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from conftest import make_user, perfut
+
+
+def legacy_quiz_scores(rows):
+    """quiz_scores como era antes de user_id ser único, com as linhas dadas."""
+    db = perfut.db
+    db.session.execute(text("DROP TABLE quiz_scores"))
+    db.session.execute(text(
+        "CREATE TABLE quiz_scores (id INTEGER PRIMARY KEY, score INTEGER NOT NULL, "
+        "user_id INTEGER NOT NULL REFERENCES users (id), played_at DATETIME NOT NULL)"
+    ))
+    for user_id, score, played_at in rows:
+        db.session.execute(text("INSERT INTO quiz_scores (score, user_id, played_at) VALUES (:s, :u, :p)"),
+                           {"s": score, "u": user_id, "p": played_at})
+    db.session.commit()
+
+
+def upgrade_db():
+    result = perfut.app.test_cli_runner().invoke(args=["upgrade-db"])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_upgrade_db_dedupes_quiz_scores_and_adds_unique_index(app_ctx):
+    ana, bia = make_user("ana"), make_user("bia")
+    legacy_quiz_scores([
+        (ana, 10, datetime(2026, 1, 1)),
+        (ana, 5, datetime(2026, 1, 3)),
+        (bia, 7, datetime(2026, 1, 2)),
+    ])
+    assert not perfut.quiz_scores_unique()
+
+    assert "1 usuários com pontuação de quiz duplicada" in upgrade_db()
+    assert perfut.quiz_scores_unique()
+    rows = {s.user_id: (s.score, s.played_at) for s in perfut.QuizScore.query}
+    assert rows == {ana: (15, datetime(2026, 1, 3)), bia: (7, datetime(2026, 1, 2))}
+
+    # O upsert do fim do quiz passa a funcionar
+    perfut.upsert(perfut.QuizScore, {"user_id": ana, "score": 3, "played_at": datetime(2026, 1, 4)},
+                  key=("user_id",), increment=("score",), replace=("played_at",))
+    perfut.db.session.commit()
+    assert perfut.QuizScore.query.filter_by(user_id=ana).one().score == 18
+
+    # Rodar de novo não muda nada
+    assert "0 usuários com pontuação de quiz duplicada" in upgrade_db()
+
+
+def test_fresh_schema_needs_no_quiz_index(app_ctx):
+    assert perfut.quiz_scores_unique()
+    assert perfut.dedupe_quiz_scores() == 0
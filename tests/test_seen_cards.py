@@ -0,0 +1,81 @@
+import json
+
+from conftest import make_user, perfut
+
+
+def setup_theme(n):
+    """n cartas de estádio e uma partida solo de n rodadas; devolve (jogo, ids das cartas)."""
+    db = perfut.db
+    cards = [perfut.Card(theme="estadio", title=f"c{i}", answer=f"Estádio {i}", hints_json=json.dumps(["d"]),
+                         difficulty=1) for i in range(n)]
+    game = perfut.Game(user_id=make_user("ana"), themes_json=json.dumps(["estadio"]), rounds_count=n)
+    db.session.add_all([*cards, game])
+    db.session.commit()
+    return game, [c.id for c in cards]
+
+
+def new_game(user_id, rounds):
+    game = perfut.Game(user_id=user_id, themes_json=json.dumps(["estadio"]), rounds_count=rounds)
+    perfut.db.session.add(game)
+    perfut.db.session.commit()
+    return game
+
+
+def seen(user_id):
+    return perfut.load_seen_filter(user_id, "estadio")
+
+
+def test_filter_remembers_added_cards():
+    f = perfut.SeenFilter()
+    for card_id in range(1, 50):
+        f.add(card_id)
+    assert all(card_id in f for card_id in range(1, 50))
+    assert f.count == 49
+
+    # Sobrevive à ida e volta pelos bytes gravados
+    copy = perfut.SeenFilter(bytes(f.bits), f.count)
+    assert 7 in copy and copy.count == 49
+
+    f.clear()
+    assert 7 not in f and f.count == 0
+
+
+def test_open_round_skips_cards_seen_in_earlier_games(app_ctx):
+    game, card_ids = setup_theme(4)
+    first = [perfut.open_round(game, n).card_id for n in (1, 2)]
+    perfut.db.session.commit()
+    assert all(card_id in seen(game.user_id) for card_id in first)
+
+    # Partida nova: as duas cartas restantes saem antes das já vistas
+    later = new_game(game.user_id, 2)
+    second = [perfut.open_round(later, n).card_id for n in (1, 2)]
+    assert sorted(first + second) == sorted(card_ids)
+
+
+def test_open_round_restarts_filter_when_theme_is_exhausted(app_ctx):
+    game, card_ids = setup_theme(2)
+    for n in (1, 2):
+        perfut.open_round(game, n)
+    perfut.db.session.commit()
+    assert seen(game.user_id).count == 2
+
+    # Todas já vistas: o sorteio volta a usar o tema inteiro e o filtro recomeça
+    r = perfut.open_round(new_game(game.user_id, 1), 1)
+    perfut.db.session.commit()
+    assert r.card_id in card_ids
+    assert seen(game.user_id).count == 1
+
+
+def test_store_resets_saturated_filter(app_ctx, monkeypatch):
+    monkeypatch.setattr(perfut, "SEEN_FILTER_CAPACITY", 3)
+    user_id = make_user("ana")
+    for card_id in (1, 2, 3):
+        perfut.store_seen_card(user_id, "estadio", card_id)
+    perfut.db.session.commit()
+    assert seen(user_id).count == 3
+
+    perfut.store_seen_card(user_id, "estadio", 4)
+    perfut.db.session.commit()
+    f = seen(user_id)
+    assert f.count == 1
+    assert 4 in f and 1 not in f
@@ -0,0 +1,62 @@
+import json
+
+from sqlalchemy import update
+
+from conftest import make_user, perfut
+
+
+def setup_rounds(results):
+    """Partida com uma rodada por item de results: (pontos, dicas) ou None para aberta."""
+    db = perfut.db
+    user_id = make_user("ana")
+    card = perfut.Card(theme="estadio", title="t", answer="Maracanã", hints_json=json.dumps(["d"]), difficulty=1)
+    game = perfut.Game(user_id=user_id, themes_json=json.dumps(["estadio"]), rounds_count=len(results))
+    db.session.add_all([card, game])
+    db.session.flush()
+    rounds = []
+    for number, result in enumerate(results, 1):
+        points, hints = result or (0, 0)
+        rounds.append(perfut.Round(game_id=game.id, number=number, card_id=card.id, finished=result is not None,
+                                   user_points=points, requested_hints=hints))
+    db.session.add_all(rounds)
+    db.session.commit()
+    return user_id, [r.id for r in rounds]
+
+
+def stats(user_id):
+    s = perfut.db.session.get(perfut.UserThemeStat, (user_id, "estadio"))
+    perfut.db.session.refresh(s)
+    return s.rounds, s.solves, s.hints_total, s.points_total
+
+
+def test_backfill_aggregates_finished_rounds(app_ctx):
+    user_id, _ = setup_rounds([(90, 2), (0, 3), None, (70, 4)])
+
+    assert perfut.backfill_theme_stats(chunk_size=2) == 3
+    assert stats(user_id) == (3, 2, 9, 160)
+
+
+def test_round_finishing_during_backfill_counts_once(app_ctx, monkeypatch):
+    user_id, (_, open_id) = setup_rounds([(90, 2), None])
+    real_upsert = perfut.upsert
+    fired = []
+
+    def upsert_after_live_finish(*args, **kwargs):
+        if not fired:
+            fired.append(True)
+            # Outro worker encerra a rodada aberta enquanto o backfill roda
+            with perfut.db.engine.begin() as conn:
+                conn.execute(update(perfut.Round).where(perfut.Round.id == open_id)
+                             .values(finished=True, user_points=50, requested_hints=1))
+                real_upsert(perfut.UserThemeStat,
+                            {"user_id": user_id, "theme": "estadio", "rounds": 1, "solves": 1,
+                             "hints_total": 1, "points_total": 50},
+                            key=("user_id", "theme"),
+                            increment=("rounds", "solves", "hints_total", "points_total"), connection=conn)
+        return real_upsert(*args, **kwargs)
+
+    monkeypatch.setattr(perfut, "upsert", upsert_after_live_finish)
+    perfut.backfill_theme_stats(chunk_size=1)
+
+    assert fired
+    assert stats(user_id) == (2, 2, 3, 140)
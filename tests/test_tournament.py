@@ -0,0 +1,94 @@
+import json
+
+from sqlalchemy import update
+
+from conftest import make_user, perfut
+
+
+def setup_tournament(levels, format="single"):
+    """Torneio com um inscrito por nível dado (maior nível = cabeça de chave 1)."""
+    db = perfut.db
+    db.session.add(perfut.Card(theme="estadio", title="t", answer="Maracanã",
+                               hints_json=json.dumps(["d"]), difficulty=1))
+    users = []
+    for i, level in enumerate(levels):
+        user_id = make_user(f"jogador{i}")
+        db.session.get(perfut.User, user_id).level = level
+        users.append(user_id)
+    t = perfut.Tournament(name="Copa", format=format, themes_json=json.dumps(["estadio"]))
+    db.session.add(t)
+    db.session.flush()
+    db.session.add_all(perfut.TournamentPlayer(tournament_id=t.id, user_id=u) for u in users)
+    db.session.commit()
+    return t, users
+
+
+def stage_matches(t):
+    return perfut.TournamentMatch.query.filter_by(tournament_id=t.id, stage=t.stage).order_by("slot").all()
+
+
+def score(user_id, points):
+    """Placar do jogo ativo de torneio do usuário."""
+    perfut.db.session.execute(
+        update(perfut.Game)
+        .where(perfut.Game.user_id == user_id, perfut.Game.mode == "tournament", perfut.Game.status == "active")
+        .values(user_score=points)
+    )
+
+
+def test_first_stage_pairs_everyone_with_a_bye(app_ctx):
+    # Níveis decrescentes: o jogador i é a semente i + 1
+    t, users = setup_tournament([50, 40, 30, 20, 10])
+    assert perfut.start_tournament(t)
+    assert (t.status, t.stage, t.total_stages) == ("running", 1, 3)
+
+    matches = stage_matches(t)
+    seen = [u for m in matches for u in (m.player_a_id, m.player_b_id) if u is not None]
+    assert sorted(seen) == sorted(users)
+
+    # Chave de 8: 1x8, 4x5, 2x7, 3x6; sementes 6 a 8 não existem e viram folga
+    pairs = [(m.player_a_id, m.player_b_id) for m in matches]
+    assert pairs == [(users[0], None), (users[3], users[4]), (users[1], None), (users[2], None)]
+    for m in matches:
+        if m.player_b_id is None:
+            assert m.winner_id == m.player_a_id and m.game_a_id is None
+        else:
+            assert m.winner_id is None and len(json.loads(m.deck_json)) == t.rounds_per_match
+
+
+def test_start_needs_two_players(app_ctx):
+    t, _ = setup_tournament([10])
+    assert not perfut.start_tournament(t)
+    assert t.status == "open"
+
+
+def test_winners_advance_until_the_final(app_ctx):
+    t, (s1, s2, s3, s4) = setup_tournament([40, 30, 20, 10])
+    perfut.start_tournament(t)
+    assert [(m.player_a_id, m.player_b_id) for m in stage_matches(t)] == [(s1, s4), (s2, s3)]
+
+    # Zebras: as sementes 4 e 3 vencem na primeira fase
+    score(s4, 300)
+    score(s3, 200)
+    perfut.advance_tournament(t)
+    assert t.stage == 2
+    alive = {p.user_id for p in perfut.TournamentPlayer.query.filter_by(tournament_id=t.id, alive=True)}
+    assert alive == {s3, s4}
+    assert [(m.player_a_id, m.player_b_id) for m in stage_matches(t)] == [(s4, s3)]
+
+    # Empate favorece o jogador_a da partida
+    perfut.advance_tournament(t)
+    assert (t.status, t.winner_id) == ("finished", s4)
+    assert perfut.Game.query.filter_by(mode="tournament", status="active").count() == 0
+
+
+def test_swiss_avoids_rematches(app_ctx):
+    t, users = setup_tournament([40, 30, 20, 10], format="swiss")
+    perfut.start_tournament(t)
+    first = {frozenset((m.player_a_id, m.player_b_id)) for m in stage_matches(t)}
+
+    perfut.advance_tournament(t)
+    second = {frozenset((m.player_a_id, m.player_b_id)) for m in stage_matches(t)}
+    assert t.stage == 2
+    assert not first & second
+    assert set().union(*second) == set(users)
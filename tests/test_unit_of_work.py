@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import login, make_user, perfut
+
+calls = []
+
+
+def spend_then(outcome):
+    """Rota de teste: altera o usuário, agenda um after_commit e termina como pedido."""
+    user = perfut.current_user()
+    user.coins -= 10
+    perfut.after_commit(lambda: calls.append(user.id))
+    if outcome == "raise":
+        raise RuntimeError("falha na rota")
+    if outcome == "error":
+        return "erro", 400
+    return "ok"
+
+
+@pytest.fixture
+def uow_client(app_ctx, monkeypatch):
+    app = perfut.app
+    if "uow_test" not in app.view_functions:
+        # Registrar rota depois da primeira requisição exige desligar a checagem do Flask
+        monkeypatch.setattr(app, "_got_first_request", False)
+        app.add_url_rule("/_test/uow/<outcome>", "uow_test", spend_then)
+    calls.clear()
+    user_id = make_user("ana", coins=100)
+    return user_id, login(user_id)
+
+
+def coins(user_id):
+    perfut.db.session.expire_all()
+    return perfut.db.session.get(perfut.User, user_id).coins
+
+
+def test_success_commits_and_runs_callbacks(uow_client):
+    user_id, client = uow_client
+    assert client.get("/_test/uow/ok").status_code == 200
+    assert coins(user_id) == 90
+    assert calls == [user_id]
+
+
+def test_error_response_rolls_back(uow_client):
+    user_id, client = uow_client
+    assert client.get("/_test/uow/error").status_code == 400
+    assert coins(user_id) == 100
+    assert calls == []
+
+
+def test_exception_rolls_back(uow_client, monkeypatch):
+    user_id, client = uow_client
+    monkeypatch.setitem(perfut.app.config, "PROPAGATE_EXCEPTIONS", False)
+    assert client.get("/_test/uow/raise").status_code == 500
+    assert coins(user_id) == 100
+    assert calls == []
+
+
+def test_manual_commit_routes_are_left_alone(uow_client, monkeypatch):
+    user_id, client = uow_client
+    monkeypatch.setattr(spend_then, "manual_commit", True, raising=False)
+    assert client.get("/_test/uow/ok").status_code == 200
+    assert coins(user_id) == 100
+    assert calls == []
@@ -0,0 +1,56 @@
+from datetime import date, datetime
+
+import pytest
+
+from conftest import make_user, perfut
+
+
+def scores():
+    return {(row.user_id, row.day): row.score for row in perfut.UserDailyScore.query}
+
+
+def add_score(user_id, day, score):
+    perfut.upsert(perfut.UserDailyScore, {"user_id": user_id, "day": day, "score": score},
+                  key=("user_id", "day"), increment=("score",))
+
+
+@pytest.fixture(params=["native", "fallback"])
+def dialect(request, app_ctx, monkeypatch):
+    """Roda cada teste com ON CONFLICT e com o caminho UPDATE + INSERT."""
+    if request.param == "fallback":
+        monkeypatch.setattr(perfut.db.engine.dialect, "name", "other")
+    return request.param
+
+
+def test_upsert_inserts_then_increments(dialect):
+    ana, bia = make_user("ana"), make_user("bia")
+    today = date(2026, 5, 1)
+
+    add_score(ana, today, 10)
+    add_score(bia, today, 3)
+    add_score(ana, today, 5)
+    add_score(ana, date(2026, 5, 2), 7)
+    perfut.db.session.commit()
+
+    assert scores() == {(ana, today): 15, (bia, today): 3, (ana, date(2026, 5, 2)): 7}
+
+
+def test_upsert_replaces_columns(dialect):
+    first, second = datetime(2026, 5, 1, 12, 0), datetime(2026, 5, 1, 12, 5)
+    for beat in (first, second):
+        perfut.upsert(perfut.ReplicaHeartbeat, {"id": 1, "beat_at": beat}, key=("id",), replace=("beat_at",))
+        perfut.db.session.commit()
+
+    rows = perfut.ReplicaHeartbeat.query.all()
+    assert [(row.id, row.beat_at) for row in rows] == [(1, second)]
+
+
+def test_upsert_on_explicit_connection(app_ctx):
+    ana = make_user("ana")
+    today = date(2026, 5, 1)
+    with perfut.db.engine.begin() as conn:
+        for score in (4, 6):
+            perfut.upsert(perfut.UserDailyScore, {"user_id": ana, "day": today, "score": score},
+                          key=("user_id", "day"), increment=("score",), connection=conn)
+
+    assert scores() == {(ana, today): 10}
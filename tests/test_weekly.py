@@ -0,0 +1,84 @@
+import json
+from datetime import date
+
+import pytest
+
+from conftest import login, make_user, perfut
+
+
+def weekly_setup():
+    """Evento ativo e uma carta por tema; devolve o id do evento."""
+    db = perfut.db
+    event = perfut.WeeklyEvent(name="Semana", start_date=date(2020, 1, 1), end_date=date(2099, 1, 1), is_active=True)
+    db.session.add(event)
+    for theme, _ in perfut.THEMES:
+        db.session.add(perfut.Card(theme=theme, title=theme, answer=f"Resposta {theme}",
+                                   hints_json=json.dumps(["dica"]), difficulty=1))
+    db.session.commit()
+    return event.id
+
+
+def start_weekly(client):
+    response = client.get("/weekly_event/start")
+    return int(response.headers["Location"].rsplit("/", 1)[-1])
+
+
+def play_round(client, game_id, correct):
+    """Abre a rodada atual e chuta; devolve a rodada."""
+    client.get(f"/game/play/{game_id}")
+    r = perfut.Round.query.filter_by(game_id=game_id).order_by(perfut.Round.number.desc()).first()
+    client.post(f"/game/guess/{r.id}", data={"guess": r.card.answer if correct else "nada a ver"})
+    return r
+
+
+def weekly_score(event_id, user_id):
+    return perfut.WeeklyScore.query.filter_by(event_id=event_id, player_id=user_id).one().score
+
+
+def test_weekly_rounds_feed_score_and_board(app_ctx):
+    event_id = weekly_setup()
+    ana, bia = make_user("ana"), make_user("bia")
+    ana_client, bia_client = login(ana), login(bia)
+    ana_game, bia_game = start_weekly(ana_client), start_weekly(bia_client)
+
+    play_round(bia_client, bia_game, correct=True)
+    # Monta o ranking em memória antes dos próximos pontos
+    assert bia_client.get("/api/rank/weekly").json["position"] == 1
+    assert ana_client.get("/api/rank/weekly").json["position"] is None
+
+    first = play_round(ana_client, ana_game, correct=True)
+    second = play_round(ana_client, ana_game, correct=True)
+    play_round(ana_client, ana_game, correct=False)
+
+    points = first.user_points + second.user_points
+    assert weekly_score(event_id, ana) == points
+    rank = ana_client.get("/api/rank/weekly").json
+    assert (rank["position"], rank["score"]) == (1, points)
+
+
+def test_same_deck_for_everyone_on_the_same_day(app_ctx, monkeypatch):
+    weekly_setup()
+    decks = []
+    for name in ("ana", "bia", "caio"):
+        client = login(make_user(name))
+        game_id = start_weekly(client)
+        decks.append([play_round(client, game_id, correct=False).card_id for _ in range(len(perfut.THEMES))])
+        if len(decks) == 1:
+            # Depois da primeira partida, baralho e evento vêm só do cache
+            monkeypatch.setattr(perfut, "build_weekly_deck", lambda *a, **k: pytest.fail("baralho sorteado de novo"))
+
+    assert decks[0] == decks[1] == decks[2]
+    assert len(set(decks[0])) == len(perfut.THEMES)
+    assert perfut.WeeklyDeck.query.count() == 1
+
+
+def test_weekly_rounds_read_the_event_once_per_game(app_ctx, monkeypatch):
+    weekly_setup()
+    client = login(make_user("ana"))
+    game_id = start_weekly(client)
+    play_round(client, game_id, correct=True)
+
+    monkeypatch.setattr(perfut, "weekly_event_for_game", lambda g: pytest.fail("evento lido do banco de novo"))
+    for _ in range(3):
+        play_round(client, game_id, correct=True)
+    assert perfut.Round.query.filter_by(game_id=game_id).count() == 4